@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# run_benchmarks.py
+# End-to-end benchmarks of graph extraction, serialization and loading.
+#
+# Synthetic DBLP, TPC-H and IMDB-style databases (the schemas of the
+# examples/ queries) are generated at the requested scale factors in a local
+# PostgreSQL database, and every phase of getting a graph out of them is
+# timed: JVM launch, SQL evaluation, serialization to each GraphGenerator
+# format, end-to-end extraction with each engine, loading the files back
+# into Python and running analytics on the result.
+#
+# Each phase runs in a forked process, so its peak RSS is its own (plus the
+# memory inherited from this process, reported as baseline_rss) and the peak
+# RSS of the JVM it launched is reported separately as child_peak_rss.
+# Results are written as JSON; pass an earlier result file to --compare to
+# report the phases that got slower or bigger.
+#
+# Usage:
+#
+#   python benchmarks/run_benchmarks.py --user postgres --password secret \
+#       --scales 1 4 --output results.json
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import psycopg2
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from graphgenpy import GraphGenerator, analytics, csr, condensed, readers, utils, writers
+from graphgenpy.engine import DatalogEngine
+
+##########################################################################
+## Schemas
+##########################################################################
+
+# Every schema has its DDL, the statements that fill it at scale factor
+# ``sf`` (rows grow linearly with it) and the extraction query of its
+# example, with filters scaled so that the graph grows linearly as well.
+# The data is generated with a fixed seed, so that runs are comparable.
+
+SCHEMAS = {
+    'dblp': {
+        'tables': ('authorpublication', 'publication', 'conference', 'author'),
+        'ddl': (
+            "CREATE TABLE author (id integer NOT NULL PRIMARY KEY, name character varying(1024))",
+            "CREATE TABLE conference (id integer NOT NULL PRIMARY KEY, name character varying(1024), year integer, location character varying(1024))",
+            "CREATE TABLE publication (id integer NOT NULL PRIMARY KEY, title character varying(2048), cid integer NOT NULL)",
+            "CREATE TABLE authorpublication (aid integer NOT NULL, pid integer NOT NULL, PRIMARY KEY(aid, pid))",
+        ),
+        'data': (
+            "INSERT INTO author SELECT i, 'Author ' || i FROM generate_series(1, 10000 * %(sf)d) i",
+            "INSERT INTO conference SELECT i, 'Conference ' || (i %% 20), 2000 + i %% 20, 'City ' || i FROM generate_series(1, 200 * %(sf)d) i",
+            "INSERT INTO publication SELECT i, 'Title ' || i, 1 + floor(random() * 200 * %(sf)d) FROM generate_series(1, 20000 * %(sf)d) i",
+            # About three authors per publication
+            "INSERT INTO authorpublication SELECT DISTINCT 1 + floor(random() * 10000 * %(sf)d), p.id "
+            "FROM publication p, generate_series(1, 3)",
+        ),
+        'query': """
+Nodes(ID, Name) :- Author(ID, Name).
+Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+""",
+    },
+    'tpch': {
+        'tables': ('lineitem', 'orders', 'customer'),
+        'ddl': (
+            "CREATE TABLE customer (c_custkey integer NOT NULL PRIMARY KEY, c_name character varying(25))",
+            "CREATE TABLE orders (o_orderkey integer NOT NULL PRIMARY KEY, o_custkey integer NOT NULL)",
+            "CREATE TABLE lineitem (l_orderkey integer NOT NULL, l_partkey integer NOT NULL, l_linenumber integer NOT NULL, PRIMARY KEY(l_orderkey, l_linenumber))",
+        ),
+        'data': (
+            "INSERT INTO customer SELECT i, 'Customer#' || lpad(i::text, 9, '0') FROM generate_series(1, 1500 * %(sf)d) i",
+            "INSERT INTO orders SELECT i, 1 + floor(random() * 1500 * %(sf)d) FROM generate_series(1, 15000 * %(sf)d) i",
+            "INSERT INTO lineitem SELECT o.o_orderkey, 1 + floor(random() * 10000 * %(sf)d), l "
+            "FROM orders o, generate_series(1, 4) l",
+        ),
+        'query': """
+Nodes(ID, Name) :- Customer(ID, Name).
+Edges(ID1, ID2) :- Orders(orderId1, ID1),Lineitem(orderId1,part,_),Orders(orderId2, ID2),Lineitem(orderId2,part,_),part < %(parts)d.
+""",
+        'params': lambda sf: {'parts': 1000 * sf},
+    },
+    'imdb': {
+        'tables': ('cast_info', 'name'),
+        'ddl': (
+            "CREATE TABLE name (id integer NOT NULL PRIMARY KEY, name character varying(1024))",
+            "CREATE TABLE cast_info (id integer NOT NULL PRIMARY KEY, person_id integer NOT NULL, movie_id integer NOT NULL, "
+            "person_role_id integer, note character varying(1024), nr_order integer, role_id integer NOT NULL)",
+        ),
+        'data': (
+            "INSERT INTO name SELECT i, 'Person ' || i FROM generate_series(1, 5000 * %(sf)d) i",
+            "INSERT INTO cast_info SELECT i, 1 + floor(random() * 5000 * %(sf)d), 1 + floor(random() * 2000 * %(sf)d), "
+            "NULL, NULL, i %% 10, 1 + floor(random() * 4) FROM generate_series(1, 100000 * %(sf)d) i",
+        ),
+        'query': """
+Nodes(id,name):- name(id,name),cast_info(_,id,movie_id,_,_,_,role),movie_id <=%(movies)d,role='1'.
+Edges(id1,id2):- cast_info(_,id1,movie_id,_,_,_,role),cast_info(_,id2,movie_id,_,_,_,role), role='1',movie_id<= %(movies)d.
+""",
+        'params': lambda sf: {'movies': 200 * sf},
+    },
+}
+
+FORMATS = (GraphGenerator.GML, GraphGenerator.GraphSON, GraphGenerator.CSR)
+
+##########################################################################
+## Database setup
+##########################################################################
+
+def connect(args, dbname=None):
+    params = {'dbname': dbname or args.dbname, 'host': args.host, 'port': args.port,
+              'user': args.user, 'password': args.password}
+    return psycopg2.connect(**dict((k, v) for k, v in params.items() if v))
+
+def create_database(args):
+    """
+    Creates the benchmark database unless it exists.
+    """
+    conn = connect(args, 'postgres')
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (args.dbname,))
+    if cursor.fetchone() is None:
+        cursor.execute('CREATE DATABASE "%s"' % args.dbname)
+    conn.close()
+
+def load_schema(conn, name, sf):
+    """
+    (Re)creates the tables of a schema at scale factor ``sf`` and returns
+    their row counts.
+    """
+    schema = SCHEMAS[name]
+    cursor = conn.cursor()
+    cursor.execute("SELECT setseed(0.5)")
+    for table in schema['tables']:
+        cursor.execute("DROP TABLE IF EXISTS %s" % table)
+    for stmt in schema['ddl']:
+        cursor.execute(stmt)
+    for stmt in schema['data']:
+        cursor.execute(stmt % {'sf': sf})
+    rows = {}
+    for table in schema['tables']:
+        cursor.execute("ANALYZE %s" % table)
+        cursor.execute("SELECT count(*) FROM %s" % table)
+        rows[table] = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return rows
+
+def query_for(name, sf):
+    schema = SCHEMAS[name]
+    params = schema['params'](sf) if 'params' in schema else {}
+    return schema['query'] % params if params else schema['query']
+
+##########################################################################
+## Measurement
+##########################################################################
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+# Phases need a fresh process each to have their own peak RSS, and run
+# closures, so they are always forked
+_fork = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children
+
+def _run_phase(fn, args, pipe):
+    # stdout carries the JSON results: send whatever the phase prints
+    # (GraphGenerator messages, JVM output) to stderr
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    own, children = _usage()
+    result = {'baseline_rss': own.ru_maxrss * _rss_unit}
+    start = time.time()
+    try:
+        info = fn(*args)
+    except Exception as e:
+        info = {'error': '%s: %s' % (type(e).__name__, e)}
+    result['wall'] = time.time() - start
+    end_own, end_children = _usage()
+    result['cpu'] = (end_own.ru_utime + end_own.ru_stime - own.ru_utime - own.ru_stime)
+    result['child_cpu'] = (end_children.ru_utime + end_children.ru_stime
+                           - children.ru_utime - children.ru_stime)
+    result['peak_rss'] = end_own.ru_maxrss * _rss_unit
+    result['child_peak_rss'] = end_children.ru_maxrss * _rss_unit
+    result.update(info or {})
+    pipe.send(result)
+    pipe.close()
+
+def measure(name, fn, *args):
+    """
+    Runs ``fn(*args)`` in a forked process and returns its measurements:
+    wall and CPU seconds, peak RSS in bytes, those of the processes it
+    waited for (the JVM), and whatever dict ``fn`` returned, e.g. the
+    bytes it wrote. An exception is recorded in ``error``.
+    """
+    receiver, sender = _fork.Pipe(False)
+    p = _fork.Process(target=_run_phase, args=(fn, args, sender))
+    p.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': 'phase process died'}
+    p.join()
+    if p.exitcode:
+        result.setdefault('error', 'phase process exited with code %d' % p.exitcode)
+    result['name'] = name
+    return result
+
+def skipped(name, reason):
+    return {'name': name, 'skipped': reason}
+
+def disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+##########################################################################
+## Phases
+##########################################################################
+
+def jvm_launch():
+    # Starting a JVM on the GraphGen classpath and exiting right away
+    from graphgenpy.graphgenpy import _jar
+    utils.java(['-version'], classpath=_jar, stdout='pipe', stderr='pipe')
+
+def sql_evaluation(gg, query, path):
+    conn = gg.connect()
+    try:
+        graph = DatalogEngine(conn).extract(query)
+    finally:
+        conn.close()
+    # Kept for the serialization and analytics phases; saving is not timed
+    # separately from the evaluation as it is a plain array dump
+    csr.save_csr(graph, path)
+    return {'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges()}
+
+def _graph_records(graph, chunksize=10000):
+    ids = np.asarray(graph.ids)
+    nodes = iter(zip(ids.tolist(), graph.attrs.dicts()))
+    for start in range(0, len(ids), chunksize):
+        yield [readers.Node(id, values) for id, values in itertools.islice(nodes, chunksize)]
+    sources = np.repeat(ids, np.diff(graph.offsets))
+    targets = ids[np.asarray(graph.neighbors)]
+    for start in range(0, len(sources), chunksize):
+        yield [readers.Edge(s, t, {}) for s, t in zip(sources[start:start + chunksize].tolist(),
+                                                     targets[start:start + chunksize].tolist())]
+
+def serialize(source, fmt, path):
+    graph = csr.load_csr(source, mmap=False)
+    if fmt == GraphGenerator.CSR:
+        csr.save_csr(graph, path)
+    else:
+        writers.write_records(_graph_records(graph), path, fmt)
+    return {'bytes': disk_size(path)}
+
+def generate(gg, query, base, fmt, engine, heap):
+    result = gg.generateGraph(query, base, fmt, engine=engine, condensed=(fmt == 'condensed'), heap=heap)
+    # The phases generateGraph breaks the extraction into
+    return {'bytes': disk_size(result), 'extraction': result.stats.as_dict()}
+
+def load(path, fmt):
+    if fmt == GraphGenerator.CSR:
+        graph = csr.load_csr(path, mmap=False)
+    elif fmt == 'condensed':
+        graph = condensed.load_condensed(path, mmap=False)
+        return {'nodes': graph.number_of_nodes(), 'links': graph.number_of_links()}
+    else:
+        graph = readers.read_graph(path, fmt)
+    return {'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges()}
+
+def load_networkx(path):
+    import networkx as nx
+    G = nx.read_gml(path, label='id')
+    return {'nodes': G.number_of_nodes(), 'edges': G.number_of_edges()}
+
+def run_analytics(path, algorithm):
+    graph = csr.load_csr(path)
+    if algorithm == 'bfs':
+        if graph.number_of_nodes():
+            analytics.bfs(graph, graph.ids[0], directed=False)
+    else:
+        getattr(analytics, algorithm)(graph)
+
+ANALYTICS = ('degree', 'pagerank', 'connected_components', 'bfs', 'triangles', 'label_propagation')
+
+##########################################################################
+## Runs
+##########################################################################
+
+def java_status():
+    """
+    Returns None if GraphGen's JVM can be run, or why not.
+    """
+    from graphgenpy.graphgenpy import _jar
+    if not os.path.exists(_jar):
+        return 'GraphGen jar not found at %s' % _jar
+    try:
+        if utils._java_bin is None:
+            utils.config_java(options=['-Xmx10G'], verbose=False)
+    except LookupError as e:
+        return str(e).strip().splitlines()[0] if str(e).strip() else 'java not found'
+    return None
+
+def benchmark(args, gg, name, sf, workdir, java):
+    """
+    Loads one schema at one scale factor and measures every phase on it.
+    """
+    conn = connect(args)
+    start = time.time()
+    try:
+        rows = load_schema(conn, name, sf)
+    finally:
+        conn.close()
+    run = {'schema': name, 'scale': sf, 'rows': rows, 'load_seconds': time.time() - start,
+           'phases': []}
+    phases = run['phases']
+    query = query_for(name, sf)
+    base = os.path.join(workdir, '%s-%d' % (name, sf))
+
+    def record(result):
+        phases.append(result)
+        if args.verbose:
+            print('  %-32s %s' % (result['name'], _summary(result)), file=sys.stderr)
+        return result
+
+    def phase(label, fn, *fargs):
+        return record(measure(label, fn, *fargs))
+
+    if java is None:
+        phase('jvm_launch', jvm_launch)
+    else:
+        record(skipped('jvm_launch', java))
+
+    sql = phase('sql', sql_evaluation, gg, query, base + '-sql.csr')
+    run['graph'] = dict((k, sql[k]) for k in ('nodes', 'edges') if k in sql)
+
+    for fmt in FORMATS:
+        phase('serialize.%s' % fmt, serialize, base + '-sql.csr', fmt, '%s-serialized.%s' % (base, fmt))
+
+    for engine in args.engines:
+        formats = FORMATS + ('condensed',) if engine == 'sql' else FORMATS
+        for fmt in formats:
+            label = 'generate.%s.%s' % (engine, fmt)
+            if engine == 'java' and java is not None:
+                record(skipped(label, java))
+                continue
+            phase(label, generate, gg, query, '%s-%s' % (base, engine), fmt, engine, args.heap)
+
+    # Load what the first engine wrote
+    written = '%s-%s' % (base, args.engines[0])
+    for fmt in FORMATS + ('condensed',):
+        path = '%s.%s' % (written, fmt)
+        if os.path.exists(path):
+            phase('load.%s' % fmt, load, path, fmt)
+    gml = written + '.' + GraphGenerator.GML
+    if os.path.exists(gml):
+        try:
+            import networkx
+            phase('load.networkx', load_networkx, gml)
+        except ImportError:
+            record(skipped('load.networkx', 'networkx is not installed'))
+
+    for algorithm in ANALYTICS:
+        label = 'analytics.%s' % algorithm
+        if algorithm == 'triangles':
+            try:
+                import scipy
+            except ImportError:
+                record(skipped(label, 'scipy is not installed'))
+                continue
+        phase(label, run_analytics, base + '-sql.csr', algorithm)
+    return run
+
+def _summary(result):
+    if 'skipped' in result:
+        return 'skipped: ' + result['skipped']
+    text = '%8.3fs %8.1f MiB' % (result['wall'], max(result['peak_rss'], result['child_peak_rss']) / 2.0 ** 20)
+    if 'error' in result:
+        text += '  ERROR ' + result['error']
+    return text
+
+def environment(args):
+    conn = connect(args)
+    cursor = conn.cursor()
+    cursor.execute("SHOW server_version")
+    server = cursor.fetchone()[0]
+    conn.close()
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'timestamp': datetime.datetime.utcnow().isoformat() + 'Z', 'revision': revision,
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(), 'postgres': server, 'numpy': np.__version__}
+
+##########################################################################
+## Comparison
+##########################################################################
+
+def compare(baseline, results, threshold, min_wall=0.1):
+    """
+    Prints the wall time and peak RSS ratio of every phase present in
+    both result files and returns the phases whose ratio exceeds
+    ``threshold``. Wall times under ``min_wall`` seconds are too noisy to
+    flag.
+    """
+    def index(data):
+        return dict(((run['schema'], run['scale'], p['name']), p)
+                    for run in data['runs'] for p in run['phases'] if 'wall' in p and 'error' not in p)
+
+    old, new = index(baseline), index(results)
+    regressions = []
+    print('%-8s %5s %-32s %10s %10s' % ('schema', 'scale', 'phase', 'wall', 'peak rss'))
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        wall = b['wall'] / a['wall'] if a['wall'] else 1.0
+        rss_a = max(a['peak_rss'], a['child_peak_rss'])
+        rss = max(b['peak_rss'], b['child_peak_rss']) / float(rss_a) if rss_a else 1.0
+        slower = wall > threshold and b['wall'] >= min_wall
+        flag = ' <<' if slower or rss > threshold else ''
+        print('%-8s %5d %-32s %9.2fx %9.2fx%s' % (key + (wall, rss, flag)))
+        if flag:
+            regressions.append(key)
+    return regressions
+
+##########################################################################
+## Main
+##########################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark GraphGen extraction, serialization and loading.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--user', default=os.environ.get('PGUSER', ''))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--dbname', default='graphgen_bench',
+                        help='database to generate the data in (created if missing; its tables are replaced)')
+    parser.add_argument('--schemas', nargs='+', default=sorted(SCHEMAS), choices=sorted(SCHEMAS))
+    parser.add_argument('--scales', nargs='+', type=int, default=[1], help='scale factors')
+    parser.add_argument('--engines', nargs='+', default=['sql', 'java'], choices=['sql', 'java'])
+    parser.add_argument('--heap', default='auto', help="JVM heap for java extractions (default: 'auto')")
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every schema and scale')
+    parser.add_argument('--workdir', help='where graphs are written (default: a temporary directory)')
+    parser.add_argument('--output', default='-', help='JSON result file (default: stdout)')
+    parser.add_argument('--compare', help='earlier JSON result file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio above which --compare reports a regression')
+    parser.add_argument('--min-wall', type=float, default=0.1,
+                        help='wall time in seconds under which --compare does not report slowdowns')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    create_database(args)
+    gg = GraphGenerator(args.dbname, args.host, args.port, args.user, args.password)
+    java = java_status() if 'java' in args.engines else 'java engine not selected'
+    workdir = args.workdir or tempfile.mkdtemp(prefix='graphgen-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    results = {'environment': environment(args), 'runs': []}
+    try:
+        for name in args.schemas:
+            for sf in args.scales:
+                for repeat in range(args.repeat):
+                    if args.verbose:
+                        print('%s, scale factor %d, run %d' % (name, sf, repeat + 1), file=sys.stderr)
+                    run = benchmark(args, gg, name, sf, workdir, java)
+                    run['repeat'] = repeat
+                    results['runs'].append(run)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold, args.min_wall):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,36 @@
 """
 Loads an example database into PostgreSQL to show off GraphGen examples.
+
+By default the small DBLP-style example dataset is loaded. With ``--scale``
+a synthetic dataset of any size is generated instead:
+
+    $ python examples/load-graphgen-testdb.py --scale 100 --skew 2.0
+
+Scale factor 1 is 10,000 authors and 20,000 publications. The number of
+authors of each publication follows a power law with exponent ``--skew``
+(truncated at ``--max-authors``), and with ``--author-skew`` some authors
+are far more prolific than others (lower author ids publish more), which
+reproduces the join fan-out of real co-authorship data. About 3 authors
+per publication are drawn with the defaults, so scale factor 1700 gives
+roughly 100M ``authorpublication`` rows.
+
+Rows are streamed to the server with ``COPY ... FROM STDIN`` in chunks, so
+memory use does not grow with the scale factor; keys, foreign keys and
+indexes are only created once the data is loaded, followed by ``ANALYZE``.
 """
 
 ##########################################################################
 ## Imports
 ##########################################################################
 
+from __future__ import print_function
+
+import argparse
+import struct
 import sys
-import pprint
+import time
+
+import numpy as np
 import psycopg2
 
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
@@ -23,63 +46,182 @@ PASSWORD = None  #<< insert PostgreSQL password here
 # I think it's safe to assume you don't though ...
 DBNAME   = "testgraphgen"
 
+# Rows per scale factor
+AUTHORS      = 10000
+PUBLICATIONS = 20000
+CONFERENCES  = 100
+
+VENUES = ('VLDB', 'SIGMOD', 'CIDR', 'ICDE', 'KDD', 'EDBT', 'PODS', 'WWW')
+
 ##########################################################################
 ## Helper Functions
 ##########################################################################
 
-def connect_and_create(username=USERNAME, password=PASSWORD, dbname=DBNAME):
+def connect_and_create(username=USERNAME, password=PASSWORD, dbname=DBNAME, host='localhost', port=None):
     """
     Connects to the database and drops the current database and creates a new one.
     """
 
     if username is None or password is None:
-        print "Please edit this file with the username and password to your database!"
+        print("Please edit this file with the username and password to your database!")
         sys.exit(1)
 
+    params = {'user': username, 'password': password, 'host': host}
+    if port:
+        params['port'] = port
+
     # Create new test database
     try:
-        dsn  = "dbname='postgres' user='{}' host='localhost' password='{}'"
-        conn = psycopg2.connect(dsn.format(username, password))
+        conn = psycopg2.connect(dbname='postgres', **params)
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    except:
-        print "Can't connect to PostgreSQL using the following DSN:\n    {}".format(repr(dsn))
+    except Exception:
+        print("Can't connect to PostgreSQL with the following parameters:\n    {}".format(repr(params)))
         sys.exit(1)
 
     cursor = conn.cursor()
     cursor.execute("DROP DATABASE IF EXISTS {}".format(dbname))
     cursor.execute("CREATE DATABASE {}".format(dbname))
+    conn.close()
 
     # Connect to the new database and return the connection
     try:
-        dsn  = "dbname='{}' user='{}' host='localhost' password='{}'"
-        conn = psycopg2.connect(dsn.format(dbname, username, password))
-        return conn
-    except:
-        print "Can't connect to PostgreSQL using the following DSN:\n    {}".format(repr(dsn))
+        return psycopg2.connect(dbname=dbname, **params)
+    except Exception:
+        print("Can't connect to PostgreSQL with the following parameters:\n    {}".format(repr(params)))
         sys.exit(1)
 
 
 def create_tables(conn):
     """
-    Using a passed in connection, creates the tables in the DB.
+    Using a passed in connection, creates the tables in the DB. Keys and
+    indexes are added by ``create_indexes`` once the data is loaded.
     """
     cursor = conn.cursor()
     stmts  = (
-        "CREATE TABLE author (id integer NOT NULL PRIMARY KEY,name character varying(1024));",
-        "CREATE TABLE conference (id integer NOT NULL PRIMARY KEY,name character varying(1024),year integer,location character varying(1024));",
-        "CREATE TABLE publication (id integer NOT NULL PRIMARY KEY,title character varying(2048),cid integer NOT NULL REFERENCES conference(id));",
-        "CREATE TABLE authorpublication (aid integer NOT NULL  REFERENCES author(id), pid integer NOT NULL REFERENCES publication(id), PRIMARY KEY(aid,pid));",
+        "CREATE TABLE author (id integer NOT NULL,name character varying(1024));",
+        "CREATE TABLE conference (id integer NOT NULL,name character varying(1024),year integer,location character varying(1024));",
+        "CREATE TABLE publication (id integer NOT NULL,title character varying(2048),cid integer NOT NULL);",
+        "CREATE TABLE authorpublication (aid integer NOT NULL, pid integer NOT NULL);",
     )
 
     for stmt in stmts:
         try:
             cursor.execute(stmt)
         except Exception as e:
-            print "Problem creating database table with the folowing SQL:"
-            print stmt
-            print e
+            print("Problem creating database table with the folowing SQL:")
+            print(stmt)
+            print(e)
             sys.exit(2)
 
+def create_indexes(conn, maintenance_work_mem='1GB'):
+    """
+    Adds the keys and indexes of the tables, then analyzes them. Building
+    them once after loading is much faster than maintaining them row by
+    row while loading.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+    stmts = (
+        "ALTER TABLE author ADD PRIMARY KEY (id);",
+        "ALTER TABLE conference ADD PRIMARY KEY (id);",
+        "ALTER TABLE publication ADD PRIMARY KEY (id);",
+        "ALTER TABLE authorpublication ADD PRIMARY KEY (aid, pid);",
+        # Co-authorship queries join authorpublication on pid
+        "CREATE INDEX authorpublication_pid ON authorpublication (pid);",
+        "ALTER TABLE publication ADD FOREIGN KEY (cid) REFERENCES conference(id);",
+        "ALTER TABLE authorpublication ADD FOREIGN KEY (aid) REFERENCES author(id);",
+        "ALTER TABLE authorpublication ADD FOREIGN KEY (pid) REFERENCES publication(id);",
+        "ANALYZE;",
+    )
+    for stmt in stmts:
+        cursor.execute(stmt)
+    conn.commit()
+    cursor.close()
+
+##########################################################################
+## COPY
+##########################################################################
+
+class ChunkReader(object):
+    """
+    A read-only file object over an iterable of byte strings, for
+    ``cursor.copy_expert`` to pull the rows of a COPY from as they are
+    generated.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self._buffer[self._pos:] + b''.join(self._chunks)
+            self._buffer, self._pos = b'', 0
+            return data
+        # Chunks are joined once rather than re-sliced on every small read
+        while len(self._buffer) - self._pos < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            self._buffer, self._pos = self._buffer[self._pos:] + chunk, 0
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+def _text_value(value):
+    if value is None:
+        return u'\\N'
+    return (u'%s' % value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(u'\n', u'\\n')
+
+def text_rows(rows):
+    """
+    Encodes rows in the text format of COPY.
+    """
+    return u''.join(u'\t'.join(_text_value(v) for v in row) + u'\n' for row in rows).encode('utf-8')
+
+def binary_rows(columns):
+    """
+    Encodes equal-length integer arrays as the rows of a binary COPY,
+    without a header or trailer.
+    """
+    n = len(columns[0])
+    fields = [('count', '>i2')]
+    for i in range(len(columns)):
+        fields += [('size%d' % i, '>i4'), ('value%d' % i, '>i4')]
+    rows = np.empty(n, dtype=fields)
+    rows['count'] = len(columns)
+    for i, column in enumerate(columns):
+        rows['size%d' % i] = 4
+        rows['value%d' % i] = column
+    return rows.tobytes()
+
+def copy_text(cursor, table, columns, chunks):
+    """
+    Streams chunks of rows into ``table`` with a single text COPY.
+    """
+    sql = "COPY {} ({}) FROM STDIN".format(table, ', '.join(columns))
+    cursor.copy_expert(sql, ChunkReader(text_rows(rows) for rows in chunks))
+
+def copy_binary(cursor, table, columns, chunks):
+    """
+    Streams chunks of integer columns (a list of arrays per chunk) into
+    ``table`` with a single binary COPY, which skips formatting and
+    parsing the numbers as text.
+    """
+    def stream():
+        yield b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+        for arrays in chunks:
+            yield binary_rows(arrays)
+        yield struct.pack('>h', -1)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT binary)".format(table, ', '.join(columns))
+    cursor.copy_expert(sql, ChunkReader(stream()))
+
+##########################################################################
+## Data
+##########################################################################
+
 def insert_data(conn):
     """
     Inserts data into the tables that were created using the create tables statement.
@@ -87,7 +229,7 @@ def insert_data(conn):
 
     # Data Structures
     database = (
-        ('authors', {
+        ('author', {
             'data': (
                 (1,'Anindya Datta'),
                 (2,'Heiko Schuldt'),
@@ -100,9 +242,9 @@ def insert_data(conn):
                 (9,'Egemen Tanin'),
                 (10,'Brandon Lloyd'),
             ),
-            'sql': "INSERT INTO author (id, name) VALUES (%s, %s);",
+            'columns': ('id', 'name'),
         }),
-        ('conferences', {
+        ('conference', {
             'data': (
                 (49,'VLDB',2014,'Hangzhou, China'),
                 (87,'VLDB',2015,'Kailua Kona, HI USA'),
@@ -110,9 +252,9 @@ def insert_data(conn):
                 (36,'SIGMOD',2015,'Melbourne, Australia'),
                 (59,'CIDR',2015,'Asilomar, CA USA'),
             ),
-            'sql': "INSERT INTO conference (id, name, year, location) VALUES (%s, %s, %s, %s);",
+            'columns': ('id', 'name', 'year', 'location'),
         }),
-        ('publications', {
+        ('publication', {
             'data': (
                 (8,'Title 1.',49),
                 (15,'Title 2.',87),
@@ -120,9 +262,9 @@ def insert_data(conn):
                 (44,'Title 4.',36),
                 (64,'Title 5.',59),
             ),
-            'sql': "INSERT INTO publication (id, title, cid) VALUES (%s, %s, %s);",
+            'columns': ('id', 'title', 'cid'),
         }),
-        ('authorpubs', {
+        ('authorpublication', {
             'data': (
                 (1,8),
                 (1,64),
@@ -142,25 +284,122 @@ def insert_data(conn):
                 (10,8),
                 (3,64),
             ),
-            'sql': "INSERT INTO authorpublication (aid, pid) VALUES (%s, %s);",
+            'columns': ('aid', 'pid'),
         }),
     )
 
     cursor = conn.cursor()
     for table, meta in database:
         try:
-            cursor.executemany(meta['sql'], meta['data'])
+            copy_text(cursor, table, meta['columns'], [meta['data']])
         except Exception as e:
-            print "Problem inserting data into {}:".format(table)
-            print e
+            print("Problem inserting data into {}:".format(table))
+            print(e)
 
     conn.commit()
     cursor.close()
 
+def power_law(exponent, maximum):
+    """
+    Returns the cumulative distribution of the values ``1..maximum`` under
+    a power law ``P(k) ~ k ** -exponent``.
+    """
+    cdf = np.cumsum(np.arange(1, maximum + 1, dtype=np.float64) ** -float(exponent))
+    return cdf / cdf[-1]
+
+def sample(rng, cdf, size):
+    """
+    Draws ``size`` values in ``1..len(cdf)`` from a cumulative distribution.
+    """
+    return np.searchsorted(cdf, rng.random_sample(size), side='right') + 1
+
+def authorships(rng, publications, authors, skew, max_authors, author_skew, chunksize):
+    """
+    Yields ``[aids, pids]`` arrays of the authors of each publication, a
+    chunk of publications at a time. Authors are distinct within a
+    publication.
+    """
+    counts_cdf = power_law(skew, max_authors)
+    popularity = power_law(author_skew, authors) if author_skew else None
+    for start in range(1, publications + 1, chunksize):
+        pids = np.arange(start, min(start + chunksize, publications + 1), dtype=np.int64)
+        counts = sample(rng, counts_cdf, len(pids))
+        pids = np.repeat(pids, counts)
+        if popularity is None:
+            aids = rng.randint(1, authors + 1, size=len(pids))
+        else:
+            aids = np.minimum(sample(rng, popularity, len(pids)), authors)
+        # Drop repeated draws of an author for the same publication
+        keys = np.unique(pids * (authors + 1) + aids)
+        yield [keys % (authors + 1), keys // (authors + 1)]
+
+def generate_data(conn, scale=1, skew=2.0, max_authors=100, author_skew=0.5, chunksize=100000, seed=0):
+    """
+    Generates and loads a synthetic dataset at scale factor ``scale`` (see
+    the module documentation). Returns the number of rows of each table.
+    """
+    rng = np.random.RandomState(seed)
+    authors = max(1, int(AUTHORS * scale))
+    publications = max(1, int(PUBLICATIONS * scale))
+    conferences = max(1, int(CONFERENCES * scale))
+    max_authors = min(max_authors, authors)
+    cursor = conn.cursor()
+
+    def author_rows():
+        for start in range(1, authors + 1, chunksize):
+            ids = range(start, min(start + chunksize, authors + 1))
+            yield [(i, 'Author %d' % i) for i in ids]
+    copy_text(cursor, 'author', ('id', 'name'), author_rows())
+
+    copy_text(cursor, 'conference', ('id', 'name', 'year', 'location'),
+              [[(i, VENUES[i % len(VENUES)], 1990 + i % 30, 'City %d' % (i % 97)) for i in range(1, conferences + 1)]])
+
+    def publication_rows():
+        for start in range(1, publications + 1, chunksize):
+            ids = range(start, min(start + chunksize, publications + 1))
+            cids = rng.randint(1, conferences + 1, size=len(ids)).tolist()
+            yield [(i, 'Title %d.' % i, c) for i, c in zip(ids, cids)]
+    copy_text(cursor, 'publication', ('id', 'title', 'cid'), publication_rows())
+
+    copy_binary(cursor, 'authorpublication', ('aid', 'pid'),
+                authorships(rng, publications, authors, skew, max_authors, author_skew, chunksize))
+    conn.commit()
+
+    rows = {}
+    for table in ('author', 'conference', 'publication', 'authorpublication'):
+        cursor.execute("SELECT count(*) FROM {}".format(table))
+        rows[table] = cursor.fetchone()[0]
+    cursor.close()
+    return rows
+
 if __name__ == '__main__':
-    conn = connect_and_create()
+    parser = argparse.ArgumentParser(description='Loads the GraphGen example database.')
+    parser.add_argument('--username', default=USERNAME)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--dbname', default=DBNAME)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port')
+    parser.add_argument('--scale', type=float, help='generate a synthetic dataset of this scale factor')
+    parser.add_argument('--skew', type=float, default=2.0,
+                        help='power-law exponent of the number of authors per publication')
+    parser.add_argument('--max-authors', type=int, default=100, help='most authors of a publication')
+    parser.add_argument('--author-skew', type=float, default=0.5,
+                        help='power-law exponent of author popularity (0 for uniform)')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows generated at a time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    conn = connect_and_create(args.username, args.password, args.dbname, args.host, args.port)
     create_tables(conn)
-    insert_data(conn)
+    if args.scale is None:
+        insert_data(conn)
+    else:
+        rows = generate_data(conn, args.scale, args.skew, args.max_authors, args.author_skew,
+                             args.chunk_size, args.seed)
+        for table in sorted(rows):
+            print("{:>20}: {:,} rows".format(table, rows[table]))
+    create_indexes(conn)
     conn.close()
 
-    print "Successfully created the test database called {}".format(repr(DBNAME))
+    print("Successfully created the test database called {} in {:.1f}s".format(repr(args.dbname), time.time() - start))
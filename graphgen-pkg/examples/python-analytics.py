@@ -0,0 +1,62 @@
+from graphgenpy import GraphGenerator, read_graph
+from graphgenpy import analytics
+import networkx as nx
+import sys
+
+# Runs the vectorized algorithms of graphgenpy.analytics on the DBLP example
+# graph and checks them against NetworkX.
+
+datalogQuery = """
+Nodes(ID, Name) :- Author(ID, Name).
+Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+"""
+
+# Credentials for connecting to the database
+gg = GraphGenerator("testgraphgen","localhost","5432","kostasx","password") #All these must be strings!!
+
+fname = gg.generateGraph(datalogQuery,"extracted_graph",GraphGenerator.GML)
+
+# The same file as arrays, and as a NetworkX graph
+graph = read_graph(fname)
+G = graph.to_networkx()
+U = G.to_undirected()
+source = sorted(G.nodes())[0]
+
+failures = []
+def check(name, ours, theirs, close=False):
+    if close:
+        ok = set(ours) == set(theirs) and all(abs(ours[n] - theirs[n]) < 1e-6 for n in theirs)
+    else:
+        ok = ours == theirs
+    print("%-18s %s" % (name, "ok" if ok else "MISMATCH"))
+    if not ok:
+        failures.append(name)
+
+check("pagerank", analytics.pagerank(graph), nx.pagerank(G), close=True)
+check("degree", analytics.degree(graph), dict(G.degree()))
+check("in degree", analytics.degree(graph, 'in'), dict(G.in_degree()))
+check("out degree", analytics.degree(graph, 'out'), dict(G.out_degree()))
+check("bfs", analytics.bfs(graph, source), nx.single_source_shortest_path_length(G, source))
+check("triangles", analytics.triangles(graph), nx.triangles(U))
+
+# Components are compared as partitions of the node set
+ours = analytics.connected_components(graph)
+partition = set(frozenset(n for n in ours if ours[n] == c) for c in set(ours.values()))
+check("components", partition, set(frozenset(c) for c in nx.connected_components(U)))
+
+# Label propagation has no NetworkX equivalent here: check that every node
+# ended with one of the most frequent labels among its neighbors
+labels = analytics.label_propagation(graph)
+stable = True
+for n in U:
+    counts = {}
+    for m in U[n]:
+        if m != n:
+            counts[labels[m]] = counts.get(labels[m], 0) + 1
+    if counts and counts.get(labels[n], 0) != max(counts.values()):
+        stable = False
+check("label propagation", stable, True)
+
+if failures:
+    sys.exit(1)
+print("All analytics match NetworkX!")
@@ -1,4 +1,4 @@
-from graphgenpy import GraphGenerator
+from graphgenpy import GraphGenerator, read_graph
 import networkx as nx
 
 datalogQuery = """
@@ -9,13 +9,18 @@ Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
 # Credentials for connecting to the database
 gg = GraphGenerator("testgraphgen","localhost","5432","kostasx","password") #All these must be strings!!
 
+# Preview a 5% sample of the publications first: it takes a fraction of the
+# time, and its stats hold the estimated size of the full graph
+preview = gg.generateGraph(datalogQuery,"extracted_graph_preview",GraphGenerator.GML,sample=0.05,sample_by="PubID")
+print preview.stats.estimate
+
 # Evaluate graph extraction query and serialize the resulting graph to disk in a standard format. Return the file's name in the FS.
 # Supported formats: GraphGenerator.GML or GraphGenerator.GraphSON
 fname = gg.generateGraph(datalogQuery,"extracted_graph",GraphGenerator.GML)
 
 # Load graph into NetworkX
-# by default, the graph format will me gml. 'id' here is the node attribute networkx should use as a label (mandatory)
-G = nx.read_gml(fname,'id')
+# read_graph parses the file straight into arrays, which is much faster for large graphs
+G = read_graph(fname).to_networkx()
 print "Graph Loaded into NetworkX! Running PageRank..."
 
 # Run any algorithm on the graph using NetworkX
@@ -10,6 +10,11 @@ Edges(ID1, ID2) :- Orders(orderId1, ID1),Lineitem(orderId1,part),Orders(orderId2
 # Credentials for connecting to the database
 gg = GraphGenerator("tpch","localhost","5432","kostasx","password") #All these must be strings!!
 
+# Estimate the size of the graph before extracting it: popular parts make
+# the expanded graph blow up (pass condensed='auto' to generateGraph to let
+# the planner pick a condensed or hybrid graph instead)
+print gg.explain(datalogQuery)
+
 # Evaluate graph extraction query and serialize the resulting graph to disk in a standard format. Return the file's name in the FS.
 extracted_name = "extracted_graph_tpch"
 fname = gg.generateGraph(datalogQuery,extracted_name,GraphGenerator.GML)
@@ -0,0 +1,48 @@
+from graphgenpy import GraphGenerator, VertexCentric, read_graph
+
+# An example of a vertex centric degree counter, like java-vertexcentric.java.
+# Supersteps run in parallel over partitions of the graph in a process pool.
+
+datalogQuery = """
+Nodes(ID, Name) :- Author(ID, Name).
+Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+"""
+
+# Implement the compute function: it must be defined at module level so that
+# the worker processes can run it
+def degree(v, ctx):
+    v.setVal(0) # initialize
+    # iterate over v's neighbors
+    for w in v.neighbors:
+        v.setVal(v.getVal() + 1)
+    ctx.voteToHalt(v)
+
+# Messages sent to a vertex can be combined into one, here the smallest, to
+# label every vertex with the smallest vertex number of its connected component
+def components(v, ctx):
+    if ctx.superstep == 0:
+        v.value = v.index
+        ctx.send_to_neighbors(v, v.index)
+    elif v.messages and v.messages[0] < v.value:
+        v.value = v.messages[0]
+        ctx.send_to_neighbors(v, v.value)
+    ctx.voteToHalt(v)
+
+# Worker processes import this script (under the spawn start method, the
+# default on macOS and Windows): only the main process extracts and runs
+if __name__ == '__main__':
+    # Credentials for connecting to the database
+    gg = GraphGenerator("testgraphgen","localhost","5432","kostasx","password") #All these must be strings!!
+
+    fname = gg.generateGraph(datalogQuery,"extracted_graph",GraphGenerator.GML)
+    g = read_graph(fname)
+
+    # Initialize vertex-centric object, iterating over neighbors in both directions
+    p = VertexCentric(g, direction='both')
+
+    print("Running Degree...")
+    print(p.run(degree)) # run degree counter
+
+    print("Running Connected Components...")
+    print(p.run(components, combiner='min'))
+    print("Done")
@@ -2,3 +2,13 @@
 
 from .graphgenpy import *
 from .utils import *
+from .csr import load_csr
+from .readers import read_graph
+from .condensed import CondensedGraph, load_condensed
+from .cache import ExtractionCache
+from .incremental import IncrementalGraph
+from .lazy import LazyGraph
+from .shm import SharedGraph
+from .vertexcentric import VertexCentric
+from .stats import ExtractionStats, ExtractionResult
+from .partition import PartitionedGraph, load_partitioned
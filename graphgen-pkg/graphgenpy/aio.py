@@ -0,0 +1,143 @@
+# aio.py
+# asyncio support for `graphgenpy` (Python 3.7+).
+#
+# The JVM is run with asyncio.create_subprocess_exec so that extractions
+# do not block the event loop, can be awaited concurrently (for example
+# with asyncio.gather), and kill their JVM when cancelled or timed out.
+
+import asyncio
+import functools
+import os
+import tempfile
+
+from . import sizing
+from . import stats as _stats
+from . import utils
+
+_java_names = ('java', 'java.exe')
+
+def find_java():
+    """
+    Locate the java binary like ``utils.config_java`` does, from
+    JAVAHOME/JAVA_HOME and then the PATH, without running ``which``.
+    :raise LookupError: If no java binary is found.
+    """
+    dirs = []
+    for env_var in ('JAVAHOME', 'JAVA_HOME'):
+        for path in os.environ.get(env_var, '').split(os.pathsep):
+            if os.path.isfile(path):
+                return path
+            if path:
+                dirs += [path, os.path.join(path, 'bin')]
+    dirs += os.environ.get('PATH', '').split(os.pathsep)
+    for directory in dirs:
+        for name in _java_names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    raise LookupError('GraphGen was unable to find the java binary! '
+                      'Set the JAVAHOME or JAVA_HOME environment variable.')
+
+async def aconfig_java():
+    """
+    Configure ``utils`` with a java binary, reusing the binary and options
+    resolved by an earlier process like ``utils.java`` does, or searching
+    for it on a thread so that the event loop is not blocked. Does nothing
+    if java is already configured.
+    """
+    if utils._java_bin is None:
+        config = utils._load_java_config()
+        path = config['bin'] if config else await asyncio.get_running_loop().run_in_executor(None, find_java)
+        if utils._java_bin is None:
+            utils._java_bin = path
+            utils._java_options = list(config['options'] if config else utils._default_options)
+            if config is None:
+                utils._save_java_config()
+    return utils._java_bin
+
+async def ajava(cmd, classpath=None, options=None, timeout=None):
+    """
+    Run a java command like ``utils.java`` and return ``(stdout, stderr)``.
+    The JVM is killed if the awaiting task is cancelled or ``timeout``
+    seconds pass, in which case ``asyncio.TimeoutError`` is raised.
+    :raise OSError: If the java command returns a nonzero return code.
+    """
+    await aconfig_java()
+    cmd = utils.java_command(cmd, classpath, options)
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                             stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(p.communicate(), timeout)
+    except BaseException:
+        # Cancelled or timed out: do not leave the JVM running
+        if p.returncode is None:
+            p.kill()
+            await p.wait()
+        raise
+    if p.returncode != 0:
+        print(stderr.decode('utf-8', 'replace'))
+        raise OSError('Java command failed : ' + str(cmd))
+    return stdout, stderr
+
+async def agenerateGraph(self, extractionQuery, filename, serialization_format='gml',
+                         engine='java', condensed=False, heap='auto', timeout=None):
+    '''
+    Asynchronous ``GraphGenerator.generateGraph``. Returns the path of the
+    serialized graph as a ``stats.ExtractionResult``, and passes the
+    stats of the extraction to the generator's hooks.
+
+    Plain JVM extractions run the JVM as an asyncio subprocess, which is
+    killed on cancellation or after ``timeout`` seconds. Extractions that
+    run in-process (the SQL engine, condensed and CSR output) or through
+    the persistent JVM or the cache are run on the default executor; they
+    honor ``timeout`` but run to completion in the background.
+
+    ``heap`` is handled as by ``generateGraph``: with ``'auto'`` (the
+    default) a JVM extraction first opens a psycopg2 connection and runs
+    EXPLAIN to size the heap (see ``planHeap``), on the default executor,
+    and extracts in spill mode with the SQL engine if the graph does not
+    fit in memory. Node ids must be integers whenever ``generateGraph``
+    requires them.
+    '''
+    loop = asyncio.get_running_loop()
+    stats = _stats.ExtractionStats(extractionQuery, serialization_format, engine)
+    if engine == 'java' and not condensed and heap == 'auto' and not self._serving():
+        with stats.phase('plan'):
+            heap = await loop.run_in_executor(None, self.planHeap, extractionQuery)
+    spill = isinstance(heap, sizing.HeapPlan) and heap.spill
+    if (engine != 'java' or condensed or spill or serialization_format == self.CSR
+            or self._serving() or self.cache is not None):
+        # generateGraph takes the plan in place of 'auto' and does not redo it
+        call = functools.partial(self.generateGraph, extractionQuery, filename, serialization_format,
+                                 engine=engine, condensed=condensed, heap=heap)
+        future = loop.run_in_executor(None, call)
+        return await asyncio.wait_for(future, timeout)
+
+    from .graphgenpy import _jar
+
+    stats.strategy = 'expanded'
+    path = filename + '.' + serialization_format
+    args = self._extractArgs(extractionQuery, serialization_format, filename)
+    options = self._heapOptions(extractionQuery, heap)[0] or []
+    fd, gc_log = tempfile.mkstemp(prefix='graphgen-gc-', suffix='.log')
+    os.close(fd)
+    try:
+        with stats.phase('jvm'):
+            stdout, stderr = await ajava(['com.umdb.graphgen.PyGenerateGraph'] + args, classpath=_jar,
+                                         options=options + _stats.gc_log_options(gc_log), timeout=timeout)
+        stats.stderr = utils._decode_stdoutdata(stderr)
+        gc = _stats.read_gc_log(gc_log)
+        if gc is not None:
+            stats.jvm_peak_heap, stats.jvm_gc_time, stats.jvm_gc_count = gc
+        with stats.phase('count'):
+            stats.nodes, stats.edges = await loop.run_in_executor(None, _stats.count_elements,
+                                                                  path, serialization_format)
+    except BaseException as e:
+        # Cancelled and timed out extractions are reported too
+        self._failed(stats, e)
+        raise
+    finally:
+        os.remove(gc_log)
+    return self._succeeded(stats, path)
+
+__all__ = ['agenerateGraph', 'ajava', 'aconfig_java', 'find_java']
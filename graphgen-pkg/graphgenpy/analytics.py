@@ -0,0 +1,197 @@
+# analytics.py
+# Vectorized graph algorithms over extracted graphs.
+#
+# The algorithms work on the vertex-numbered arrays of a `csr.CSRGraph`
+# (as returned by `load_csr`, `read_graph` or the SQL engine) with NumPy,
+# instead of iterating over NetworkX dicts, and return dicts keyed by the
+# original node ids. Graphs are treated like the NetworkX DiGraph the same
+# file would load into: parallel edges count once.
+
+import numpy as np
+
+from . import csr
+
+##########################################################################
+# Helpers
+##########################################################################
+
+def _csr(graph):
+    # Condensed graphs are expanded; anything else must be CSR-like
+    return graph.expand() if hasattr(graph, 'expand') else graph
+
+def edge_arrays(graph, undirected=False, self_loops=True):
+    '''
+    Returns the distinct edges of ``graph`` as ``(sources, targets)``
+    arrays of vertex numbers. With ``undirected`` every edge is present
+    in both directions.
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    src = np.repeat(np.arange(n, dtype=np.int64), np.diff(graph.offsets))
+    dst = np.asarray(graph.neighbors, dtype=np.int64)
+    if undirected:
+        src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+    if not self_loops:
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+    keys = np.unique(src * n + dst)
+    return keys // n, keys % n
+
+def _adjacency(n, src, dst):
+    try:
+        import scipy.sparse
+    except ImportError:
+        raise ImportError('scipy is required for this algorithm')
+    data = np.ones(len(src), dtype=np.int64)
+    return scipy.sparse.csr_matrix((data, (src, dst)), shape=(n, n))
+
+def _reduce_rows(ufunc, values, rows, n, initial):
+    # ufunc.reduce over the values of each row, for rows in sorted order
+    out = np.full(n, initial, dtype=values.dtype)
+    if len(rows):
+        present, starts = np.unique(rows, return_index=True)
+        out[present] = ufunc.reduceat(values, starts)
+    return out
+
+def _keyed(graph, values):
+    return dict(zip(np.asarray(graph.ids).tolist(), values.tolist()))
+
+##########################################################################
+# Algorithms
+##########################################################################
+
+def degree(graph, mode='all'):
+    '''
+    Returns the in-, out- or total (``mode='in'``, ``'out'``, ``'all'``)
+    degree of every node
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    src, dst = edge_arrays(graph)
+    deg = np.zeros(n, dtype=np.int64)
+    if mode in ('out', 'all'):
+        deg += np.bincount(src, minlength=n)
+    if mode in ('in', 'all'):
+        deg += np.bincount(dst, minlength=n)
+    if mode not in ('in', 'out', 'all'):
+        raise ValueError("mode must be 'in', 'out' or 'all'")
+    return _keyed(graph, deg)
+
+def pagerank(graph, alpha=0.85, max_iter=100, tol=1.0e-6):
+    '''
+    Returns the PageRank of every node, computed by power iteration like
+    ``networkx.pagerank``: the rank of dangling nodes is spread uniformly
+    and iteration stops once the L1 change is below ``n * tol``.
+    :raise RuntimeError: If it does not converge in ``max_iter`` iterations.
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    if n == 0:
+        return {}
+    src, dst = edge_arrays(graph)
+    out = np.bincount(src, minlength=n).astype(np.float64)
+    dangling = out == 0
+    weight = 1.0 / out[src]
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        last = x
+        x = alpha * np.bincount(dst, weights=last[src] * weight, minlength=n)
+        x += (alpha * last[dangling].sum() + 1.0 - alpha) / n
+        if np.abs(x - last).sum() < n * tol:
+            return _keyed(graph, x)
+    raise RuntimeError('pagerank: power iteration failed to converge in %d iterations' % max_iter)
+
+def connected_components(graph):
+    '''
+    Returns the weakly connected component of every node, numbered from 0
+    in order of each component's smallest vertex number
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    src, dst = edge_arrays(graph, undirected=True, self_loops=False)
+    # Min-label propagation with pointer jumping
+    label = np.arange(n, dtype=np.int64)
+    while True:
+        low = np.minimum(label, _reduce_rows(np.minimum, label[dst], src, n, n))
+        low = low[low]
+        while True:
+            jumped = low[low]
+            if np.array_equal(jumped, low):
+                break
+            low = jumped
+        if np.array_equal(low, label):
+            break
+        label = low
+    _, numbered = np.unique(label, return_inverse=True)
+    return _keyed(graph, numbered)
+
+def bfs(graph, source, depth=None, directed=True):
+    '''
+    Returns the hop distance from ``source`` to every node it reaches,
+    following edges forwards (or both ways if not ``directed``), up to
+    ``depth`` hops
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    offsets, neighbors = graph.offsets, graph.neighbors
+    if not directed:
+        src, dst = edge_arrays(graph, undirected=True)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+        neighbors = dst
+    dist = np.full(n, -1, dtype=np.int64)
+    start = graph.index(source)
+    dist[start] = 0
+    frontier, hops = np.array([start]), 0
+    while len(frontier) and (depth is None or hops < depth):
+        reached = np.unique(csr.gather_rows(offsets, neighbors, frontier))
+        frontier = reached[dist[reached] < 0]
+        hops += 1
+        dist[frontier] = hops
+    found = np.flatnonzero(dist >= 0)
+    return dict(zip(np.asarray(graph.ids)[found].tolist(), dist[found].tolist()))
+
+def triangles(graph):
+    '''
+    Returns the number of triangles through every node, ignoring edge
+    direction and self-loops like ``networkx.triangles`` on the
+    undirected graph. Requires scipy.
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    a = _adjacency(n, *edge_arrays(graph, undirected=True, self_loops=False))
+    counts = np.asarray((a.dot(a)).multiply(a).sum(axis=1)).ravel() // 2
+    return _keyed(graph, counts)
+
+def label_propagation(graph, max_iter=100):
+    '''
+    Returns a community label for every node by synchronous label
+    propagation on the undirected graph: each node repeatedly adopts the
+    most frequent label among its neighbors, the smallest one on ties,
+    keeping its own label when that is among the most frequent. Labels
+    are node ids of community members. Stops after ``max_iter`` rounds
+    if labels keep oscillating.
+    '''
+    graph = _csr(graph)
+    n = graph.number_of_nodes()
+    src, dst = edge_arrays(graph, undirected=True, self_loops=False)
+    label = np.arange(n, dtype=np.int64)
+    for _ in range(max_iter):
+        # Count each (node, neighbor label) pair
+        keys, counts = np.unique(src * n + label[dst], return_counts=True)
+        nodes, labels = keys // n, keys % n
+        best = _reduce_rows(np.maximum, counts, nodes, n, 0)
+        top = counts == best[nodes]
+        # Keep the current label when it is among the most frequent
+        keep = np.zeros(n, dtype=bool)
+        keep[nodes[top & (labels == label[nodes])]] = True
+        new = label.copy()
+        choice = _reduce_rows(np.minimum, labels[top], nodes[top], n, n)
+        change = (choice < n) & ~keep
+        new[change] = choice[change]
+        if np.array_equal(new, label):
+            break
+        label = new
+    return _keyed(graph, np.asarray(graph.ids)[label])
+
+__all__ = ['degree', 'pagerank', 'connected_components', 'bfs', 'triangles', 'label_propagation']
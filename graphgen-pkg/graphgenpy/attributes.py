@@ -0,0 +1,462 @@
+# attributes.py
+# Columnar node attributes, kept apart from the graph topology.
+#
+# Every attribute (a head variable of the Nodes rule besides the id, such as
+# Name in ``Nodes(ID, Name) :- Author(ID, Name)``) is one column over the
+# vertex numbers of a graph. Numeric columns are typed arrays; text columns
+# hold int32 codes into a pool of distinct strings, stored once as UTF-8, so
+# repeated values cost four bytes per node. A column mixing text and numbers
+# pools its values as JSON, so that every value keeps its type. On disk every column is a few .npy files in the ``attrs``
+# directory of a graph, memory-mapped only when the column is first accessed:
+# algorithms that only use the topology never read them.
+#
+# `NodeAttributes` is also a read-only mapping of node id to attribute dict,
+# which is how graphs exposed attributes before they were columnar.
+
+import io
+import json
+import os
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+_directory = 'attrs'
+_schema = 'columns.json'
+
+##########################################################################
+# Columns
+##########################################################################
+
+class NumericColumn(object):
+    '''
+    An integer or floating point attribute: ``values[i]`` is the value of
+    vertex ``i`` if ``mask`` is None or ``mask[i]`` is set
+    '''
+    kind = 'numeric'
+
+    def __init__(self, values, mask=None):
+        self.values = values
+        self.mask = mask
+
+    def present(self):
+        '''
+        Returns a boolean array of the vertices that have a value
+        '''
+        return np.ones(len(self.values), dtype=bool) if self.mask is None else np.asarray(self.mask)
+
+    def get(self, i):
+        if self.mask is not None and not self.mask[i]:
+            return None
+        return self.values[i].item()
+
+    def take(self, rows):
+        return NumericColumn(np.asarray(self.values)[rows],
+                             None if self.mask is None else np.asarray(self.mask)[rows])
+
+    def to_list(self):
+        values = np.asarray(self.values).tolist()
+        if self.mask is not None:
+            values = [v if m else None for v, m in zip(values, np.asarray(self.mask).tolist())]
+        return values
+
+class StringColumn(object):
+    '''
+    A text attribute: ``codes[i]`` is the position of the value of vertex
+    ``i`` in ``pool``, or -1 if it has none
+    '''
+    kind = 'string'
+
+    def __init__(self, codes, pool):
+        self.codes = codes
+        self.pool = pool
+
+    def present(self):
+        return np.asarray(self.codes) >= 0
+
+    def get(self, i):
+        code = int(self.codes[i])
+        return None if code < 0 else self.pool[code]
+
+    def take(self, rows):
+        return StringColumn(np.asarray(self.codes)[rows], self.pool)
+
+    def to_list(self):
+        strings = self.pool.strings()
+        return [strings[c] if c >= 0 else None for c in np.asarray(self.codes).tolist()]
+
+class MixedColumn(StringColumn):
+    '''
+    An attribute mixing numbers and text: a ``StringColumn`` whose pool
+    holds the values as JSON, so that ``1`` and ``'1'`` stay apart
+    '''
+    kind = 'mixed'
+
+    def get(self, i):
+        value = StringColumn.get(self, i)
+        return None if value is None else json.loads(value)
+
+    def take(self, rows):
+        return MixedColumn(np.asarray(self.codes)[rows], self.pool)
+
+    def to_list(self):
+        values = [json.loads(s) for s in self.pool.strings()]
+        return [values[c] if c >= 0 else None for c in np.asarray(self.codes).tolist()]
+
+_text_columns = {'string': StringColumn, 'mixed': MixedColumn}
+
+def text_column(kind, codes, pool):
+    '''
+    Returns the ``StringColumn`` or ``MixedColumn`` (``kind``) of codes
+    into a ``StringPool``
+    '''
+    return _text_columns[kind](codes, pool)
+
+class StringPool(object):
+    '''
+    Distinct strings stored back to back as UTF-8 in ``data``, string
+    ``k`` being ``data[offsets[k]:offsets[k + 1]]``. Strings are decoded
+    when accessed.
+    '''
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._strings = None
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        if self._strings is not None:
+            return self._strings[code]
+        return self.data[self.offsets[code]:self.offsets[code + 1]].tobytes().decode('utf-8')
+
+    def strings(self):
+        '''
+        Returns (and keeps) all the strings of the pool as a list
+        '''
+        if self._strings is None:
+            self._strings = [self[k] for k in range(len(self))]
+        return self._strings
+
+##########################################################################
+# Node attributes
+##########################################################################
+
+class NodeAttributes(Mapping):
+    '''
+    The attribute columns of the nodes of a graph with the sorted node
+    ``ids``. ``column(name)`` returns a column over the vertex numbers;
+    as a mapping, ``attrs[id]`` is the dict of the attributes node ``id``
+    has, and iterating yields the ids of the nodes with any attribute.
+    Columns stored at ``path`` are loaded on first access.
+    '''
+
+    def __init__(self, ids, columns=None, path=None):
+        self.ids = ids
+        self.path = path
+        columns = list(columns or [])
+        self._columns = dict(columns)
+        self._names = [name for name, _ in columns] if path is None else None
+
+    def names(self):
+        '''
+        Returns the attribute names
+        '''
+        if self._names is None:
+            self._names = [c['name'] for c in _read_schema(self.path)]
+        return list(self._names)
+
+    def column(self, name):
+        '''
+        Returns the ``NumericColumn`` or ``StringColumn`` of an attribute
+        :raise KeyError: If there is no such attribute.
+        '''
+        if name not in self._columns:
+            if self.path is None:
+                raise KeyError(name)
+            for i, spec in enumerate(_read_schema(self.path)):
+                if spec['name'] == name:
+                    self._columns[name] = _load_column(self.path, i, spec)
+                    break
+            else:
+                raise KeyError(name)
+        return self._columns[name]
+
+    def row(self, i):
+        '''
+        Returns the attribute dict of vertex ``i``
+        '''
+        values = {}
+        for name in self.names():
+            value = self.column(name).get(i)
+            if value is not None:
+                values[name] = value
+        return values
+
+    def dicts(self):
+        '''
+        Yields the attribute dict of every vertex, in vertex order
+        '''
+        names = self.names()
+        columns = [self.column(name).to_list() for name in names]
+        for row in zip(*columns) if columns else ({} for _ in range(len(self.ids))):
+            yield dict((name, value) for name, value in zip(names, row) if value is not None)
+
+    def take(self, rows, ids):
+        '''
+        Returns the attributes of the vertices ``rows``, which become the
+        nodes ``ids`` of another graph
+        '''
+        return NodeAttributes(ids, [(name, self.column(name).take(rows)) for name in self.names()])
+
+    def _present(self):
+        present = np.zeros(len(self.ids), dtype=bool)
+        for name in self.names():
+            present |= self.column(name).present()
+        return present
+
+    def __getitem__(self, id):
+        i = int(np.searchsorted(self.ids, id))
+        if i == len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        values = self.row(i)
+        if not values:
+            raise KeyError(id)
+        return values
+
+    def __iter__(self):
+        return iter(np.asarray(self.ids)[self._present()].tolist())
+
+    def __len__(self):
+        return int(self._present().sum())
+
+    def __repr__(self):
+        return '<NodeAttributes: %s>' % ', '.join(self.names())
+
+def from_dicts(ids, attrs):
+    '''
+    Builds ``NodeAttributes`` for the sorted node ``ids`` from a dict of
+    node id to attribute dict
+    '''
+    builder = AttributeBuilder()
+    for id, values in attrs.items():
+        builder.add(id, values)
+    return builder.build(ids)
+
+def as_attributes(ids, attrs):
+    '''
+    Returns ``attrs`` (``NodeAttributes``, an ``AttributeBuilder``, a
+    dict of attribute dicts or None) as ``NodeAttributes`` over ``ids``
+    '''
+    if isinstance(attrs, NodeAttributes):
+        return attrs
+    if isinstance(attrs, AttributeBuilder):
+        return attrs.build(ids)
+    return from_dicts(ids, attrs or {})
+
+##########################################################################
+# Building
+##########################################################################
+
+class AttributeBuilder(object):
+    '''
+    Collects node attributes column by column while a graph is being
+    built, interning every distinct value once, and turns them into
+    ``NodeAttributes`` once the node ids are known
+    '''
+
+    def __init__(self):
+        self._columns = {}
+        self._order = []
+
+    def add(self, id, values):
+        for name, value in values.items():
+            if value is None:
+                continue
+            column = self._columns.get(name)
+            if column is None:
+                column = self._columns[name] = ([], [], {}, [])
+                self._order.append(name)
+            ids, codes, index, distinct = column
+            # bool, int and float values that compare equal stay apart
+            key = (type(value), value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(distinct)
+                distinct.append(value)
+            ids.append(id)
+            codes.append(code)
+
+    def __len__(self):
+        return len(self._order)
+
+    def build(self, ids):
+        columns = []
+        for name in self._order:
+            node_ids, codes, _, distinct = self._columns[name]
+            rows = np.searchsorted(ids, np.array(node_ids, dtype=np.int64))
+            columns.append((name, _column(len(ids), rows, np.array(codes, dtype=np.int64), distinct)))
+        return NodeAttributes(ids, columns)
+
+def _numeric_dtype(values):
+    if all(isinstance(v, (bool, int, np.integer)) or _is_long(v) for v in values):
+        return np.int64
+    if all(isinstance(v, (bool, int, float, np.number)) or _is_long(v) for v in values):
+        return np.float64
+    return None
+
+def _is_long(value):
+    return type(value).__name__ == 'long'
+
+def _is_number(value):
+    return isinstance(value, (bool, int, float, np.number)) or _is_long(value)
+
+def _text(value):
+    return value if isinstance(value, type(u'')) else (u'%s' % (value,))
+
+def _json(value):
+    # Numbers and text as JSON, anything else as its text
+    value = value.item() if isinstance(value, np.generic) else value
+    text = json.dumps(value if _is_number(value) else _text(value))
+    return text.decode('utf-8') if isinstance(text, bytes) else text
+
+def _column(n, rows, codes, distinct):
+    '''
+    Builds the column of ``n`` vertices where vertex ``rows[k]`` has value
+    ``distinct[codes[k]]``
+    '''
+    dtype = _numeric_dtype(distinct)
+    if dtype is not None:
+        values = np.zeros(n, dtype=dtype)
+        mask = np.zeros(n, dtype=bool)
+        values[rows] = np.array(distinct, dtype=dtype)[codes] if len(distinct) else 0
+        mask[rows] = True
+        return NumericColumn(values, None if mask.all() else mask)
+    kind = 'mixed' if any(_is_number(v) for v in distinct) else 'string'
+    strings = [(_json if kind == 'mixed' else _text)(v) for v in distinct]
+    full = np.full(n, -1, dtype=np.int32)
+    full[rows] = codes
+    return text_column(kind, full, StringPool.from_strings(strings))
+
+def concat(parts, ids):
+    '''
+    Joins the attributes of several graphs, given as ``(ids,
+    NodeAttributes)`` pairs, into ``NodeAttributes`` over the sorted
+    ``ids`` that contain all of them
+    '''
+    names = []
+    for _, attrs in parts:
+        names += [name for name in attrs.names() if name not in names]
+    columns = []
+    for name in names:
+        kinds = [attrs.column(name) for _, attrs in parts if name in attrs.names()]
+        if all(c.kind == 'numeric' for c in kinds):
+            dtype = np.result_type(*[c.values.dtype for c in kinds])
+            values = np.zeros(len(ids), dtype=dtype)
+            mask = np.zeros(len(ids), dtype=bool)
+            for part_ids, attrs in parts:
+                if name in attrs.names():
+                    c = attrs.column(name)
+                    rows = np.searchsorted(ids, part_ids)
+                    present = c.present()
+                    values[rows[present]] = np.asarray(c.values)[present]
+                    mask[rows[present]] = True
+            columns.append((name, NumericColumn(values, None if mask.all() else mask)))
+            continue
+        # Text: merge the pools and renumber the codes of every part. Text
+        # and numbers from different parts make a mixed column
+        kind = 'string' if all(c.kind == 'string' for c in kinds) else 'mixed'
+        pool, index = [], {}
+        codes = np.full(len(ids), -1, dtype=np.int32)
+        for part_ids, attrs in parts:
+            if name not in attrs.names():
+                continue
+            c = attrs.column(name)
+            rows = np.searchsorted(ids, part_ids)
+            if c.kind == 'numeric':
+                values = c.to_list()
+                present = np.array([v is not None for v in values], dtype=bool)
+                strings = [_json(v) for v in values if v is not None]
+                part_codes = np.arange(len(strings))
+            else:
+                present = c.present()
+                strings = c.pool.strings()
+                if c.kind != kind:
+                    strings = [_json(v) for v in strings]
+                part_codes = np.asarray(c.codes)[present]
+            for s in strings:
+                if s not in index:
+                    index[s] = len(pool)
+                    pool.append(s)
+            remap = np.array([index[s] for s in strings], dtype=np.int32)
+            codes[rows[present]] = remap[part_codes] if len(part_codes) else part_codes
+        columns.append((name, text_column(kind, codes, StringPool.from_strings(pool))))
+    return NodeAttributes(ids, columns)
+
+##########################################################################
+# Serialization
+##########################################################################
+
+def save_attributes(path, ids, attrs):
+    '''
+    Writes node attributes (``NodeAttributes`` or a dict of attribute
+    dicts) of a graph with the sorted node ``ids`` to the ``attrs``
+    directory of the graph directory ``path``
+    '''
+    attrs = as_attributes(ids, attrs)
+    directory = os.path.join(path, _directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    schema = []
+    for i, name in enumerate(attrs.names()):
+        column = attrs.column(name)
+        prefix = os.path.join(directory, '%d.' % i)
+        if column.kind == 'numeric':
+            np.save(prefix + 'values.npy', column.values)
+            if column.mask is not None:
+                np.save(prefix + 'mask.npy', column.mask)
+            schema.append({'name': name, 'kind': 'numeric', 'masked': column.mask is not None})
+        else:
+            np.save(prefix + 'codes.npy', column.codes)
+            np.save(prefix + 'pool.npy', column.pool.data)
+            np.save(prefix + 'pool_offsets.npy', column.pool.offsets)
+            schema.append({'name': name, 'kind': column.kind})
+    text = json.dumps({'columns': schema}, ensure_ascii=False)
+    with io.open(os.path.join(directory, _schema), 'w', encoding='utf-8') as f:
+        f.write(text.decode('utf-8') if isinstance(text, bytes) else text)
+
+def load_attributes(path, ids):
+    '''
+    Returns the ``NodeAttributes`` stored with the graph in the directory
+    ``path``; no column is read until it is accessed
+    '''
+    if os.path.exists(os.path.join(path, _directory, _schema)):
+        return NodeAttributes(ids, path=path)
+    return NodeAttributes(ids)
+
+def _read_schema(path):
+    with io.open(os.path.join(path, _directory, _schema), 'r', encoding='utf-8') as f:
+        return json.load(f)['columns']
+
+def _load_column(path, i, spec):
+    prefix = os.path.join(path, _directory, '%d.' % i)
+    load = lambda name: np.load(prefix + name + '.npy', mmap_mode='r')
+    if spec['kind'] == 'numeric':
+        return NumericColumn(load('values'), load('mask') if spec.get('masked') else None)
+    return text_column(spec['kind'], load('codes'), StringPool(load('pool'), load('pool_offsets')))
+
+__all__ = ['NodeAttributes', 'NumericColumn', 'StringColumn', 'MixedColumn', 'StringPool', 'AttributeBuilder',
+           'save_attributes', 'load_attributes']
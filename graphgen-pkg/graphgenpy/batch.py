@@ -0,0 +1,129 @@
+# batch.py
+# Concurrent extraction of many queries under a memory budget.
+#
+# Every extraction launches a JVM whose maximum heap is fixed up front, so
+# running them side by side is only safe while the sum of their heaps fits
+# in memory. A `MemoryBudget` admits extractions until the budget is used
+# up and makes the rest wait for running ones to finish.
+
+import os
+import re
+import threading
+from collections import namedtuple
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Memory a JVM uses beyond its heap (metaspace, code cache, thread stacks)
+JVM_OVERHEAD = 256 * 2 ** 20
+
+_units = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+def parse_size(size):
+    """
+    Convert a JVM style size such as ``'512m'`` or ``'10G'`` (or a number
+    of bytes) to bytes.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    m = re.match(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', size, re.IGNORECASE)
+    if not m:
+        raise ValueError('Invalid memory size: %r' % (size,))
+    return int(m.group(1)) * _units[m.group(2).lower()]
+
+def available_memory():
+    """
+    Return the number of bytes of memory available to new processes, from
+    ``MemAvailable`` in /proc/meminfo where possible and the physical
+    memory size otherwise.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+class MemoryBudget(object):
+    '''
+    An admission controller handing out reservations from a fixed number
+    of bytes. A reservation larger than the whole budget is admitted once
+    nothing else is running, so that it cannot wait forever.
+    '''
+
+    def __init__(self, total):
+        self.total = parse_size(total)
+        self.reserved = 0
+        self.running = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self.running and self.reserved + size > self.total:
+                self._cond.wait()
+            self.reserved += size
+            self.running += 1
+
+    def release(self, size):
+        with self._cond:
+            self.reserved -= size
+            self.running -= 1
+            self._cond.notify_all()
+
+# The outcome of one extraction of a batch: ``path`` is the written file on
+# success and ``error`` the raised exception on failure
+BatchResult = namedtuple('BatchResult', ['index', 'query', 'path', 'error'])
+
+def run_batch(extract, jobs, max_workers=None, reservation=0, budget=None):
+    """
+    Run ``extract(*job)`` for every job on up to ``max_workers`` threads,
+    each holding ``reservation`` bytes of ``budget`` while it runs (or
+    ``reservation(*job)`` bytes, called on the same thread just before).
+    Yields a ``BatchResult`` per job, in order of completion.
+    """
+    jobs = list(jobs)
+    if max_workers is None:
+        import multiprocessing
+        max_workers = multiprocessing.cpu_count()
+    if budget is None:
+        budget = MemoryBudget(available_memory())
+
+    pending = queue.Queue()
+    for item in enumerate(jobs):
+        pending.put(item)
+    results = queue.Queue()
+
+    def work():
+        while True:
+            try:
+                index, job = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                size = reservation(*job) if callable(reservation) else reservation
+            except Exception as e:
+                results.put(BatchResult(index, job[0], None, e))
+                continue
+            budget.acquire(size)
+            try:
+                result = BatchResult(index, job[0], extract(*job), None)
+            except Exception as e:
+                result = BatchResult(index, job[0], None, e)
+            finally:
+                budget.release(size)
+            results.put(result)
+
+    threads = [threading.Thread(target=work) for _ in range(min(max_workers, len(jobs)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for _ in jobs:
+        yield results.get()
+    for t in threads:
+        t.join()
+
+__all__ = ['MemoryBudget', 'BatchResult', 'available_memory', 'parse_size', 'run_batch']
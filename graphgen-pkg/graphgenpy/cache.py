@@ -0,0 +1,218 @@
+# cache.py
+# A content-addressed, size-bounded on-disk cache of extraction results.
+#
+# Entries are keyed on the normalized Datalog query, the connection target
+# and the output format, and are only served while the change markers of
+# the tables the query reads (from pg_stat_user_tables and pg_class) are the
+# same as when the entry was stored. Cached files are read-only and are
+# hard-linked to the output path on a hit, so outputs are replaced rather
+# than written in place.
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from . import datalog
+
+def normalize_query(query):
+    """
+    Return a canonical form of a Datalog query, so that queries differing
+    only in whitespace or layout share cache entries.
+    """
+    try:
+        return '\n'.join(str(rule) for rule in datalog.parse(query))
+    except SyntaxError:
+        return ' '.join(query.split())
+
+def table_markers(conn, tables):
+    """
+    Return a dict mapping each table to a change marker: its insert, update
+    and delete counters and its relfilenode (which changes on TRUNCATE).
+    Note that PostgreSQL publishes the counters with a short delay after
+    the modifying transaction commits.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT c.relname, c.relfilenode, "
+                   "coalesce(s.n_tup_ins, 0), coalesce(s.n_tup_upd, 0), coalesce(s.n_tup_del, 0) "
+                   "FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+                   "WHERE c.relname = ANY(%s) AND pg_table_is_visible(c.oid)",
+                   (sorted(tables),))
+    markers = dict((row[0], list(row[1:])) for row in cursor.fetchall())
+    cursor.close()
+    conn.rollback()
+    return markers
+
+class ExtractionCache(object):
+    '''
+    An LRU cache of extraction outputs (files or directories) stored under
+    ``directory`` and bounded to ``max_bytes`` in total.
+    '''
+
+    def __init__(self, directory=None, max_bytes=10 * 2 ** 30):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.graphgenpy', 'cache')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, query, target, serialization_format, engine='java'):
+        '''
+        Returns the cache key for a query against a connection target
+        (a tuple such as ``(host, port, dbname, username)``)
+        '''
+        text = json.dumps([normalize_query(query), [str(t) for t in target], serialization_format, engine])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def lookup(self, key, markers):
+        '''
+        Returns the path of the cached output for ``key`` if it was stored
+        with the same table markers, or None. Stale entries are dropped.
+        '''
+        entry = os.path.join(self.directory, key)
+        meta = _read_meta(entry)
+        with self._lock:
+            if meta is None:
+                self.misses += 1
+                return None
+            if meta['markers'] != markers:
+                self.misses += 1
+                _remove(entry)
+                return None
+            self.hits += 1
+        # The modification time of meta.json records the last use
+        os.utime(os.path.join(entry, 'meta.json'), None)
+        return os.path.join(entry, meta['name'])
+
+    def store(self, key, markers, path):
+        '''
+        Copies the output at ``path`` into the cache under ``key`` and
+        evicts least recently used entries to stay within ``max_bytes``.
+        Returns the path of the cached copy.
+        '''
+        name = os.path.basename(path.rstrip(os.sep))
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+        try:
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(staging, name))
+            else:
+                shutil.copy2(path, os.path.join(staging, name))
+            _freeze(os.path.join(staging, name))
+            meta = {'markers': markers, 'name': name, 'size': _size(staging), 'created': time.time()}
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            entry = os.path.join(self.directory, key)
+            _remove(entry)
+            os.rename(staging, entry)
+        except Exception:
+            _remove(staging)
+            raise
+        self.evict()
+        return os.path.join(entry, name)
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache fits
+        ``max_bytes``
+        '''
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            meta = _read_meta(entry)
+            if meta is not None:
+                used = os.path.getmtime(os.path.join(entry, 'meta.json'))
+                entries.append((used, meta['size'], entry))
+        total = sum(size for _, size, _ in entries)
+        for used, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(entry)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        for key in os.listdir(self.directory):
+            _remove(os.path.join(self.directory, key))
+
+    def stats(self):
+        '''
+        Returns hit/miss/eviction counters and the current cache size
+        '''
+        entries = [m for m in (_read_meta(os.path.join(self.directory, k))
+                               for k in os.listdir(self.directory)) if m is not None]
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'entries': len(entries), 'bytes': sum(m['size'] for m in entries),
+                'max_bytes': self.max_bytes}
+
+def place(cached, path):
+    """
+    Make the cached output available at ``path``, hard-linking its files
+    so that large outputs are not copied, and copying them only where
+    linking fails (e.g. across file systems). The files are read-only and
+    shared with the cache entry: replace the output at ``path`` (as
+    ``generateGraph`` does) rather than writing to it in place.
+    """
+    _remove(path)
+    if os.path.isdir(cached):
+        _link_tree(cached, path)
+    else:
+        _link(cached, path)
+    return path
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _link_tree(src, dst):
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        s, d = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(s):
+            _link_tree(s, d)
+        else:
+            _link(s, d)
+
+def _freeze(path):
+    # Makes the files of a cached output read-only
+    read_only = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    if not os.path.isdir(path):
+        os.chmod(path, read_only)
+        return
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            os.chmod(os.path.join(root, f), read_only)
+
+def _read_meta(entry):
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+__all__ = ['ExtractionCache']
@@ -0,0 +1,279 @@
+# canonical.py
+# Out-of-core canonicalization of edge lists.
+#
+# Self-join rules such as
+#
+#   Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+#
+# derive every pair of co-authors in both directions, a self-loop per author
+# and one copy of a pair per shared publication. `canonicalize` turns such a
+# stream of edges into a CSR graph of distinct edges, without self-loops by
+# default, whose ``weights`` count the copies of every edge. With
+# ``undirected=True`` the two directions of a pair are one edge, stored in
+# both directions with the larger of the two counts: above, the number of
+# publications the authors share.
+#
+# The edges are never all in memory. The stream is cut into runs of
+# ``run_size`` edges, each sorted, deduplicated and written to disk; the
+# runs are then merged a block of each at a time (MERGE_WIDTH runs at once,
+# in several passes if there are more), and the merged edges are placed
+# into the CSR arrays with the counting sort of ``csr.save_edges``. Memory
+# use is bounded by the run size and the number of nodes.
+
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import attributes
+from . import csr
+from . import readers
+
+# Edges sorted in memory at a time
+RUN_SIZE = 1 << 24
+# Runs merged at once
+MERGE_WIDTH = 64
+
+# Sort key (low endpoint, high endpoint, direction) and count of an edge
+_fields = (('lo', np.int64), ('hi', np.int64), ('direction', np.int8), ('count', np.int64))
+
+##########################################################################
+# Runs
+##########################################################################
+
+def _canonical(sources, targets, undirected, self_loops):
+    # The sort keys of a batch of edges, each with a count of one
+    sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+    if not self_loops:
+        keep = sources != targets
+        sources, targets = sources[keep], targets[keep]
+    if undirected:
+        lo, hi = np.minimum(sources, targets), np.maximum(sources, targets)
+        direction = (sources > targets).astype(np.int8)
+    else:
+        lo, hi, direction = sources, targets, np.zeros(len(sources), dtype=np.int8)
+    return [lo, hi, direction, np.ones(len(sources), dtype=np.int64)]
+
+def _reduce(columns):
+    # Sorts edges by key and sums the counts of equal keys
+    lo, hi, direction, count = columns
+    order = np.lexsort((direction, hi, lo))
+    lo, hi, direction, count = lo[order], hi[order], direction[order], count[order]
+    if len(lo) == 0:
+        return [lo, hi, direction, count]
+    new = np.ones(len(lo), dtype=bool)
+    new[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1]) | (direction[1:] != direction[:-1])
+    starts = np.flatnonzero(new)
+    return [lo[starts], hi[starts], direction[starts], np.add.reduceat(count, starts)]
+
+class _Run(object):
+    # A sorted, deduplicated run of edges in one file per field
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.length = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def append(self, columns):
+        for (name, dtype), values in zip(_fields, columns):
+            with open(self._file(name), 'ab') as f:
+                np.asarray(values, dtype=dtype).tofile(f)
+        self.length += len(columns[0])
+
+    def columns(self):
+        if self.length == 0:
+            return [np.zeros(0, dtype=dtype) for _, dtype in _fields]
+        return [np.memmap(self._file(name), dtype=dtype, mode='r') for name, dtype in _fields]
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def _not_after(columns, key):
+    # Whether every edge of sorted columns is not after ``key``
+    lo, hi, direction = columns[:3]
+    return (lo < key[0]) | ((lo == key[0]) & ((hi < key[1]) | ((hi == key[1]) & (direction <= key[2]))))
+
+def _merge(runs, block):
+    '''
+    Yields the edges of sorted runs as sorted, deduplicated chunks,
+    reading ``block`` edges of each run at a time
+    '''
+    columns = [run.columns() for run in runs]
+    cursors = [0] * len(runs)
+    while True:
+        active = [i for i in range(len(runs)) if cursors[i] < runs[i].length]
+        if not active:
+            return
+        ends = dict((i, min(cursors[i] + block, runs[i].length)) for i in active)
+        # Edges up to the smallest last key of a block that does not end its
+        # run are complete: every later edge of that run comes after it
+        bound = None
+        for i in active:
+            if ends[i] < runs[i].length:
+                key = tuple(c[ends[i] - 1] for c in columns[i][:3])
+                bound = key if bound is None or key < bound else bound
+        parts = []
+        for i in active:
+            part = [np.asarray(c[cursors[i]:ends[i]]) for c in columns[i]]
+            if bound is not None:
+                taken = int(np.count_nonzero(_not_after(part, bound)))
+                part = [c[:taken] for c in part]
+            cursors[i] += len(part[0])
+            parts.append(part)
+        yield _reduce([np.concatenate(c) for c in zip(*parts)])
+
+def _runs(batches, directory, undirected, self_loops, run_size):
+    # Cuts a stream of (sources, targets) batches into sorted runs
+    runs, pending, size = [], [], 0
+
+    def flush():
+        run = _Run(os.path.join(directory, 'run%d' % len(runs)))
+        run.append(_reduce([np.concatenate(c) for c in zip(*pending)]))
+        runs.append(run)
+
+    for sources, targets in batches:
+        columns = _canonical(sources, targets, undirected, self_loops)
+        for start in range(0, len(columns[0]), run_size):
+            part = [c[start:start + run_size] for c in columns]
+            pending.append(part)
+            size += len(part[0])
+            if size >= run_size:
+                flush()
+                pending, size = [], 0
+    if pending:
+        flush()
+    elif not runs:
+        runs.append(_Run(os.path.join(directory, 'run0')))
+    return runs
+
+def _merged(runs, directory, run_size):
+    # Merges the runs, MERGE_WIDTH at a time, until one merge remains
+    passes = 0
+    while len(runs) > MERGE_WIDTH:
+        merged = []
+        for start in range(0, len(runs), MERGE_WIDTH):
+            group = runs[start:start + MERGE_WIDTH]
+            run = _Run(os.path.join(directory, 'pass%d-%d' % (passes, len(merged))))
+            for chunk in _merge(group, max(1, run_size // len(group))):
+                run.append(chunk)
+            for old in group:
+                old.remove()
+            merged.append(run)
+        runs, passes = merged, passes + 1
+    return _merge(runs, max(1, run_size // len(runs)))
+
+def _weighted(chunks):
+    '''
+    Yields ``(lo, hi, weight)`` arrays of the distinct edges of merged
+    chunks, with the larger count of the two directions of an edge
+    '''
+    carry = None
+    for lo, hi, _, count in chunks:
+        if carry is not None:
+            lo, hi, count = [np.concatenate(pair) for pair in zip(carry, (lo, hi, count))]
+        if len(lo) == 0:
+            continue
+        new = np.ones(len(lo), dtype=bool)
+        new[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+        starts = np.flatnonzero(new)
+        lo, hi, weight = lo[starts], hi[starts], np.maximum.reduceat(count, starts)
+        # The last edge may have its other direction in the next chunk
+        carry = (lo[-1:], hi[-1:], weight[-1:])
+        if len(lo) > 1:
+            yield lo[:-1], hi[:-1], weight[:-1]
+    if carry is not None:
+        yield carry
+
+##########################################################################
+# Canonicalization
+##########################################################################
+
+def canonicalize(batches, path, undirected=False, self_loops=False, node_ids=None, attrs=None,
+                 run_size=RUN_SIZE, tmpdir=None):
+    '''
+    Writes the graph of a stream of edges to the directory ``path`` like
+    ``csr.save_csr``, with every edge once and the number of its copies in
+    the stream as its weight. Self-loops are dropped unless
+    ``self_loops`` is set. With ``undirected`` the two directions of an
+    edge are merged, and the edge is stored in both directions.
+
+    :param batches: An iterable of ``(sources, targets)`` arrays of node
+        ids, such as ``DatalogEngine.edge_batches(query, distinct=False)``.
+    :param node_ids: Node ids to include besides the edge endpoints, e.g.
+        those of the Nodes rule, and ``attrs`` their attributes. Both are
+        only read once the stream is consumed, so they can be filled while
+        it is read.
+    :param run_size: The number of edges sorted in memory at a time.
+    :param tmpdir: Where runs are spilled, the default temporary directory
+        if None.
+    '''
+    spill = tempfile.mkdtemp(prefix='graphgen-canonical-', dir=tmpdir)
+    try:
+        chunks = _merged(_runs(batches, spill, undirected, self_loops, run_size), spill, run_size)
+        output = _Run(os.path.join(spill, 'edges'))
+        seen = [np.zeros(0, dtype=np.int64) if node_ids is None else np.asarray(node_ids, dtype=np.int64)]
+        for lo, hi, weight in _weighted(chunks):
+            if undirected:
+                mirror = lo != hi
+                lo, hi, weight = (np.concatenate([lo, hi[mirror]]), np.concatenate([hi, lo[mirror]]),
+                                  np.concatenate([weight, weight[mirror]]))
+            output.append([lo, hi, np.zeros(len(lo), dtype=np.int8), weight])
+            seen.append(np.unique(np.concatenate([lo, hi])))
+            if len(seen) > 64:
+                seen = [np.unique(np.concatenate(seen))]
+        ids = np.unique(np.concatenate(seen))
+        sources, targets, _, weights = output.columns()
+        csr.save_edges(path, ids, sources, targets, attrs, weights=weights)
+        del sources, targets, weights
+    finally:
+        shutil.rmtree(spill, ignore_errors=True)
+    return path
+
+def _csr_batches(graph, chunksize=1 << 22):
+    offsets = np.asarray(graph.offsets)
+    for start in range(0, graph.number_of_edges(), chunksize):
+        positions = np.arange(start, min(start + chunksize, graph.number_of_edges()))
+        rows = np.searchsorted(offsets, positions, side='right') - 1
+        yield np.asarray(graph.ids)[rows], np.asarray(graph.ids)[np.asarray(graph.neighbors[start:start + chunksize])]
+
+def canonicalize_file(source, path, serialization_format=None, undirected=False, self_loops=False,
+                      run_size=RUN_SIZE, tmpdir=None):
+    '''
+    Canonicalizes a serialized graph (see ``canonicalize``): a GML or
+    GraphSON file, read a chunk at a time, or a CSR directory. Its nodes
+    and their attributes are kept. Node ids must be integers. Returns
+    ``path``.
+    '''
+    if serialization_format is None:
+        serialization_format = ('csr' if os.path.isdir(source) else
+                                readers._extensions.get(os.path.splitext(source)[1].lower(), 'gml'))
+    if serialization_format == 'csr':
+        graph = csr.load_csr(source)
+        return canonicalize(_csr_batches(graph), path, undirected, self_loops, graph.ids, graph.attrs,
+                            run_size, tmpdir)
+
+    node_ids, builder = [], attributes.AttributeBuilder()
+
+    def batches(f):
+        for chunk in readers.chunked(readers.iter_records(f, serialization_format), 1 << 16):
+            sources, targets = [], []
+            for record in chunk:
+                if isinstance(record, readers.Edge):
+                    sources.append(record.source)
+                    targets.append(record.target)
+                else:
+                    node_ids.append(record.id)
+                    if record.attrs:
+                        builder.add(record.id, record.attrs)
+            yield sources, targets
+
+    with io.open(source, 'r', encoding='utf-8') as f:
+        return canonicalize(batches(f), path, undirected, self_loops, node_ids, builder, run_size, tmpdir)
+
+__all__ = ['canonicalize', 'canonicalize_file']
@@ -0,0 +1,369 @@
+# condensed.py
+# Condensed (virtual-node) graphs, the Python counterpart of GraphGen's
+# CondensedCSRGraph.
+#
+# A self-join rule such as
+#
+#   Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+#
+# connects every pair of authors of a paper. Instead of expanding each paper
+# into a clique, a condensed graph keeps one virtual node per join key value
+# (per paper) with links from the authors on the left of the join to it and
+# from it to the authors on the right, i.e. the underlying bipartite graph.
+#
+# A hybrid graph only keeps virtual nodes for the heavy join keys, whose
+# cliques are much larger than their links, and stores the edges of all
+# other keys directly (see `compile_condensed` and the `planner` module).
+
+import json
+import os
+
+import numpy as np
+
+from . import attributes
+from . import csr
+from . import datalog
+
+##########################################################################
+# Rule analysis
+##########################################################################
+
+class JoinSplit(object):
+    '''
+    An ``Edges`` rule split into a left half that binds the source, a right
+    half that binds the target, and the join key variables they share.
+    '''
+
+    def __init__(self, rule, left, right, key, left_comparisons, right_comparisons, self_loops):
+        self.rule = rule
+        self.left = left
+        self.right = right
+        self.key = key
+        self.left_comparisons = left_comparisons
+        self.right_comparisons = right_comparisons
+        self.self_loops = self_loops
+
+    def half(self, side):
+        '''
+        Returns the rule ``(node, key...) :- <atoms of that side>``
+        '''
+        atoms, comparisons, node = ((self.left, self.left_comparisons, self.rule.head.terms[0])
+                                    if side == 'left' else
+                                    (self.right, self.right_comparisons, self.rule.head.terms[1]))
+        head = datalog.Atom(side, (node,) + tuple(datalog.Var(k) for k in self.key))
+        return datalog.Rule(head, tuple(atoms), tuple(comparisons))
+
+def _term_vars(terms):
+    return set(t.name for t in terms if isinstance(t, datalog.Var))
+
+def split_rule(rule):
+    '''
+    Splits an ``Edges`` rule written as a left half followed by a right
+    half into a ``JoinSplit``, picking the split point with the smallest
+    join key.
+    :raise ValueError: If the rule cannot be condensed.
+    '''
+    source, target = rule.head.terms[:2]
+    if not (isinstance(source, datalog.Var) and isinstance(target, datalog.Var)):
+        raise ValueError('Condensed extraction needs variables as edge endpoints')
+    best = None
+    for k in range(1, len(rule.atoms)):
+        left, right = rule.atoms[:k], rule.atoms[k:]
+        lvars = _term_vars(t for a in left for t in a.terms)
+        rvars = _term_vars(t for a in right for t in a.terms)
+        if source.name not in lvars or target.name not in rvars:
+            continue
+        if source.name in rvars or target.name in lvars:
+            continue
+        key = sorted(lvars & rvars)
+        if key and (best is None or len(key) < len(best[2])):
+            best = (left, right, key, lvars, rvars)
+    if best is None:
+        raise ValueError('Rule %s is not a join of two halves on a shared key' % (rule,))
+    left, right, key, lvars, rvars = best
+
+    lcomps, rcomps, self_loops = [], [], True
+    for c in rule.comparisons:
+        names = _term_vars((c.left, c.right))
+        if names == set([source.name, target.name]) and c.op == '<>':
+            # ID1 != ID2 only removes self-loops
+            self_loops = False
+            continue
+        placed = False
+        if names <= lvars:
+            lcomps.append(c)
+            placed = True
+        if names <= rvars:
+            rcomps.append(c)
+            placed = True
+        if not placed:
+            raise ValueError('Comparison %s%s%s spans both halves of the join and cannot be condensed'
+                             % (datalog._term_str(c.left), c.op, datalog._term_str(c.right)))
+    return JoinSplit(rule, left, right, key, lcomps, rcomps, self_loops)
+
+def compile_condensed(split, columns, expand_factor=None):
+    '''
+    Compiles a ``JoinSplit`` into one statement returning
+    ``(side, node, virtual)`` rows, where side is 0 for source-to-virtual
+    links and 1 for virtual-to-target links. Virtual node numbers are
+    assigned to the key values present on both sides.
+
+    With ``expand_factor`` (a hybrid graph) only the keys whose ``l * r``
+    edges are more than ``expand_factor`` times their ``l + r`` links
+    become virtual nodes; the edges of the other keys are returned as
+    ``(2, source, target)`` rows.
+    '''
+    lsql, lparams = datalog.compile_rule(split.half('left'), columns, distinct=True)
+    rsql, rparams = datalog.compile_rule(split.half('right'), columns, distinct=True)
+    keys = ['k%d' % i for i in range(len(split.key))]
+    cols = ', '.join(['node'] + keys)
+    klist = ', '.join(keys)
+    if expand_factor is None:
+        sql = ('WITH l(%(cols)s) AS (%(l)s), r(%(cols)s) AS (%(r)s), '
+               'k AS (SELECT %(keys)s, row_number() OVER () - 1 AS vid FROM '
+               '(SELECT %(keys)s FROM l INTERSECT SELECT %(keys)s FROM r) x) '
+               'SELECT 0, l.node, k.vid FROM l JOIN k USING (%(keys)s) '
+               'UNION ALL SELECT 1, r.node, k.vid FROM r JOIN k USING (%(keys)s)'
+               % {'cols': cols, 'keys': klist, 'l': lsql, 'r': rsql})
+        return sql, lparams + rparams
+    sql = ('WITH l(%(cols)s) AS (%(l)s), r(%(cols)s) AS (%(r)s), '
+           'k AS (SELECT %(keys)s, row_number() OVER () - 1 AS vid FROM '
+           '(SELECT %(keys)s, count(*) AS n FROM l GROUP BY %(keys)s) kl JOIN '
+           '(SELECT %(keys)s, count(*) AS n FROM r GROUP BY %(keys)s) kr USING (%(keys)s) '
+           'WHERE kl.n * kr.n > %%s * (kl.n + kr.n)) '
+           'SELECT 0, l.node, k.vid FROM l JOIN k USING (%(keys)s) '
+           'UNION ALL SELECT 1, r.node, k.vid FROM r JOIN k USING (%(keys)s) '
+           'UNION ALL SELECT DISTINCT 2, l.node, r.node FROM l JOIN r USING (%(keys)s) '
+           'LEFT JOIN k USING (%(keys)s) WHERE k.vid IS NULL'
+           % {'cols': cols, 'keys': klist, 'l': lsql, 'r': rsql})
+    return sql, lparams + rparams + [expand_factor]
+
+##########################################################################
+# In-memory representation
+##########################################################################
+
+class CondensedGraph(object):
+    '''
+    A graph stored as real vertices linked through virtual nodes.
+
+    Real vertices are numbered like in ``csr.CSRGraph`` (``ids`` holds the
+    sorted node ids). The virtual nodes reached from vertex ``i`` are
+    ``virtuals[offsets[i]:offsets[i + 1]]`` and the vertices reached from
+    virtual node ``v`` are ``members[virtual_offsets[v]:virtual_offsets[v + 1]]``.
+    The neighbors of a vertex are the members of its virtual nodes.
+
+    A hybrid graph also has direct edges, ``edges[edge_offsets[i]:
+    edge_offsets[i + 1]]`` being the vertices vertex ``i`` links to without
+    a virtual node.
+    '''
+
+    def __init__(self, ids, offsets, virtuals, virtual_offsets, members,
+                 self_loops=True, attrs=None, path=None, edge_offsets=None, edges=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.virtuals = virtuals
+        self.virtual_offsets = virtual_offsets
+        self.members = members
+        self.self_loops = self_loops
+        self.edge_offsets = edge_offsets
+        self.edges = edges
+        self._attrs = attrs
+        self.path = path
+
+    @property
+    def attrs(self):
+        '''
+        ``attributes.NodeAttributes`` of the real vertices, also a mapping
+        of node id to its attribute dict
+        '''
+        if self._attrs is None and self.path:
+            self._attrs = attributes.load_attributes(self.path, self.ids)
+        elif not isinstance(self._attrs, attributes.NodeAttributes):
+            self._attrs = attributes.as_attributes(self.ids, self._attrs)
+        return self._attrs
+
+    def number_of_nodes(self):
+        return len(self.ids)
+
+    def number_of_virtual_nodes(self):
+        return len(self.virtual_offsets) - 1
+
+    def number_of_links(self):
+        '''
+        Returns the number of stored real-virtual links and direct edges
+        '''
+        return len(self.virtuals) + len(self.members) + self.number_of_direct_edges()
+
+    def number_of_direct_edges(self):
+        return 0 if self.edges is None else len(self.edges)
+
+    def is_hybrid(self):
+        return self.edges is not None
+
+    def index(self, id):
+        '''
+        Returns the vertex number of the node with the given id
+        '''
+        i = int(np.searchsorted(self.ids, id))
+        if i == len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def _successor_indices(self, i):
+        found = csr.gather_rows(self.virtual_offsets, self.members,
+                                self.virtuals[self.offsets[i]:self.offsets[i + 1]])
+        if self.edges is not None:
+            found = np.concatenate([found, self.edges[self.edge_offsets[i]:self.edge_offsets[i + 1]]])
+        found = np.unique(found)
+        if not self.self_loops:
+            found = found[found != i]
+        return found
+
+    def successors(self, id):
+        '''
+        Returns the ids of the distinct out-neighbors of a node, without
+        expanding the graph
+        '''
+        return self.ids[self._successor_indices(self.index(id))]
+
+    def out_degree(self, id):
+        '''
+        Returns the number of distinct out-neighbors of a node
+        '''
+        return len(self._successor_indices(self.index(id)))
+
+    def bfs(self, source, depth=None):
+        '''
+        Breadth-first search from ``source`` through the virtual nodes.
+        Every virtual node is expanded at most once, so the cost is linear
+        in the size of the condensed graph. Returns a dict mapping reached
+        node ids to their hop distance.
+        '''
+        n = self.number_of_nodes()
+        dist = np.full(n, -1, dtype=np.int64)
+        seen_virtual = np.zeros(self.number_of_virtual_nodes(), dtype=bool)
+        start = self.index(source)
+        dist[start] = 0
+        frontier, hops = np.array([start]), 0
+        while len(frontier) and (depth is None or hops < depth):
+            virtual = np.unique(csr.gather_rows(self.offsets, self.virtuals, frontier))
+            virtual = virtual[~seen_virtual[virtual]]
+            seen_virtual[virtual] = True
+            reached = csr.gather_rows(self.virtual_offsets, self.members, virtual)
+            if self.edges is not None:
+                reached = np.concatenate([reached, csr.gather_rows(self.edge_offsets, self.edges, frontier)])
+            reached = np.unique(reached)
+            frontier = reached[dist[reached] < 0]
+            hops += 1
+            dist[frontier] = hops
+        found = np.flatnonzero(dist >= 0)
+        return dict(zip(self.ids[found].tolist(), dist[found].tolist()))
+
+    def expand(self, batch=1 << 22):
+        '''
+        Materializes the deduplicated edges as a ``csr.CSRGraph``. Virtual
+        nodes are expanded in batches of about ``batch`` edges at a time.
+        '''
+        n = self.number_of_nodes()
+        # Transpose vertex->virtual links to get each virtual node's sources
+        sources = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.offsets))
+        order = np.argsort(self.virtuals, kind='mergesort')
+        left = sources[order]
+        left_offsets = np.zeros(self.number_of_virtual_nodes() + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.virtuals, minlength=self.number_of_virtual_nodes()), out=left_offsets[1:])
+
+        a = np.diff(left_offsets)
+        b = np.diff(self.virtual_offsets)
+        sizes = a * b
+        ends = np.cumsum(sizes)
+        keys, start = [], 0
+        while start < len(sizes):
+            done = ends[start - 1] if start else 0
+            end = max(int(np.searchsorted(ends, done + batch, side='right')), start + 1)
+            counts = sizes[start:end]
+            total = int(counts.sum())
+            if total:
+                vrep = np.repeat(np.arange(start, end), counts)
+                local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                brep = b[vrep]
+                src = left[left_offsets[vrep] + local // brep]
+                dst = self.members[self.virtual_offsets[vrep] + local % brep]
+                keys.append(np.unique(src * n + dst))
+            start = end
+        if self.edges is not None:
+            src = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.edge_offsets))
+            keys.append(src * n + self.edges)
+        pairs = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+        src, dst = pairs // n, pairs % n
+        if not self.self_loops:
+            keep = src != dst
+            src, dst = src[keep], dst[keep]
+        return csr.from_edges(self.ids, src, dst, self.attrs)
+
+    def __repr__(self):
+        return '<CondensedGraph: %d nodes, %d virtual nodes, %d links>' % (
+            self.number_of_nodes(), self.number_of_virtual_nodes(), self.number_of_links())
+
+##########################################################################
+# Construction
+##########################################################################
+
+def from_links(node_ids, left_nodes, left_virtual, right_nodes, right_virtual,
+               n_virtual, self_loops=True, attrs=None, edge_sources=None, edge_targets=None):
+    '''
+    Builds a ``CondensedGraph`` from the node ids of the ``Nodes`` rule and
+    the (node id, virtual node) links of both halves of the join, plus the
+    (source id, target id) direct edges of a hybrid graph
+    '''
+    endpoints = [] if edge_sources is None else [edge_sources, edge_targets]
+    ids = np.unique(np.concatenate([node_ids, left_nodes, right_nodes] + endpoints))
+    n = len(ids)
+    dtype = csr._index_dtype(max(n, n_virtual))
+    lsrc = np.searchsorted(ids, left_nodes)
+    order = np.argsort(lsrc, kind='mergesort')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(lsrc, minlength=n), out=offsets[1:])
+    virtuals = np.asarray(left_virtual, dtype=dtype)[order]
+
+    order = np.argsort(right_virtual, kind='mergesort')
+    members = np.searchsorted(ids, right_nodes).astype(dtype)[order]
+    virtual_offsets = np.zeros(n_virtual + 1, dtype=np.int64)
+    np.cumsum(np.bincount(right_virtual, minlength=n_virtual), out=virtual_offsets[1:])
+    edge_offsets = edges = None
+    if edge_sources is not None:
+        direct = csr.from_edges(ids, np.searchsorted(ids, edge_sources), np.searchsorted(ids, edge_targets))
+        edge_offsets, edges = direct.offsets, direct.neighbors
+    return CondensedGraph(ids, offsets, virtuals, virtual_offsets, members,
+                          self_loops, attributes.as_attributes(ids, attrs),
+                          edge_offsets=edge_offsets, edges=edges)
+
+##########################################################################
+# Serialization
+##########################################################################
+
+_arrays = ('ids', 'offsets', 'virtuals', 'virtual_offsets', 'members')
+_hybrid_arrays = ('edge_offsets', 'edges')
+
+def save_condensed(graph, path):
+    '''
+    Writes a ``CondensedGraph`` to the directory ``path``
+    '''
+    names = _arrays + (_hybrid_arrays if graph.is_hybrid() else ())
+    csr.save_arrays(path, dict((name, getattr(graph, name)) for name in names), graph.attrs)
+    with open(os.path.join(path, 'condensed.json'), 'w') as f:
+        json.dump({'self_loops': graph.self_loops, 'hybrid': graph.is_hybrid()}, f)
+    return path
+
+def load_condensed(path, mmap=True):
+    '''
+    Opens a graph written by ``save_condensed``, memory-mapped like
+    ``csr.load_csr``
+    '''
+    with open(os.path.join(path, 'condensed.json')) as f:
+        meta = json.load(f)
+    hybrid = csr.load_arrays(path, _hybrid_arrays, mmap) if meta.get('hybrid') else (None, None)
+    return CondensedGraph(*csr.load_arrays(path, _arrays, mmap),
+                          self_loops=meta['self_loops'], path=path,
+                          edge_offsets=hybrid[0], edges=hybrid[1])
+
+__all__ = ['CondensedGraph', 'split_rule', 'save_condensed', 'load_condensed']
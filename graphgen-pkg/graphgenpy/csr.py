@@ -0,0 +1,337 @@
+# csr.py
+# Compact binary (CSR) graphs for the Python wrapper of the GraphGen system.
+#
+# A CSR graph is stored on disk as a directory of .npy arrays, so that it can
+# be memory-mapped: it opens in constant time, uses no heap until touched and
+# its pages are shared between processes through the page cache.
+
+import os
+import shutil
+
+import numpy as np
+
+from . import attributes
+from . import readers
+
+##########################################################################
+# In-memory representation
+##########################################################################
+
+class CSRGraph(object):
+    '''
+    A directed graph stored as contiguous integer arrays.
+
+    Vertices are numbered ``0..n-1`` in ascending order of their original
+    node ids, which are kept in ``ids``. The out-neighbors of vertex ``i``
+    are ``neighbors[offsets[i]:offsets[i + 1]]``. Node attributes are kept
+    apart from the topology, in the columns of ``attrs``, and are only read
+    from disk on first access. ``weights``, if not None, holds the weight
+    of every edge, aligned with ``neighbors``.
+    '''
+
+    def __init__(self, ids, offsets, neighbors, attrs=None, path=None, weights=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+        self._attrs = attrs
+        self.path = path
+
+    @property
+    def attrs(self):
+        '''
+        ``attributes.NodeAttributes``: the attribute columns, also a
+        mapping of node id to its attribute dict
+        '''
+        if self._attrs is None and self.path:
+            self._attrs = attributes.load_attributes(self.path, self.ids)
+        elif not isinstance(self._attrs, attributes.NodeAttributes):
+            self._attrs = attributes.as_attributes(self.ids, self._attrs)
+        return self._attrs
+
+    def number_of_nodes(self):
+        return len(self.ids)
+
+    def number_of_edges(self):
+        return len(self.neighbors)
+
+    def index(self, id):
+        '''
+        Returns the vertex number of the node with the given id
+        '''
+        i = int(np.searchsorted(self.ids, id))
+        if i == len(self.ids) or self.ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def successors(self, id):
+        '''
+        Returns the ids of the out-neighbors of the node with the given id
+        '''
+        i = self.index(id)
+        return self.ids[self.neighbors[self.offsets[i]:self.offsets[i + 1]]]
+
+    def out_degree(self):
+        '''
+        Returns the out-degree of every vertex as an array
+        '''
+        return np.diff(self.offsets)
+
+    def to_scipy(self):
+        '''
+        Returns the adjacency matrix as a ``scipy.sparse.csr_matrix`` of
+        the edge weights (1 for unweighted graphs); parallel edges are
+        summed
+        '''
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ImportError("Could not import \"scipy\". "
+                              "Please install scipy to convert graphs to sparse matrices.")
+        n = self.number_of_nodes()
+        data = np.ones(self.number_of_edges(), dtype=np.int64) if self.weights is None else self.weights
+        matrix = sparse.csr_matrix((data, self.neighbors, self.offsets), shape=(n, n))
+        matrix.sum_duplicates()
+        return matrix
+
+    def to_networkx(self, create_using=None):
+        '''
+        Returns the graph as a NetworkX graph keyed on the original node
+        ids, with node attributes attached (a ``DiGraph`` by default) and
+        edge weights as the ``weight`` attribute
+        '''
+        import networkx as nx
+        G = nx.DiGraph() if create_using is None else create_using
+        G.add_nodes_from(zip(self.ids.tolist(), self.attrs.dicts()))
+        sources = np.repeat(self.ids, np.diff(self.offsets)).tolist()
+        if self.weights is None:
+            G.add_edges_from(zip(sources, self.ids[self.neighbors].tolist()))
+        else:
+            G.add_weighted_edges_from(zip(sources, self.ids[self.neighbors].tolist(), self.weights.tolist()))
+        return G
+
+    def __repr__(self):
+        return '<CSRGraph: %d nodes, %d edges>' % (self.number_of_nodes(), self.number_of_edges())
+
+##########################################################################
+# Construction
+##########################################################################
+
+class CSRBuilder(object):
+    '''
+    Accumulates node and edge records in chunked arrays and turns them
+    into a ``CSRGraph``. Node ids must be integers.
+    '''
+
+    def __init__(self, chunksize=1 << 16):
+        self.chunksize = chunksize
+        self.attrs = attributes.AttributeBuilder()
+        self._nodes, self._sources, self._targets = [], [], []
+        self._node_chunks, self._source_chunks, self._target_chunks = [], [], []
+
+    def add_node(self, id, attrs=None):
+        self._nodes.append(id)
+        if attrs:
+            self.attrs.add(id, attrs)
+        if len(self._nodes) >= self.chunksize:
+            self._flush_nodes()
+
+    def add_edge(self, source, target):
+        self._sources.append(source)
+        self._targets.append(target)
+        if len(self._sources) >= self.chunksize:
+            self._flush_edges()
+
+    def add_edges(self, sources, targets):
+        '''
+        Adds a batch of edges given as two sequences of endpoint ids
+        '''
+        self._source_chunks.append(_id_array(sources))
+        self._target_chunks.append(_id_array(targets))
+
+    def add_records(self, records):
+        '''
+        Adds ``readers.Node`` and ``readers.Edge`` records
+        '''
+        for record in records:
+            if isinstance(record, readers.Edge):
+                self.add_edge(record.source, record.target)
+            else:
+                self.add_node(record.id, record.attrs)
+
+    def _flush_nodes(self):
+        self._node_chunks.append(_id_array(self._nodes))
+        self._nodes = []
+
+    def _flush_edges(self):
+        self._source_chunks.append(_id_array(self._sources))
+        self._target_chunks.append(_id_array(self._targets))
+        self._sources, self._targets = [], []
+
+    def build(self):
+        self._flush_nodes()
+        self._flush_edges()
+        sources = np.concatenate(self._source_chunks)
+        targets = np.concatenate(self._target_chunks)
+        # Vertices referenced only by edges still get a vertex number
+        ids = np.unique(np.concatenate(self._node_chunks + [sources, targets]))
+        self._node_chunks, self._source_chunks, self._target_chunks = [], [], []
+        return from_edges(ids, np.searchsorted(ids, sources),
+                          np.searchsorted(ids, targets), self.attrs.build(ids))
+
+def _id_array(values):
+    try:
+        return np.array(values, dtype=np.int64)
+    except (ValueError, TypeError, OverflowError):
+        raise ValueError('CSR graphs require integer node ids')
+
+def _index_dtype(n):
+    return np.int32 if n < 2 ** 31 else np.int64
+
+def from_edges(ids, sources, targets, attrs=None):
+    '''
+    Builds a ``CSRGraph`` from the sorted node ids and two arrays holding
+    the vertex numbers of the endpoints of every edge. ``attrs`` may be
+    ``attributes.NodeAttributes`` or a dict of attribute dicts.
+    '''
+    n = len(ids)
+    order = np.argsort(sources, kind='mergesort')
+    neighbors = np.asarray(targets, dtype=_index_dtype(n))[order]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return CSRGraph(ids, offsets, neighbors, attributes.as_attributes(ids, attrs))
+
+def from_records(records):
+    '''
+    Builds a ``CSRGraph`` from an iterable of node and edge records, or of
+    lists of records as produced by ``GraphGenerator.streamGraph``
+    '''
+    builder = CSRBuilder()
+    for record in records:
+        if isinstance(record, list):
+            builder.add_records(record)
+        else:
+            builder.add_records((record,))
+    return builder.build()
+
+def gather_rows(offsets, values, rows):
+    '''
+    Returns the concatenation of ``values[offsets[r]:offsets[r + 1]]`` for
+    every ``r`` in ``rows``, without a Python-level loop
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = np.asarray(offsets[rows])
+    lengths = np.asarray(offsets[rows + 1]) - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return values[:0]
+    ends = np.cumsum(lengths)
+    positions = np.arange(total) + np.repeat(starts - (ends - lengths), lengths)
+    return values[positions]
+
+def save_edges(path, ids, sources, targets, attrs=None, chunksize=1 << 22, weights=None):
+    '''
+    Writes a graph to the directory ``path`` in the layout of ``save_csr``
+    from the sorted node ids and two arrays of edge endpoint ids, which may
+    be memory maps of files larger than memory. The edges are placed with
+    a counting sort, ``chunksize`` at a time, straight into a memory-mapped
+    neighbors file (and their ``weights``, if given, into a weights file),
+    so only arrays over the nodes are held in memory. The result equals
+    ``save_csr(from_edges(...))``.
+    '''
+    n, m = len(ids), len(sources)
+    counts = np.zeros(n, dtype=np.int64)
+    for start in range(0, m, chunksize):
+        counts += np.bincount(np.searchsorted(ids, sources[start:start + chunksize]), minlength=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    del counts
+
+    _clear(path)
+    neighbors = np.lib.format.open_memmap(os.path.join(path, 'neighbors.npy'), mode='w+',
+                                          dtype=_index_dtype(n), shape=(m,))
+    placed = None
+    if weights is not None:
+        placed = np.lib.format.open_memmap(os.path.join(path, 'weights.npy'), mode='w+',
+                                           dtype=weights.dtype, shape=(m,))
+    cursor = offsets[:-1].copy()
+    for start in range(0, m, chunksize):
+        src = np.searchsorted(ids, sources[start:start + chunksize])
+        dst = np.searchsorted(ids, targets[start:start + chunksize])
+        order = np.argsort(src, kind='mergesort')
+        src, dst = src[order], dst[order]
+        rows, first, sizes = np.unique(src, return_index=True, return_counts=True)
+        rank = np.arange(len(src)) - np.repeat(first, sizes)
+        neighbors[cursor[src] + rank] = dst
+        if placed is not None:
+            placed[cursor[src] + rank] = np.asarray(weights[start:start + chunksize])[order]
+        cursor[rows] += sizes
+    neighbors.flush()
+    del neighbors
+    if placed is not None:
+        placed.flush()
+        del placed
+    return _write_arrays(path, {'ids': ids, 'offsets': offsets}, attrs)
+
+##########################################################################
+# Serialization
+##########################################################################
+
+_arrays = ('ids', 'offsets', 'neighbors')
+
+def save_csr(graph, path):
+    '''
+    Writes ``graph`` to the directory ``path`` as one .npy file per array,
+    with the node attribute columns in the ``attrs`` subdirectory
+    '''
+    names = _arrays + (('weights',) if graph.weights is not None else ())
+    return save_arrays(path, dict((name, getattr(graph, name)) for name in names), graph.attrs)
+
+def load_csr(path, mmap=True):
+    '''
+    Opens a graph written by ``save_csr``. With ``mmap=True`` the arrays
+    are read-only memory maps of the files; nothing is read until touched.
+    '''
+    ids, offsets, neighbors = load_arrays(path, _arrays, mmap)
+    weights = None
+    if os.path.exists(os.path.join(path, 'weights.npy')):
+        weights, = load_arrays(path, ('weights',), mmap)
+        if len(weights) != len(neighbors):
+            raise ValueError('%s has %d weights for %d edges' % (path, len(weights), len(neighbors)))
+    return CSRGraph(ids, offsets, neighbors, path=path, weights=weights)
+
+def save_arrays(path, arrays, attrs=None):
+    '''
+    Writes a dict of named arrays to the directory ``path``, one .npy file
+    each, and the node attributes ``attrs`` (over ``arrays['ids']``) with
+    ``attributes.save_attributes``. Whatever the directory held before
+    is removed.
+    '''
+    _clear(path)
+    return _write_arrays(path, arrays, attrs)
+
+def _clear(path):
+    # Starts the graph directory afresh: files of an earlier graph (such as
+    # its weights) must not be read with this one, and files hard-linked
+    # elsewhere must be replaced rather than written through
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+    os.makedirs(path)
+
+def _write_arrays(path, arrays, attrs=None):
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+    attributes.save_attributes(path, arrays['ids'], attrs)
+    return path
+
+def load_arrays(path, names, mmap=True):
+    '''
+    Loads the named arrays written by ``save_arrays``, memory-mapped
+    read-only if ``mmap`` is set
+    '''
+    mode = 'r' if mmap else None
+    return [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in names]
+
+__all__ = ['CSRGraph', 'CSRBuilder', 'save_csr', 'save_edges', 'load_csr']
@@ -0,0 +1,283 @@
+# datalog.py
+# Parser and SQL compiler for the GraphGen Datalog dialect.
+#
+# A program is a list of rules such as
+#
+#   Nodes(ID, Name) :- Author(ID, Name).
+#   Edges(ID1, ID2) :- AuthorPublication(ID1, PubID), AuthorPublication(ID2, PubID).
+#
+# Body atoms refer to database tables and bind their columns by position.
+# Bare identifiers are variables, `_` is a wildcard, quoted strings and
+# numbers are constants, and comparisons (`movie_id <= 200`) filter rows.
+
+import re
+from collections import namedtuple
+
+##########################################################################
+# Syntax tree
+##########################################################################
+
+Var = namedtuple('Var', ['name'])
+Const = namedtuple('Const', ['value'])
+Wildcard = namedtuple('Wildcard', [])
+Atom = namedtuple('Atom', ['name', 'terms'])
+Comparison = namedtuple('Comparison', ['left', 'op', 'right'])
+
+WILDCARD = Wildcard()
+
+class Rule(namedtuple('Rule', ['head', 'atoms', 'comparisons'])):
+    '''
+    A rule ``head :- atoms, comparisons.``
+    '''
+
+    def variables(self):
+        '''
+        Returns the set of variable names used in the body atoms
+        '''
+        return set(t.name for a in self.atoms for t in a.terms if isinstance(t, Var))
+
+    def __str__(self):
+        body = [_atom_str(a) for a in self.atoms]
+        body += ['%s%s%s' % (_term_str(c.left), c.op, _term_str(c.right)) for c in self.comparisons]
+        return '%s :- %s.' % (_atom_str(self.head), ', '.join(body))
+
+def _term_str(term):
+    if isinstance(term, Var):
+        return term.name
+    if isinstance(term, Const):
+        return repr(term.value) if not isinstance(term.value, str) else "'%s'" % term.value
+    return '_'
+
+def _atom_str(atom):
+    return '%s(%s)' % (atom.name, ','.join(_term_str(t) for t in atom.terms))
+
+##########################################################################
+# Parser
+##########################################################################
+
+_token = re.compile(r'''
+    \s*(?:
+      (?P<implies>:-) |
+      (?P<op><=|>=|!=|<>|=|<|>) |
+      (?P<punct>[(),.]) |
+      (?P<number>-?\d+(?:\.\d+)?(?!\w)) |
+      (?P<string>'[^']*'|"[^"]*") |
+      (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    )''', re.VERBOSE)
+
+def _tokenize(text):
+    pos, text = 0, text.strip()
+    while pos < len(text):
+        m = _token.match(text, pos)
+        if not m or m.end() == pos:
+            raise SyntaxError('Unexpected input in Datalog query at: %r' % text[pos:pos + 20])
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'string':
+            value = value[1:-1]
+        yield kind, value
+
+class _Parser(object):
+
+    def __init__(self, text):
+        self.tokens = list(_tokenize(text))
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        tok = self.peek()
+        if tok[0] is None or (kind and tok[0] != kind) or (value and tok[1] != value):
+            raise SyntaxError('Expected %s in Datalog query, found %r' % (value or kind, tok[1]))
+        self.pos += 1
+        return tok[1]
+
+    def program(self):
+        rules = []
+        while self.peek()[0] is not None:
+            rules.append(self.rule())
+        return rules
+
+    def rule(self):
+        head = self.atom()
+        self.take('implies')
+        atoms, comparisons = [], []
+        while True:
+            kind, value = self.peek()
+            nxt = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else (None, None)
+            if kind == 'ident' and nxt == ('punct', '('):
+                atoms.append(self.atom())
+            else:
+                left = self.term()
+                op = self.take('op')
+                comparisons.append(Comparison(left, '<>' if op == '!=' else op, self.term()))
+            if self.peek() == ('punct', ','):
+                self.take()
+                continue
+            self.take('punct', '.')
+            return Rule(head, tuple(atoms), tuple(comparisons))
+
+    def atom(self):
+        name = self.take('ident')
+        self.take('punct', '(')
+        terms = [self.term()]
+        while self.peek() == ('punct', ','):
+            self.take()
+            terms.append(self.term())
+        self.take('punct', ')')
+        return Atom(name, tuple(terms))
+
+    def term(self):
+        kind, value = self.peek()
+        if kind == 'ident':
+            self.take()
+            return WILDCARD if value == '_' else Var(value)
+        if kind in ('number', 'string'):
+            self.take()
+            return Const(value)
+        raise SyntaxError('Expected a term in Datalog query, found %r' % (value,))
+
+def parse(text):
+    '''
+    Parses a GraphGen Datalog program into a list of ``Rule`` objects.
+    :raise SyntaxError: If the program is malformed.
+    '''
+    rules = _Parser(text).program()
+    if not rules:
+        raise SyntaxError('Empty Datalog query')
+    return rules
+
+def node_rules(rules):
+    return [r for r in rules if r.head.name.lower() == 'nodes']
+
+def edge_rules(rules):
+    return [r for r in rules if r.head.name.lower() == 'edges']
+
+def tables(rules):
+    '''
+    Returns the set of (lower-cased) table names the rules read from
+    '''
+    return set(a.name.lower() for r in rules for a in r.atoms)
+
+##########################################################################
+# SQL compilation
+##########################################################################
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+class Catalog(object):
+    '''
+    Looks up (and caches) the ordered column names of database tables,
+    which Datalog atoms bind by position, or another field of their
+    ``information_schema.columns`` rows such as ``'data_type'``
+    '''
+
+    def __init__(self, conn, field='column_name'):
+        self.conn = conn
+        self.field = field
+        self._columns = {}
+
+    def __call__(self, table):
+        table = table.lower()
+        if table not in self._columns:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT " + quote_ident(self.field) + " FROM information_schema.columns "
+                           "WHERE table_name = %s AND table_schema = ANY(current_schemas(false)) "
+                           "ORDER BY ordinal_position", (table,))
+            columns = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            if not columns:
+                raise LookupError('Table %r referenced in Datalog query does not exist' % table)
+            self._columns[table] = columns
+        return self._columns[table]
+
+def compile_rule(rule, columns, sources=None, select=None, distinct=False, weight=None):
+    '''
+    Compiles a rule into a ``SELECT`` statement over its body atoms.
+    Returns ``(sql, params)`` for use with a DB-API cursor.
+    :param columns: A callable mapping a table name to its column names,
+        typically a ``Catalog``.
+    :param sources: Optional mapping of atom position to a SQL expression
+        (e.g. a subquery) to read that atom from instead of its table.
+    :param select: Optional list of head terms to select instead of the
+        rule head.
+    :param distinct: Whether to remove duplicate rows.
+    :param weight: Optional name of a multiplicity column that every atom
+        read from ``sources`` provides. The product of these columns is
+        selected after the head terms (1 for rows of plain tables).
+    '''
+    sources = sources or {}
+    bindings, where, params = {}, [], []
+    tables = []
+    for i, atom in enumerate(rule.atoms):
+        alias = 't%d' % i
+        cols = columns(atom.name)
+        if len(cols) < len(atom.terms):
+            raise ValueError('Atom %s has %d terms but table %s has %d columns'
+                             % (atom.name, len(atom.terms), atom.name.lower(), len(cols)))
+        tables.append('%s %s' % (sources.get(i, quote_ident(atom.name.lower())), alias))
+        for col, term in zip(cols, atom.terms):
+            expr = '%s.%s' % (alias, quote_ident(col))
+            if isinstance(term, Var):
+                if term.name in bindings:
+                    where.append('%s = %s' % (bindings[term.name], expr))
+                else:
+                    bindings[term.name] = expr
+            elif isinstance(term, Const):
+                where.append('%s = %%s' % expr)
+                params.append(term.value)
+
+    def operand(term, sink):
+        if isinstance(term, Var):
+            if term.name not in bindings:
+                raise ValueError('Variable %s in rule for %s is not bound by any atom'
+                                 % (term.name, rule.head.name))
+            return bindings[term.name]
+        if isinstance(term, Const):
+            sink.append(term.value)
+            return '%s'
+        raise ValueError('Wildcards are not allowed in rule heads or comparisons')
+
+    for c in rule.comparisons:
+        left = operand(c.left, params)
+        where.append('%s %s %s' % (left, c.op, operand(c.right, params)))
+
+    select_params = []
+    exprs = [operand(t, select_params) for t in (select or rule.head.terms)]
+    if weight is not None:
+        exprs.append(' * '.join('t%d.%s' % (i, quote_ident(weight)) for i in sorted(sources)) or '1')
+    sql = 'SELECT %s%s FROM %s' % ('DISTINCT ' if distinct else '', ', '.join(exprs), ', '.join(tables))
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return sql, select_params + params
+
+def compile_program(rules, columns):
+    '''
+    Compiles the ``Nodes`` and ``Edges`` rules of a program into one
+    statement each (a union over rules with the same head). Returns a dict
+    with ``(sql, params)`` pairs under ``'nodes'`` and ``'edges'``.
+    '''
+    compiled = {}
+    # Graphs are sets of nodes and edges, like the ones GraphGen writes
+    for key, group in (('nodes', node_rules(rules)), ('edges', edge_rules(rules))):
+        if not group:
+            continue
+        parts = [compile_rule(r, columns, distinct=True) for r in group]
+        compiled[key] = (' UNION '.join(sql for sql, _ in parts),
+                         [p for _, params in parts for p in params])
+    if 'edges' not in compiled:
+        raise ValueError('Datalog query has no Edges rule')
+    return compiled
+
+def head_names(rule):
+    '''
+    Returns the names of the head terms of a rule, used as attribute names
+    '''
+    return [t.name if isinstance(t, Var) else 'const%d' % i for i, t in enumerate(rule.head.terms)]
+
+__all__ = ['parse', 'compile_rule', 'compile_program', 'Catalog']
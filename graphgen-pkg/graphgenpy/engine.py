@@ -0,0 +1,243 @@
+# engine.py
+# In-process evaluation of GraphGen Datalog queries on PostgreSQL.
+#
+# Rules are compiled to SQL (see `datalog`), so the joins run inside the
+# database, and results are pulled through server-side cursors in large
+# batches straight into node and edge arrays. No JVM is involved.
+
+import itertools
+import numbers
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+from . import attributes
+from . import canonical
+from . import csr
+from . import condensed
+from . import datalog
+from . import readers
+
+_cursor_ids = itertools.count()
+
+_integer_types = ('smallint', 'integer', 'bigint')
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+def iter_batches(conn, sql, params=(), fetchsize=100000):
+    """
+    Run ``sql`` on a named (server-side) cursor and yield lists of up to
+    ``fetchsize`` rows, so that the result never has to fit in memory.
+    """
+    cursor = conn.cursor(name='graphgen_%d' % next(_cursor_ids))
+    psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, cursor)
+    cursor.itersize = fetchsize
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetchsize)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+class DatalogEngine(object):
+    '''
+    Evaluates GraphGen Datalog programs on a psycopg2 connection.
+
+    The first term of a ``Nodes`` head is the node id and the remaining
+    terms become node attributes named after their variables. The first
+    two terms of an ``Edges`` head are the edge endpoints. Node ids must
+    be integers (see ``check_ids``): the graphs number their vertices by
+    sorting them.
+    '''
+
+    def __init__(self, conn, fetchsize=100000):
+        self.conn = conn
+        self.fetchsize = fetchsize
+        self.catalog = datalog.Catalog(conn)
+
+    def compile(self, query):
+        '''
+        Returns the ``(sql, params)`` pairs for the nodes and edges of
+        ``query`` (a Datalog string or a list of parsed rules)
+        '''
+        return datalog.compile_program(self._rules(query), self.catalog)
+
+    def check_ids(self, query):
+        '''
+        Raises ``ValueError`` unless every node id of ``query`` (the first
+        term of a ``Nodes`` head, the first two of an ``Edges`` head) is
+        an integer constant or read from an integer column
+        '''
+        types = datalog.Catalog(self.conn, 'data_type')
+        for rule in self._rules(query):
+            name = rule.head.name.lower()
+            for term in rule.head.terms[:{'nodes': 1, 'edges': 2}.get(name, 0)]:
+                if isinstance(term, datalog.Const):
+                    if not isinstance(term.value, numbers.Integral):
+                        raise ValueError('Node ids must be integers: %s has the id %r' % (rule, term.value))
+                    continue
+                for atom in rule.atoms:
+                    if term in atom.terms:
+                        i = atom.terms.index(term)
+                        if types(atom.name)[i] not in _integer_types:
+                            raise ValueError('Node ids must be integers: %s takes %s from column %s.%s of type %s'
+                                             % (rule, term.name, atom.name.lower(), self.catalog(atom.name)[i],
+                                                types(atom.name)[i]))
+                        break
+
+    def node_batches(self, query):
+        '''
+        Yields lists of ``readers.Node`` records
+        '''
+        rules = self._rules(query)
+        compiled = datalog.compile_program(rules, self.catalog)
+        if 'nodes' not in compiled:
+            return
+        names = datalog.head_names(datalog.node_rules(rules)[0])[1:]
+        sql, params = compiled['nodes']
+        for rows in iter_batches(self.conn, sql, params, self.fetchsize):
+            yield [readers.Node(row[0], dict(zip(names, row[1:]))) for row in rows]
+
+    def edge_batches(self, query, distinct=True):
+        '''
+        Yields ``(sources, targets)`` pairs of int64 arrays. With
+        ``distinct=False`` an edge comes once per derivation of it (row of
+        the join of its rule) instead of once.
+        '''
+        if distinct:
+            sql, params = self.compile(query)['edges']
+        else:
+            parts = [datalog.compile_rule(r, self.catalog) for r in datalog.edge_rules(self._rules(query))]
+            if not parts:
+                raise ValueError('Datalog query has no Edges rule')
+            sql, params = ' UNION ALL '.join(sql for sql, _ in parts), [p for _, ps in parts for p in ps]
+        for rows in iter_batches(self.conn, sql, params, self.fetchsize):
+            pairs = np.array([row[:2] for row in rows], dtype=np.int64).reshape(-1, 2)
+            yield pairs[:, 0], pairs[:, 1]
+
+    def records(self, query):
+        '''
+        Yields lists of ``readers.Node`` and then ``readers.Edge`` records,
+        in the form produced by ``GraphGenerator.streamGraph``
+        '''
+        for batch in self.node_batches(query):
+            yield batch
+        for sources, targets in self.edge_batches(query):
+            yield [readers.Edge(s, t, {}) for s, t in zip(sources.tolist(), targets.tolist())]
+
+    def extract(self, query):
+        '''
+        Evaluates ``query`` and returns the graph as a ``csr.CSRGraph``
+        '''
+        builder = csr.CSRBuilder()
+        for batch in self.node_batches(query):
+            builder.add_records(batch)
+        for sources, targets in self.edge_batches(query):
+            builder.add_edges(sources, targets)
+        return builder.build()
+
+    def extract_to_disk(self, query, path, tmpdir=None):
+        '''
+        Evaluates ``query`` and writes the graph to the directory ``path``
+        like ``csr.save_csr``, spilling the edges to temporary files in
+        ``tmpdir`` instead of holding them in memory. Memory use grows with
+        the number of nodes only.
+        '''
+        rules = self._rules(query)
+        node_ids, attrs = [np.zeros(0, dtype=np.int64)], attributes.AttributeBuilder()
+        for batch in self.node_batches(rules):
+            node_ids.append(np.array([node.id for node in batch], dtype=np.int64))
+            for node in batch:
+                if node.attrs:
+                    attrs.add(node.id, node.attrs)
+        ids = np.unique(np.concatenate(node_ids))
+
+        spill = tempfile.mkdtemp(prefix='graphgen-spill-', dir=tmpdir)
+        try:
+            files = [os.path.join(spill, name) for name in ('sources', 'targets')]
+            seen = [ids]
+            with open(files[0], 'wb') as fs, open(files[1], 'wb') as ft:
+                for sources, targets in self.edge_batches(rules):
+                    fs.write(sources.tobytes())
+                    ft.write(targets.tobytes())
+                    seen.append(np.unique(np.concatenate([sources, targets])))
+                    if len(seen) > 64:
+                        seen = [np.unique(np.concatenate(seen))]
+            # Vertices referenced only by edges still get a vertex number
+            ids = np.unique(np.concatenate(seen))
+            arrays = [np.memmap(f, dtype=np.int64, mode='r') if os.path.getsize(f)
+                      else np.zeros(0, dtype=np.int64) for f in files]
+            csr.save_edges(path, ids, arrays[0], arrays[1], attrs.build(ids))
+            del arrays
+        finally:
+            shutil.rmtree(spill, ignore_errors=True)
+        return path
+
+    def extract_canonical(self, query, path, undirected=False, self_loops=False, tmpdir=None):
+        '''
+        Evaluates ``query`` and writes the graph to the directory ``path``
+        like ``csr.save_csr`` with every edge once, weighted by the number
+        of its derivations, canonicalizing the edges out of core (see
+        ``canonical.canonicalize``)
+        '''
+        rules = self._rules(query)
+        node_ids, attrs = [], attributes.AttributeBuilder()
+        for batch in self.node_batches(rules):
+            for node in batch:
+                node_ids.append(node.id)
+                if node.attrs:
+                    attrs.add(node.id, node.attrs)
+        return canonical.canonicalize(self.edge_batches(rules, distinct=False), path, undirected, self_loops,
+                                      node_ids, attrs, tmpdir=tmpdir)
+
+    def extract_condensed(self, query, expand_factor=None):
+        '''
+        Evaluates ``query`` without expanding its self-join and returns a
+        ``condensed.CondensedGraph``. The query must have a single
+        ``Edges`` rule (see ``condensed.split_rule``). With
+        ``expand_factor`` the graph is a hybrid that only condenses the
+        heavy join keys (see ``condensed.compile_condensed``).
+        '''
+        rules = self._rules(query)
+        edges = datalog.edge_rules(rules)
+        if len(edges) != 1:
+            raise ValueError('Condensed extraction needs exactly one Edges rule')
+        split = condensed.split_rule(edges[0])
+        sql, params = condensed.compile_condensed(split, self.catalog, expand_factor)
+
+        node_ids, attrs = [np.zeros(0, dtype=np.int64)], attributes.AttributeBuilder()
+        for batch in self.node_batches(rules):
+            node_ids.append(np.array([node.id for node in batch], dtype=np.int64))
+            for node in batch:
+                if node.attrs:
+                    attrs.add(node.id, node.attrs)
+        node_ids = np.concatenate(node_ids)
+
+        links = [np.zeros((0, 3), dtype=np.int64)]
+        for rows in iter_batches(self.conn, sql, params, self.fetchsize):
+            links.append(np.array(rows, dtype=np.int64).reshape(-1, 3))
+        links = np.concatenate(links)
+        left, right = links[links[:, 0] == 0], links[links[:, 0] == 1]
+        vids = links[links[:, 0] < 2, 2]
+        n_virtual = int(vids.max()) + 1 if len(vids) else 0
+        edge_sources = edge_targets = None
+        if expand_factor is not None:
+            direct = links[links[:, 0] == 2]
+            edge_sources, edge_targets = direct[:, 1], direct[:, 2]
+        return condensed.from_links(node_ids, left[:, 1], left[:, 2], right[:, 1], right[:, 2],
+                                    n_virtual, split.self_loops, attrs, edge_sources, edge_targets)
+
+    def _rules(self, query):
+        return datalog.parse(query) if isinstance(query, _string_types) else query
+
+__all__ = ['DatalogEngine']
@@ -6,39 +6,792 @@
 
 import sys
 import os
-import utils
-import os
+import io
+import errno
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from . import utils
+from . import readers
+from . import writers
+from . import csr
+from . import condensed
+from . import partition
+from . import cache as _cache
+from . import batch
+from . import planner
+from . import sampling
+from . import sharing
+from . import shm
+from . import sizing
+from . import stats as _stats
+from .worker import ExtractionWorker
+
+if sys.version_info >= (3, 7):
+    from .aio import agenerateGraph as _agenerateGraph
+else:
+    _agenerateGraph = None
+
+_jar = os.path.dirname(os.path.abspath(__file__)) + "/lib/GraphGen-0.0.6-SNAPSHOT-jar-with-dependencies.jar"
 
 class GraphGenerator:
     '''
     GraphGenerator objects keep track of the
     database connection configuration details
+
+    With ``persistent=True`` extractions are served by a single long-lived
+    JVM that is started on first use and recycled every ``max_requests``
+    extractions, instead of launching a new JVM per call. If the GraphGen
+    jar exits the JVM after an extraction, a ``RuntimeWarning`` is issued
+    and later extractions launch a JVM each. The persistent JVM runs with
+    the configured java options (see ``utils.config_java``): extractions
+    it serves are not sized with ``heap``.
+
+    With ``cache=True`` (or an ``cache.ExtractionCache``) extraction
+    results are kept on disk and reused while the tables the query reads
+    are unchanged. A cached result is hard-linked to the output path, so
+    its files are read-only: replace them rather than writing in place.
+
+    ``hooks`` are callables that ``generateGraph`` calls with the
+    ``stats.ExtractionStats`` of every extraction when it finishes (or
+    fails), e.g. to export them to a metrics system. The stats are also
+    logged on the ``graphgenpy.stats`` logger.
     '''
     GML = 'gml'
     GraphSON = 'json'
+    CSR = 'csr'
 
-    def __init__(self, dbname, host='', port='', username='', password=''):
+    def __init__(self, dbname, host='', port='', username='', password='',
+                 persistent=False, max_requests=100, cache=None, hooks=None):
         self.dbname = dbname
         self.port = port
         self.host = host
         self.username = username
         self.password = password
+        self.persistent = persistent
+        self._worker = ExtractionWorker(_jar, max_requests) if persistent else None
+        self.cache = _cache.ExtractionCache() if cache is True else cache
+        self.hooks = list(hooks or [])
 
     def displayConfig(self):
-        print "DBName: %s, Port: %s, Host: %s, Username: %s, Pass:%s " % self.dbname, self.port, self.host, self.username, self.password
+        print("DBName: %s, Port: %s, Host: %s, Username: %s, Pass:%s " % (self.dbname, self.port, self.host, self.username, self.password))
+
+    def connect(self):
+        '''
+        Opens a psycopg2 connection to the configured database
+        '''
+        import psycopg2
+        params = {'dbname': self.dbname, 'host': self.host, 'port': self.port,
+                  'user': self.username, 'password': self.password}
+        return psycopg2.connect(**dict((k, v) for k, v in params.items() if v))
 
-    def generateGraph(self,extractionQuery, filename, serialization_format='gml'):
+    def generateGraph(self,extractionQuery, filename, serialization_format='gml', engine='java', condensed=False, heap='auto',
+                      partitions=None, partition_by='hash', sample=None, sample_by=None, canonical=None):
         '''
         Generates a Graph based on the extraction query,
         and serializes the result to disk
+
+        With ``GraphGenerator.CSR`` the graph is written as a directory of
+        binary arrays that can be opened with ``csr.load_csr``
+
+        With ``engine='sql'`` the query is compiled to SQL and evaluated
+        in-process through psycopg2 instead of by the GraphGen jar
+
+        With ``condensed=True`` the self-join in the Edges rule is not
+        expanded: the graph is written as a condensed (virtual-node) graph
+        to ``<filename>.condensed``, to be opened with
+        ``condensed.load_condensed``. This always uses the SQL engine.
+        ``condensed='hybrid'`` only keeps virtual nodes for the heavy join
+        keys and stores the other edges directly, and ``condensed='auto'``
+        lets the planner pick the expanded, condensed or hybrid graph from
+        the database statistics before extracting (see ``explain``).
+
+        ``heap`` sets the maximum heap of the JVM launched for this
+        extraction: a size such as ``'4G'``, None for the configured
+        options, or ``'auto'`` to size it from the planner's estimate of
+        the graph (see ``planHeap``). When the estimated graph does not fit
+        in memory, ``'auto'`` extracts in spill mode with the SQL engine,
+        keeping edges on disk instead of in memory. ``'auto'`` is the
+        default: every JVM extraction then first opens a psycopg2
+        connection and runs EXPLAIN on the query. Pass a size or None to
+        skip this. Extractions served by the persistent JVM
+        (``persistent=True``) skip this too, and warn about an explicit
+        size, as that JVM keeps the configured options.
+
+        With ``partitions=N`` the graph is written to the directory
+        ``<filename>.parts`` as N shards in the serialization format plus a
+        manifest, to be opened with ``partition.load_partitioned``. Nodes
+        are partitioned by a hash of their id (``partition_by='hash'``) or
+        by id range (``'range'``), and edges go with their source node.
+
+        With ``sample=p`` (a fraction in (0, 1]) only a sample of the graph
+        is extracted, for a quick preview: the values of the variable
+        ``sample_by`` of the rules are sampled by hash, by default those of
+        the join key of the Edges rule (such as the publication of a
+        co-authorship rule), which keeps every node and the edges of the
+        sampled keys. Sampling an Edges head variable keeps a fraction of
+        the nodes with their edges instead. The estimated node and edge
+        counts of the full graph, with 95% confidence bounds, are in
+        ``stats.estimate`` (see ``sampling``). This always uses the SQL
+        engine.
+
+        With ``canonical='directed'`` or ``'undirected'`` the edges are
+        canonicalized out of core as they are fetched (see ``canonical``):
+        every edge is written once, without self-loops, with the number of
+        times the query derives it (for a co-authorship rule, the number of
+        shared publications) as its weight, and ``'undirected'`` merges the
+        two directions of an edge. Only the sort runs are held in memory, so
+        this scales to graphs with many more derivations than fit in RAM.
+        The graph is written to ``<filename>.csr``, with a ``weights``
+        array, and this always uses the SQL engine. Serialized graphs can
+        be canonicalized with ``canonical.canonicalize_file``.
+
+        Node ids must be integers when the SQL engine extracts the graph
+        (with ``engine='sql'`` or any of the options above that use it) and
+        for CSR or partitioned outputs: the query is checked against the
+        column types first and a ``ValueError`` names the offending column.
+
+        Returns the path of the output as a ``stats.ExtractionResult``, a
+        string whose ``stats`` attribute holds the ``stats.ExtractionStats``
+        of the extraction: the time spent in each phase, the node and edge
+        counts, the bytes written and the resources the JVM used.
+        '''
+
+        if condensed not in (False, True, 'hybrid', 'auto'):
+            raise ValueError("condensed must be True, False, 'hybrid' or 'auto'")
+        if condensed and partitions:
+            raise ValueError('Condensed graphs cannot be partitioned')
+        if sample is not None and (condensed or partitions):
+            raise ValueError('Sampled graphs cannot be condensed or partitioned')
+        if canonical not in (None, 'directed', 'undirected'):
+            raise ValueError("canonical must be None, 'directed' or 'undirected'")
+        if canonical and (condensed or partitions or sample is not None):
+            raise ValueError('Canonical graphs cannot be condensed, partitioned or sampled')
+        stats = _stats.ExtractionStats(extractionQuery, serialization_format, engine)
+        try:
+            if condensed == 'auto':
+                with stats.phase('plan'):
+                    plan = self._planExtraction(extractionQuery)
+                condensed = {'expanded': False, 'condensed': True, 'hybrid': 'hybrid'}[plan]
+            expand_factor = planner.EXPAND_FACTOR if condensed == 'hybrid' else None
+            stats.strategy = 'hybrid' if expand_factor else 'condensed' if condensed else 'expanded'
+            if condensed:
+                serialization_format = stats.serialization_format = 'condensed'
+                engine = 'sql'
+            if canonical:
+                serialization_format = stats.serialization_format = GraphGenerator.CSR
+                engine = 'sql'
+            path = filename + '.' + serialization_format
+            partitioning = None
+            if partitions:
+                partitioning = (partitions, partition_by)
+                path = filename + '.parts'
+
+            options, spill = None, False
+            if sample is not None:
+                engine = 'sql'
+            if engine == 'java' and self._serving():
+                if heap not in (None, 'auto') and not isinstance(heap, sizing.HeapPlan):
+                    warnings.warn('The persistent JVM ignores heap=%r' % (heap,), RuntimeWarning)
+            elif engine == 'java':
+                with stats.phase('plan'):
+                    options, spill = self._heapOptions(extractionQuery, heap)
+                if spill:
+                    engine = 'sql'
+            stats.engine, stats.spill = engine, spill
+            if engine == 'sql' or serialization_format == GraphGenerator.CSR or partitions:
+                self._checkIds(extractionQuery)
+
+            # An earlier output is replaced rather than written over in place
+            _cache._remove(path)
+            if sample is not None:
+                stats.sample = sample
+                self._sampleSQL(extractionQuery, path, serialization_format, stats, sample, sample_by)
+            elif canonical:
+                self._canonicalSQL(extractionQuery, path, stats, canonical == 'undirected')
+            elif self.cache is None:
+                self._generate(extractionQuery, filename, serialization_format, engine, options, spill, stats,
+                               partitioning, expand_factor)
+            else:
+                with stats.phase('cache'):
+                    # Markers are read before extracting, so changes made during
+                    # the extraction invalidate the stored entry
+                    key = self.cache.key(extractionQuery, (self.host, self.port, self.dbname, self.username),
+                                         '%s/%d-%s' % ((serialization_format,) + partitioning) if partitioning
+                                         else stats.strategy if expand_factor else serialization_format, engine)
+                    markers = self._tableMarkers(extractionQuery)
+                    cached = self.cache.lookup(key, markers)
+                    if cached is not None:
+                        _cache.place(cached, path)
+                stats.cached = cached is not None
+                if not stats.cached:
+                    self._generate(extractionQuery, filename, serialization_format, engine, options, spill, stats,
+                                   partitioning, expand_factor)
+                    if os.path.exists(path):
+                        with stats.phase('cache'):
+                            self.cache.store(key, markers, path)
+        except Exception as e:
+            self._failed(stats, e)
+            raise
+        return self._succeeded(stats, path)
+
+    def _checkIds(self, extractionQuery):
+        '''
+        Raises ``ValueError`` unless the node ids of the query are integers
+        (see ``DatalogEngine.check_ids``)
+        '''
+        from .engine import DatalogEngine
+
+        conn = self.connect()
+        try:
+            DatalogEngine(conn).check_ids(extractionQuery)
+        finally:
+            conn.close()
+
+    def _succeeded(self, stats, path):
+        '''
+        Finishes the ``stats`` of an extraction that wrote ``path``, passes
+        them to the hooks and returns the ``stats.ExtractionResult``
+        '''
+        stats.finish(path)
+        if not stats.cached:
+            print("Extraction was Successful! Graph was serialized in: " + os.path.dirname(os.path.realpath(__file__)) + '/' + path)
+        _stats.notify(self.hooks, stats)
+        return _stats.ExtractionResult(path, stats)
+
+    def _failed(self, stats, error):
+        '''
+        Finishes the ``stats`` of an extraction that raised ``error`` and
+        passes them to the hooks
+        '''
+        stats.error = '%s: %s' % (type(error).__name__, error)
+        stats.finish()
+        _stats.notify(self.hooks, stats)
+
+    def generateGraphs(self, queries, max_workers=None, heap='auto', memory=None, **kwargs):
+        '''
+        Runs several extractions concurrently and yields a
+        ``batch.BatchResult`` for each as it completes, in completion order.
+        A failed extraction yields its exception in ``error`` instead of
+        stopping the batch.
+
+        :param queries: An iterable of ``(extractionQuery, filename)`` or
+            ``(extractionQuery, filename, serialization_format)`` tuples.
+        :param max_workers: The maximum number of concurrent extractions,
+            by default the number of CPUs.
+        :param heap: The maximum JVM heap of each extraction, or ``'auto'``
+            to size each one from its estimated graph (see ``planHeap``).
+            Not used while the persistent JVM serves the extractions.
+        :param memory: The memory all running extractions may use together,
+            by default the memory currently available. An extraction only
+            starts once its heap (plus JVM overhead) fits.
+        :param kwargs: Further ``generateGraph`` arguments, e.g. ``engine``.
+        '''
+        if self._worker is not None:
+            # The persistent JVM serves one request at a time
+            max_workers = 1
+        memory = memory if memory is not None else batch.available_memory()
+        budget = batch.MemoryBudget(memory)
+        # A worker thread sizes a job right before running it
+        local = threading.local()
+
+        def reserve(extractionQuery, filename, serialization_format='gml'):
+            local.heap = heap
+            if self._serving():
+                # Extractions share the persistent JVM and its options
+                local.heap = None
+                return _configured_heap() + batch.JVM_OVERHEAD
+            if heap == 'auto':
+                local.heap = self.planHeap(extractionQuery, memory)
+                if local.heap is None:
+                    return _configured_heap() + batch.JVM_OVERHEAD
+                if local.heap.spill:
+                    return sizing.MIN_HEAP
+                return local.heap.heap + batch.JVM_OVERHEAD
+            return batch.parse_size(heap) + batch.JVM_OVERHEAD
+
+        def extract(extractionQuery, filename, serialization_format='gml'):
+            return self.generateGraph(extractionQuery, filename, serialization_format,
+                                      heap=local.heap, **kwargs)
+        return batch.run_batch(extract, queries, max_workers, reserve, budget)
+
+    def generateGraphSet(self, extractionQueries, filename, serialization_format='gml'):
+        '''
+        Extracts several graphs in one pass over the database, evaluating
+        the sub-joins and filtered table scans they have in common only
+        once (see ``sharing``). Always uses the SQL engine.
+
+        :param extractionQueries: A Datalog program with one or more edge
+            predicates besides ``Nodes`` (each one a graph, named after the
+            predicate), a list of programs (named by position) or a dict of
+            programs by graph name.
+        :param filename: The prefix of the outputs: each graph is written
+            to ``<filename>-<name>.<serialization_format>``.
+
+        Returns an ``OrderedDict`` mapping the graph names to the paths of
+        their outputs as ``stats.ExtractionResult``. The time spent
+        evaluating the shared sub-joins is the ``share`` phase of the
+        first graph's stats. Node ids must be integers, as with
+        ``engine='sql'`` in ``generateGraph``.
+        '''
+        from .engine import DatalogEngine
+
+        if serialization_format not in (GraphGenerator.GML, GraphGenerator.GraphSON, GraphGenerator.CSR):
+            raise ValueError('Graph sets are written as gml, json or csr')
+        graphs = sharing.split_graphs(extractionQueries)
+        results = OrderedDict()
+        conn = self.connect()
+        try:
+            eng = DatalogEngine(conn)
+            for rules in graphs.values():
+                eng.check_ids(rules)
+            shared, rewritten = sharing.plan_sharing(graphs)
+            for name in graphs:
+                stats = _stats.ExtractionStats('\n'.join(str(r) for r in graphs[name]), serialization_format, 'sql')
+                stats.strategy = 'expanded'
+                path = '%s-%s.%s' % (filename, name, serialization_format)
+                try:
+                    if not results:
+                        with stats.phase('share'):
+                            sharing.create_shared(conn, shared, eng.catalog)
+                        eng.catalog = sharing.SharedCatalog(eng.catalog, shared)
+                    self._writeSQL(eng, rewritten[name], path, serialization_format, False, stats)
+                except Exception as e:
+                    self._failed(stats, e)
+                    raise
+                stats.finish(path)
+                _stats.notify(self.hooks, stats)
+                results[name] = _stats.ExtractionResult(path, stats)
+        finally:
+            # Ending the transaction drops the shared tables
+            conn.rollback()
+            conn.close()
+        return results
+
+    def planHeap(self, extractionQuery, memory=None):
+        '''
+        Estimates the size of the graph of the query from the PostgreSQL
+        planner's row estimates and returns a ``sizing.HeapPlan`` with the
+        JVM heap and GC options to use, and whether the extraction should
+        spill to disk. Returns None if the query cannot be estimated.
+        '''
+        try:
+            conn = self.connect()
+        except Exception:
+            return None
+        try:
+            return sizing.plan_heap(conn, extractionQuery, memory)
+        except Exception:
+            # Sizing is best effort: fall back to the configured options
+            return None
+        finally:
+            conn.close()
+
+    def explain(self, extractionQuery, expand_factor=planner.EXPAND_FACTOR):
+        '''
+        Plans the extraction of the query without running it and returns a
+        ``planner.ExtractionPlan``: the estimated nodes, and the edges of
+        the expanded graph, links of the condensed graph and size of the
+        hybrid graph, computed from the PostgreSQL statistics on the join
+        key, with the representation ``condensed='auto'`` would choose.
+        ``print(plan)`` shows it as text.
+        '''
+        conn = self.connect()
+        try:
+            return planner.plan_extraction(conn, extractionQuery, expand_factor)
+        finally:
+            conn.close()
+
+    def _planExtraction(self, extractionQuery):
+        '''
+        Returns the strategy ``explain`` picks, or ``'expanded'`` if the
+        query cannot be planned
+        '''
+        try:
+            return self.explain(extractionQuery).strategy
+        except Exception:
+            # Planning is best effort, like heap sizing
+            return 'expanded'
+
+    def _heapOptions(self, extractionQuery, heap):
+        '''
+        Returns the JVM options for a ``heap`` argument (see
+        ``generateGraph``), and whether to spill instead
+        '''
+        if heap == 'auto':
+            heap = self.planHeap(extractionQuery)
+        if isinstance(heap, sizing.HeapPlan):
+            return heap.options, heap.spill
+        return _heap_options(heap), False
+
+    def _generate(self, extractionQuery, filename, serialization_format, engine, options=None, spill=False,
+                  stats=None, partitioning=None, expand_factor=None):
+        '''
+        Runs the extraction with the selected engine, recording its phases
+        and graph size in ``stats``. ``partitioning`` is a ``(partitions,
+        partition_by)`` pair for partitioned output and ``expand_factor``
+        makes condensed output a hybrid graph.
+        '''
+        stats = stats or _stats.ExtractionStats()
+        if partitioning is not None:
+            # Extract to a CSR graph next to the output, then split it one
+            # shard at a time from the memory-mapped arrays
+            tmpdir = tempfile.mkdtemp(prefix='graphgen-', dir=os.path.dirname(os.path.abspath(filename)))
+            try:
+                base = os.path.join(tmpdir, 'graph')
+                self._generate(extractionQuery, base, GraphGenerator.CSR, engine, options, spill, stats)
+                with stats.phase('partition'):
+                    path = filename + '.parts'
+                    _cache._remove(path)
+                    partition.write_partitioned(csr.load_csr(base + '.' + GraphGenerator.CSR), path,
+                                                partitioning[0], serialization_format, partitioning[1],
+                                                extractionQuery)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        if serialization_format == 'condensed' or engine == 'sql':
+            self._extractSQL(extractionQuery, filename, serialization_format, spill, stats, expand_factor)
+            return
+        path = filename + '.' + serialization_format
+        if serialization_format == GraphGenerator.CSR:
+            # Build the arrays straight from the GML stream of the JVM
+            graph = csr.from_records(self._stream(extractionQuery, GraphGenerator.GML, 10000, options, stats))
+            with stats.phase('serialize'):
+                csr.save_csr(graph, path)
+            stats.nodes, stats.edges = graph.number_of_nodes(), graph.number_of_edges()
+            return
+        self._extract(extractionQuery, serialization_format, filename, options, stats)
+        with stats.phase('count'):
+            stats.nodes, stats.edges = _stats.count_elements(path, serialization_format)
+
+    def _tableMarkers(self, extractionQuery):
+        '''
+        Returns the change markers of the tables the query reads
         '''
+        from . import datalog
 
-        classpth = os.path.dirname(os.path.abspath(__file__)) + "/lib/GraphGen-0.0.6-SNAPSHOT-jar-with-dependencies.jar";
+        conn = self.connect()
+        try:
+            return _cache.table_markers(conn, datalog.tables(datalog.parse(extractionQuery)))
+        finally:
+            conn.close()
 
-        # Directly call Java program for graph extraction using popen
-        (stdout, stderr) = utils.java(['com.umdb.graphgen.PyGenerateGraph', extractionQuery, serialization_format, filename,self.host, self.port, self.dbname, self.username, self.password], classpath=classpth)
+    def streamGraph(self, extractionQuery, serialization_format='gml', chunksize=10000, heap=None):
+        '''
+        Generates a Graph based on the extraction query and yields
+        its node and edge records (see ``readers.Node`` and
+        ``readers.Edge``) in lists of up to ``chunksize`` records,
+        while the JVM is still producing them. The graph is passed
+        through a named pipe and never written to disk.
+        '''
+        return self._stream(extractionQuery, serialization_format, chunksize, _heap_options(heap))
+
+    def _stream(self, extractionQuery, serialization_format, chunksize, options=None, stats=None):
+        tmpdir = tempfile.mkdtemp(prefix='graphgen-')
+        base = os.path.join(tmpdir, 'graph')
+        fifo = base + '.' + serialization_format
+        os.mkfifo(fifo)
+
+        errors = []
+        done = threading.Event()
+        def extract():
+            try:
+                self._extract(extractionQuery, serialization_format, base, options, stats)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                _release_fifo(fifo, done)
+        extraction = threading.Thread(target=extract)
+        extraction.daemon = True
+        extraction.start()
+
+        try:
+            with io.open(fifo, 'r', encoding='utf-8') as f:
+                for chunk in readers.chunked(readers.iter_records(f, serialization_format), chunksize):
+                    yield chunk
+            done.set()
+            extraction.join()
+            if errors:
+                raise errors[0]
+        finally:
+            # Closing the pipe early makes the JVM fail on its next write
+            done.set()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def lazyGraph(self, extractionQuery, cache_size=1000000, direction='out'):
+        '''
+        Returns a ``lazy.LazyGraph`` of the query: nothing is extracted up
+        front, neighborhoods are looked up in the database as they are
+        explored and kept in an LRU cache of about ``cache_size`` edges.
+        Close it (or use it in a ``with`` block) to release its connection.
+        '''
+        from .lazy import LazyGraph
+
+        conn = self.connect()
+        try:
+            return LazyGraph(conn, extractionQuery, cache_size, direction=direction, owns_connection=True)
+        except Exception:
+            conn.close()
+            raise
+
+    def publishGraph(self, extractionQuery, name):
+        '''
+        Extracts the graph of the query with the SQL engine into shared
+        memory under ``name``, where other processes on this host can open
+        it with ``shm.attach(name)`` without copying it. Returns the
+        publisher's ``shm.SharedGraph``; the graph stays in shared memory
+        until every process attached to it has detached. Node ids must be
+        integers.
+        '''
+        from .engine import DatalogEngine
+
+        conn = self.connect()
+        try:
+            eng = DatalogEngine(conn)
+            eng.check_ids(extractionQuery)
+            graph = eng.extract(extractionQuery)
+        finally:
+            conn.close()
+        return shm.publish(graph, name)
+
+    def extractIncremental(self, extractionQuery):
+        '''
+        Extracts a graph that can later be brought up to date with
+        ``refreshGraph`` at a cost proportional to the size of the change.
+        Installs change-capture triggers on the tables the query reads.
+        Returns an ``incremental.IncrementalGraph``.
+        '''
+        from .incremental import IncrementalGraph
+
+        conn = self.connect()
+        try:
+            return IncrementalGraph.extract(conn, extractionQuery)
+        finally:
+            conn.close()
+
+    def refreshGraph(self, graph, filename=None, serialization_format='gml'):
+        '''
+        Applies the changes made to the source tables since ``graph`` was
+        extracted or last refreshed, optionally rewrites it to
+        ``<filename>.<serialization_format>``, and returns the
+        ``incremental.GraphDelta``
+        '''
+        conn = self.connect()
+        try:
+            delta = graph.refresh(conn)
+        finally:
+            conn.close()
+        if filename is not None:
+            writers.write_records(graph.records(), filename + '.' + serialization_format, serialization_format)
+        return delta
+
+    def _extractSQL(self, extractionQuery, filename, serialization_format, spill=False, stats=None,
+                    expand_factor=None):
+        '''
+        Evaluates the query with the in-process Datalog engine and writes
+        the result like PyGenerateGraph does. With ``spill`` CSR output is
+        built from edges spilled to disk.
+        '''
+        from .engine import DatalogEngine
+
+        stats = stats or _stats.ExtractionStats()
+        conn = self.connect()
+        try:
+            self._writeSQL(DatalogEngine(conn), extractionQuery, filename + '.' + serialization_format,
+                           serialization_format, spill, stats, expand_factor)
+        finally:
+            conn.close()
+
+    def _sampleSQL(self, extractionQuery, path, serialization_format, stats, fraction, sample_by=None):
+        '''
+        Extracts a sample of the graph of the query with the in-process
+        Datalog engine and stores the estimates of the full graph in
+        ``stats.estimate``
+        '''
+        from . import datalog
+        from .engine import DatalogEngine
+
+        conn = self.connect()
+        try:
+            eng = DatalogEngine(conn)
+            with stats.phase('plan'):
+                design = sampling.Sample(datalog.parse(extractionQuery), fraction, sample_by)
+                rules, eng.catalog = design.rewrite(conn, eng.catalog)
+            self._writeSQL(eng, rules, path, serialization_format, False, stats)
+            with stats.phase('estimate'):
+                stats.estimate = design.estimate(conn, rules, eng.catalog)
+        finally:
+            conn.close()
+
+    def _canonicalSQL(self, extractionQuery, path, stats, undirected=False):
+        '''
+        Extracts the graph of the query with the in-process Datalog engine,
+        canonicalizing its edges out of core
+        '''
+        from .engine import DatalogEngine
 
-        if(stderr is None):
-            print "Extraction was Successful! Graph was serialized in: " + os.path.dirname(os.path.realpath(__file__)) + '/' + filename + '.' + serialization_format
+        conn = self.connect()
+        try:
+            # Fetching, sorting and merging are interleaved
+            with stats.phase('sql'):
+                DatalogEngine(conn).extract_canonical(extractionQuery, path, undirected)
+        finally:
+            conn.close()
+        graph = csr.load_csr(path)
+        stats.nodes, stats.edges = graph.number_of_nodes(), graph.number_of_edges()
 
-        return filename+"."+serialization_format
+    def _writeSQL(self, eng, extractionQuery, path, serialization_format, spill, stats, expand_factor=None):
+        '''
+        Extracts the graph of a query (or list of rules) with ``eng`` and
+        writes it to ``path``
+        '''
+        if serialization_format == 'condensed':
+            with stats.phase('sql'):
+                graph = eng.extract_condensed(extractionQuery, expand_factor)
+            with stats.phase('serialize'):
+                condensed.save_condensed(graph, path)
+            stats.nodes = graph.number_of_nodes()
+        elif serialization_format == GraphGenerator.CSR and spill:
+            # Fetching and spilling are interleaved
+            with stats.phase('sql'):
+                eng.extract_to_disk(extractionQuery, path)
+            graph = csr.load_csr(path)
+            stats.nodes, stats.edges = graph.number_of_nodes(), graph.number_of_edges()
+        elif serialization_format == GraphGenerator.CSR:
+            with stats.phase('sql'):
+                graph = eng.extract(extractionQuery)
+            with stats.phase('serialize'):
+                csr.save_csr(graph, path)
+            stats.nodes, stats.edges = graph.number_of_nodes(), graph.number_of_edges()
+        else:
+            # Fetching and writing are interleaved: the time spent waiting
+            # for batches is fetching, the rest writing
+            start = time.time()
+            writers.write_records(_counted(eng.records(extractionQuery), stats), path, serialization_format)
+            fetched = dict(stats.phases).get('sql', 0.0)
+            stats.add_time('serialize', time.time() - start - fetched)
+
+    def _extract(self, extractionQuery, serialization_format, filename, options=None, stats=None):
+        '''
+        Runs PyGenerateGraph, on the persistent JVM if there is one. With
+        ``stats`` the run is timed and the JVM's stderr output, heap and
+        GC figures are recorded in them.
+        '''
+        args = self._extractArgs(extractionQuery, serialization_format, filename)
+
+        if self._serving():
+            # Hand the request to the persistent JVM
+            start = time.time()
+            self._worker.extract(args)
+            if stats is not None:
+                stats.add_time('jvm', time.time() - start)
+            return
+
+        if stats is None:
+            # Directly call Java program for graph extraction using popen
+            utils.java(['com.umdb.graphgen.PyGenerateGraph'] + args, classpath=_jar, options=options)
+            return
+
+        fd, gc_log = tempfile.mkstemp(prefix='graphgen-gc-', suffix='.log')
+        os.close(fd)
+        try:
+            with stats.phase('jvm'):
+                (stdout, stderr) = utils.java(['com.umdb.graphgen.PyGenerateGraph'] + args, classpath=_jar,
+                                              stderr='pipe', options=(options or []) + _stats.gc_log_options(gc_log))
+            stats.stderr = utils._decode_stdoutdata(stderr)
+            gc = _stats.read_gc_log(gc_log)
+            if gc is not None:
+                stats.jvm_peak_heap, stats.jvm_gc_time, stats.jvm_gc_count = gc
+        finally:
+            os.remove(gc_log)
+
+    def _serving(self):
+        '''
+        Whether the persistent JVM serves the extractions
+        '''
+        return self._worker is not None and not self._worker.disabled
+
+    def _extractArgs(self, extractionQuery, serialization_format, filename):
+        return [extractionQuery, serialization_format, filename, self.host, self.port, self.dbname, self.username, self.password]
+
+    # Asynchronous generateGraph (see ``aio.agenerateGraph``), Python 3.7+
+    if _agenerateGraph is not None:
+        agenerateGraph = _agenerateGraph
+
+    def warm(self, extractionQuery=None):
+        '''
+        Builds the class-data-sharing archive for the GraphGen jar (see
+        ``utils.warm_java``) so that later JVMs start faster. With a query
+        the training run performs a real extraction and records every
+        class it needs; without one only the classes needed to start up.
+        Returns the path of the archive.
+        '''
+        cmd = ['com.umdb.graphgen.PyGenerateGraph']
+        tmpdir = tempfile.mkdtemp(prefix='graphgen-')
+        try:
+            if extractionQuery is not None:
+                cmd += self._extractArgs(extractionQuery, GraphGenerator.GML, os.path.join(tmpdir, 'graph'))
+            return utils.warm_java(cmd, _jar)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def close(self):
+        '''
+        Shuts down the persistent JVM, if one is running
+        '''
+        if self._worker is not None:
+            self._worker.close()
+
+
+def _counted(batches, stats):
+    '''
+    Passes through the record batches of ``DatalogEngine.records``,
+    timing the waits for them as the ``sql`` phase and counting the nodes
+    and edges
+    '''
+    stats.nodes, stats.edges = 0, 0
+    batches = iter(batches)
+    while True:
+        start = time.time()
+        try:
+            batch = next(batches)
+        except StopIteration:
+            stats.add_time('sql', time.time() - start)
+            return
+        stats.add_time('sql', time.time() - start)
+        if batch and isinstance(batch[0], readers.Edge):
+            stats.edges += len(batch)
+        else:
+            stats.nodes += len(batch)
+        yield batch
+
+def _heap_options(heap):
+    return ['-Xmx%s' % heap] if heap else None
+
+def _configured_heap():
+    '''
+    Returns the maximum heap in bytes set by the configured java options
+    '''
+    for option in reversed(utils._java_options):
+        if option.startswith('-Xmx'):
+            return batch.parse_size(option[4:])
+    return batch.parse_size('10G')
+
+def _release_fifo(fifo, done):
+    '''
+    Opens and closes the write end of ``fifo`` once, so that a reader
+    still blocked in open() sees end-of-file when the JVM exits without
+    ever opening the pipe. Gives up once ``done`` is set.
+    '''
+    while not done.is_set():
+        try:
+            os.close(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+            return
+        except OSError as e:
+            # ENXIO: nobody has opened the read end yet
+            if e.errno != errno.ENXIO:
+                return
+            done.wait(0.05)
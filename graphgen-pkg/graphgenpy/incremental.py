@@ -0,0 +1,324 @@
+# incremental.py
+# Incremental maintenance of extracted graphs.
+#
+# Triggers record every inserted, deleted and updated row of the tables a
+# query reads in a change log table (graphgen_log_<table>), tagged with the
+# id of the writing transaction. An `IncrementalGraph` remembers the
+# transaction snapshot its contents correspond to, and refreshing it only
+# evaluates the delta rules of the query over the log entries committed
+# since then:
+#
+#   delta(R1 x ... x Rn) = sum over i of  R1' x ... x Ri-1' x dRi x Ri+1 x ... x Rn
+#
+# where Ri' is the new and Ri the old content of a table. Every node and
+# edge carries the number of ways it is derived, so deletions are handled
+# by counting: an edge disappears when its count drops to zero.
+
+import json
+import re
+from collections import namedtuple
+
+from . import datalog
+from . import readers
+from .engine import iter_batches
+
+_log_prefix = 'graphgen_log_'
+
+_snapshot_re = re.compile(r'^\d+:\d+:[\d,]*$')
+
+##########################################################################
+# Change capture
+##########################################################################
+
+_trigger_function = """
+CREATE OR REPLACE FUNCTION graphgen_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format('INSERT INTO %I SELECT ($1).*, -1', 'graphgen_log_' || TG_TABLE_NAME) USING OLD;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        EXECUTE format('INSERT INTO %I SELECT ($1).*, 1', 'graphgen_log_' || TG_TABLE_NAME) USING NEW;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+def log_table(table):
+    return _log_prefix + table.lower()
+
+def install_change_capture(conn, tables):
+    """
+    Create the change log tables and triggers for ``tables`` unless they
+    already exist, and commit. TRUNCATE is not captured.
+    """
+    cursor = conn.cursor()
+    cursor.execute(_trigger_function)
+    for table in sorted(tables):
+        log = datalog.quote_ident(log_table(table))
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'graphgen_log' "
+                       "AND tgrelid = %s::regclass", (datalog.quote_ident(table),))
+        if cursor.fetchone():
+            continue
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s AS SELECT * FROM %s WITH NO DATA'
+                       % (log, datalog.quote_ident(table)))
+        cursor.execute('ALTER TABLE %s ADD COLUMN graphgen_m smallint NOT NULL, '
+                       'ADD COLUMN graphgen_xid bigint NOT NULL DEFAULT txid_current()' % log)
+        cursor.execute('CREATE INDEX ON %s (graphgen_xid)' % log)
+        cursor.execute('CREATE TRIGGER graphgen_log AFTER INSERT OR UPDATE OR DELETE ON %s '
+                       'FOR EACH ROW EXECUTE PROCEDURE graphgen_log_change()'
+                       % datalog.quote_ident(table))
+    cursor.close()
+    conn.commit()
+
+def prune_change_log(conn, tables, snapshot):
+    """
+    Delete the log entries of transactions visible in ``snapshot``, which
+    must be the oldest snapshot of any graph that is still refreshed.
+    """
+    _check_snapshot(snapshot)
+    cursor = conn.cursor()
+    for table in sorted(tables):
+        cursor.execute('DELETE FROM %s WHERE txid_visible_in_snapshot(graphgen_xid, %%s::txid_snapshot)'
+                       % datalog.quote_ident(log_table(table)), (snapshot,))
+    cursor.close()
+    conn.commit()
+
+def _check_snapshot(snapshot):
+    if not _snapshot_re.match(snapshot):
+        raise ValueError('Malformed transaction snapshot: %r' % (snapshot,))
+
+##########################################################################
+# Delta rules
+##########################################################################
+
+def _changes(table, columns, snapshot):
+    # Log entries of transactions committed after ``snapshot``
+    _check_snapshot(snapshot)
+    return ("SELECT %s, graphgen_m FROM %s WHERE graphgen_xid >= txid_snapshot_xmin('%s') "
+            "AND NOT txid_visible_in_snapshot(graphgen_xid, '%s')"
+            % (', '.join(datalog.quote_ident(c) for c in columns),
+               datalog.quote_ident(log_table(table)), snapshot, snapshot))
+
+def _old_table(table, columns, snapshot):
+    # The table as of ``snapshot``: its rows minus the logged changes
+    cols = ', '.join(datalog.quote_ident(c) for c in columns)
+    return ('SELECT %s, 1 AS graphgen_m FROM %s UNION ALL '
+            'SELECT %s, -graphgen_m FROM (%s) c'
+            % (cols, datalog.quote_ident(table), cols, _changes(table, columns, snapshot)))
+
+def compile_counts(rules, columns, width, snapshot=None):
+    '''
+    Compiles rules into one statement returning the first ``width`` head
+    terms and the signed number of their derivations. Without a snapshot
+    all derivations are counted; with one, only the change since it.
+    '''
+    parts = []
+    for rule in rules:
+        select = rule.head.terms[:width]
+        if snapshot is None:
+            parts.append(datalog.compile_rule(rule, columns, select=select, weight='graphgen_m'))
+            continue
+        for i, atom in enumerate(rule.atoms):
+            table = atom.name.lower()
+            sources = {i: '(%s)' % _changes(table, columns(table), snapshot)}
+            for j, later in enumerate(rule.atoms[i + 1:], i + 1):
+                sources[j] = '(%s)' % _old_table(later.name.lower(), columns(later.name), snapshot)
+            parts.append(datalog.compile_rule(rule, columns, sources=sources, select=select,
+                                              weight='graphgen_m'))
+    names = ', '.join('c%d' % k for k in range(width))
+    sql = ('SELECT %s, sum(w) FROM (%s) d(%s, w) GROUP BY %s HAVING sum(w) <> 0'
+           % (names, ' UNION ALL '.join('(%s)' % sql for sql, _ in parts), names, names))
+    return sql, [p for _, params in parts for p in params]
+
+##########################################################################
+# Incrementally maintained graphs
+##########################################################################
+
+GraphDelta = namedtuple('GraphDelta', ['added_nodes', 'changed_nodes', 'removed_nodes',
+                                       'added_edges', 'removed_edges'])
+
+def _apply_delta(delta, graph):
+    '''
+    Applies a ``GraphDelta`` to a NetworkX graph
+    '''
+    graph.remove_edges_from(delta.removed_edges)
+    graph.remove_nodes_from(delta.removed_nodes)
+    for node in delta.added_nodes + delta.changed_nodes:
+        graph.add_node(node.id, **node.attrs)
+    graph.add_edges_from(delta.added_edges)
+    return graph
+
+GraphDelta.apply = _apply_delta
+
+class IncrementalGraph(object):
+    '''
+    A graph extracted from a Datalog query together with the derivation
+    counts and the transaction snapshot needed to refresh it.
+
+    ``nodes`` maps each node head tuple (id followed by attributes) and
+    ``edges`` each ``(source, target)`` pair to its number of derivations.
+    '''
+
+    def __init__(self, query, snapshot, nodes, edges):
+        self.query = query
+        self.snapshot = snapshot
+        self.nodes = nodes
+        self.edges = edges
+        self._rules = datalog.parse(query)
+        node_rules = datalog.node_rules(self._rules)
+        self._names = datalog.head_names(node_rules[0])[1:] if node_rules else []
+        self._index()
+
+    def _index(self):
+        # The node head tuples of each id, so a refresh only looks at the
+        # ids it changes
+        self._keys = {}
+        for key in self.nodes:
+            self._keys.setdefault(key[0], set()).add(key)
+
+    @classmethod
+    def extract(cls, conn, query, fetchsize=100000):
+        '''
+        Extracts the graph for ``query``, installing change capture on the
+        tables it reads first
+        '''
+        rules = datalog.parse(query)
+        install_change_capture(conn, datalog.tables(rules))
+        graph = cls(query, None, {}, {})
+        graph.snapshot = graph._evaluate(conn, None, fetchsize)
+        graph._index()
+        return graph
+
+    def refresh(self, conn, fetchsize=100000):
+        '''
+        Brings the graph up to date with the committed changes to its tables
+        and returns the ``GraphDelta`` that was applied
+        '''
+        delta_nodes, delta_edges = {}, {}
+        snapshot = self._evaluate(conn, self.snapshot, fetchsize, delta_nodes, delta_edges)
+        return self._apply(snapshot, delta_nodes, delta_edges)
+
+    def _apply(self, snapshot, delta_nodes, delta_edges):
+        # Changes that net out (a row inserted and deleted again since the
+        # last refresh) leave the graph as it was
+        added_edges, removed_edges = [], []
+        for edge, change in delta_edges.items():
+            if not change:
+                continue
+            count = self.edges.get(edge, 0) + change
+            if count > 0:
+                if edge not in self.edges:
+                    added_edges.append(edge)
+                self.edges[edge] = count
+            elif edge in self.edges:
+                removed_edges.append(edge)
+                del self.edges[edge]
+
+        touched = set(key[0] for key, change in delta_nodes.items() if change)
+        before = dict((id, frozenset(self._keys.get(id, ()))) for id in touched)
+        for key, change in delta_nodes.items():
+            if not change:
+                continue
+            count = self.nodes.get(key, 0) + change
+            if count > 0:
+                self.nodes[key] = count
+                self._keys.setdefault(key[0], set()).add(key)
+            elif key in self.nodes:
+                del self.nodes[key]
+                keys = self._keys[key[0]]
+                keys.discard(key)
+                if not keys:
+                    del self._keys[key[0]]
+        added, changed, removed = [], [], []
+        for id in touched:
+            after = self._keys.get(id)
+            if not after:
+                if before[id]:
+                    removed.append(id)
+            elif not before[id]:
+                added.append(self._node(next(iter(after))))
+            elif after != before[id]:
+                changed.append(self._node(next(iter(after))))
+
+        self.snapshot = snapshot
+        return GraphDelta(added, changed, removed, added_edges, removed_edges)
+
+    def _evaluate(self, conn, since, fetchsize, nodes=None, edges=None):
+        '''
+        Counts derivations (or their change since snapshot ``since``) into
+        ``nodes`` and ``edges`` within a single snapshot and returns it
+        '''
+        nodes = self.nodes if nodes is None else nodes
+        edges = self.edges if edges is None else edges
+        catalog = datalog.Catalog(conn)
+        node_rules = datalog.node_rules(self._rules)
+        edge_rules = datalog.edge_rules(self._rules)
+        if not edge_rules:
+            raise ValueError('Datalog query has no Edges rule')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            cursor.execute('SELECT txid_current_snapshot()')
+            snapshot = cursor.fetchone()[0]
+            cursor.close()
+            if node_rules:
+                width = len(node_rules[0].head.terms)
+                sql, params = compile_counts(node_rules, catalog, width, since)
+                for rows in iter_batches(conn, sql, params, fetchsize):
+                    for row in rows:
+                        key = tuple(row[:-1])
+                        nodes[key] = nodes.get(key, 0) + int(row[-1])
+            sql, params = compile_counts(edge_rules, catalog, 2, since)
+            for rows in iter_batches(conn, sql, params, fetchsize):
+                for s, t, count in rows:
+                    edges[(s, t)] = edges.get((s, t), 0) + int(count)
+        finally:
+            conn.rollback()
+        return snapshot
+
+    def _node(self, key):
+        return readers.Node(key[0], dict(zip(self._names, key[1:])))
+
+    def records(self):
+        '''
+        Yields the ``readers.Node`` and then the ``readers.Edge`` records of
+        the graph, for use with ``writers.write_records``
+        '''
+        for key in self.nodes:
+            yield self._node(key)
+        for s, t in self.edges:
+            yield readers.Edge(s, t, {})
+
+    def to_networkx(self, create_using=None):
+        import networkx as nx
+
+        graph = create_using if create_using is not None else nx.DiGraph()
+        for key in self.nodes:
+            graph.add_node(key[0], **dict(zip(self._names, key[1:])))
+        graph.add_edges_from(self.edges)
+        return graph
+
+    def save(self, path):
+        '''
+        Writes the graph and its refresh state to ``path`` as JSON
+        '''
+        with open(path, 'w') as f:
+            json.dump({'query': self.query, 'snapshot': self.snapshot,
+                       'nodes': [list(key) + [count] for key, count in self.nodes.items()],
+                       'edges': [[s, t, count] for (s, t), count in self.edges.items()]}, f)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        return cls(state['query'], state['snapshot'],
+                   dict((tuple(row[:-1]), row[-1]) for row in state['nodes']),
+                   dict(((s, t), count) for s, t, count in state['edges']))
+
+    def __repr__(self):
+        return '<IncrementalGraph: %d nodes, %d edges at %s>' % (
+            len(self.nodes), len(self.edges), self.snapshot)
+
+__all__ = ['IncrementalGraph', 'GraphDelta', 'install_change_capture', 'prune_change_log']
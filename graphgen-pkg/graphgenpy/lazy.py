@@ -0,0 +1,277 @@
+# lazy.py
+# On-demand exploration of the graph of a Datalog query.
+#
+# A `LazyGraph` never extracts the whole graph. The Edges rules are compiled
+# once into a lookup of the edges of a set of vertices,
+#
+#   SELECT DISTINCT c0, c1 FROM (<Edges rules>) e(c0, c1) WHERE c0 = ANY(%s)
+#
+# which PostgreSQL flattens, so that the filter applies to the column the
+# edge source is bound to and can use an index on it. A breadth-first
+# search looks up every level in one such query, and the adjacency lists it
+# fetched are kept in a bounded LRU cache: exploring costs time in
+# proportion to the neighborhoods touched, not to the size of the graph.
+
+from collections import OrderedDict
+
+from . import csr
+from . import datalog
+
+_directions = ('out', 'in', 'both')
+
+class LRUCache(object):
+    '''
+    A mapping holding entries of a total ``weight`` of at most
+    ``capacity``, evicting the least recently used entries first
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.weight = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, weight=1):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.weight -= old[1]
+        if weight > self.capacity:
+            return
+        self._entries[key] = (value, weight)
+        self.weight += weight
+        while self.weight > self.capacity:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.weight -= evicted
+
+    def clear(self):
+        self._entries.clear()
+        self.weight = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+def compile_lookup(rules, columns, width, key=0):
+    '''
+    Compiles rules into one statement returning the distinct first
+    ``width`` head terms of the rows whose term ``key`` is in an array,
+    passed as the last parameter. Returns ``(sql, params)`` without it.
+    '''
+    parts = [datalog.compile_rule(r, columns, select=r.head.terms[:width]) for r in rules]
+    names = ', '.join('c%d' % k for k in range(width))
+    sql = ('SELECT DISTINCT ' + names + ' FROM (' + ' UNION ALL '.join('(%s)' % sql for sql, _ in parts)
+           + ') e(' + names + ') WHERE c%d = ANY(%%s)' % key)
+    return sql, [p for _, params in parts for p in params]
+
+class LazyGraph(object):
+    '''
+    The graph of a Datalog query, fetched from the database a
+    neighborhood at a time. Adjacency lists are cached up to about
+    ``cache_size`` edges in total, and lookups of many vertices are sent
+    ``batch_size`` vertices per query.
+
+    ``direction`` is the default direction neighbors are followed in:
+    ``'out'`` (successors), ``'in'`` (predecessors) or ``'both'``.
+    Vertices are identified by their node ids, as Python values.
+    '''
+
+    def __init__(self, conn, query, cache_size=1000000, batch_size=10000, direction='out', owns_connection=False):
+        if direction not in _directions:
+            raise ValueError("direction must be 'out', 'in' or 'both'")
+        self.conn = conn
+        self.query = query
+        self.batch_size = batch_size
+        self.direction = direction
+        self.queries = 0
+        self.hits = 0
+        self.misses = 0
+        self._owns_connection = owns_connection
+        self._adjacency = LRUCache(cache_size)
+        self._attrs = LRUCache(cache_size)
+
+        rules = datalog.parse(query)
+        catalog = datalog.Catalog(conn)
+        edges = datalog.edge_rules(rules)
+        if not edges:
+            raise ValueError('Datalog query has no Edges rule')
+        self._lookups = {'out': compile_lookup(edges, catalog, 2, key=0),
+                         'in': compile_lookup(edges, catalog, 2, key=1)}
+        nodes = datalog.node_rules(rules)
+        self._names = datalog.head_names(nodes[0])[1:] if nodes else []
+        self._nodes = compile_lookup(nodes, catalog, len(nodes[0].head.terms)) if nodes else None
+        conn.rollback()
+
+    def _execute(self, lookup, ids):
+        sql, params = lookup
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params + [list(ids)])
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            # Do not keep a transaction open between lookups
+            self.conn.rollback()
+        self.queries += 1
+        return rows
+
+    def _fetch(self, ids, direction):
+        # Adjacency lists of one direction, from the cache or the database
+        found, missing = {}, []
+        for id in ids:
+            neighbors = self._adjacency.get((direction, id))
+            if neighbors is None:
+                missing.append(id)
+            else:
+                found[id] = neighbors
+        self.hits += len(found)
+        self.misses += len(missing)
+        key, other = (0, 1) if direction == 'out' else (1, 0)
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            fetched = dict((id, []) for id in chunk)
+            for row in self._execute(self._lookups[direction], chunk):
+                fetched.setdefault(row[key], []).append(row[other])
+            for id, neighbors in fetched.items():
+                neighbors = tuple(neighbors)
+                self._adjacency.put((direction, id), neighbors, len(neighbors) + 1)
+                found[id] = neighbors
+        return found
+
+    def adjacency(self, ids, direction=None):
+        '''
+        Returns a dict mapping each of the node ``ids`` to the tuple of its
+        neighbors, looking up all the uncached ones in batched queries
+        '''
+        direction = direction or self.direction
+        ids = list(OrderedDict.fromkeys(ids))
+        if direction != 'both':
+            return self._fetch(ids, direction)
+        out, into = self._fetch(ids, 'out'), self._fetch(ids, 'in')
+        return dict((id, tuple(OrderedDict.fromkeys(out[id] + into[id]))) for id in ids)
+
+    def neighbors(self, id, direction=None):
+        '''
+        Returns the neighbors of one node
+        '''
+        return self.adjacency([id], direction)[id]
+
+    def successors(self, id):
+        return self.neighbors(id, 'out')
+
+    def predecessors(self, id):
+        return self.neighbors(id, 'in')
+
+    def degree(self, id, direction=None):
+        return len(self.neighbors(id, direction))
+
+    def bfs(self, sources, depth=None, direction=None, max_nodes=None):
+        '''
+        Breadth-first search from one node id or a list of them, up to
+        ``depth`` hops, with one batched lookup per level. Stops expanding
+        once ``max_nodes`` nodes were reached. Returns a dict mapping the
+        reached node ids to their hop distance.
+        '''
+        sources = list(sources) if isinstance(sources, (list, tuple, set)) else [sources]
+        dist = OrderedDict((s, 0) for s in sources)
+        frontier, hops = list(dist), 0
+        while frontier and (depth is None or hops < depth):
+            if max_nodes is not None and len(dist) >= max_nodes:
+                break
+            hops += 1
+            adjacency = self.adjacency(frontier, direction)
+            frontier = []
+            for id in adjacency:
+                for neighbor in adjacency[id]:
+                    if neighbor not in dist:
+                        dist[neighbor] = hops
+                        frontier.append(neighbor)
+        return dict(dist)
+
+    def node_attributes(self, ids):
+        '''
+        Returns a dict mapping node ids to their attribute dicts from the
+        ``Nodes`` rules; nodes they do not produce are left out
+        '''
+        ids = list(OrderedDict.fromkeys(ids))
+        found, missing = {}, []
+        for id in ids:
+            values = self._attrs.get(id)
+            if values is None:
+                missing.append(id)
+            elif values is not _absent:
+                found[id] = values
+        if self._nodes is None:
+            return found
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            rows = dict((row[0], dict(zip(self._names, row[1:]))) for row in self._execute(self._nodes, chunk))
+            for id in chunk:
+                self._attrs.put(id, rows.get(id, _absent))
+            found.update(rows)
+        return found
+
+    def neighborhood(self, sources, depth=1, direction=None, attributes=True):
+        '''
+        Returns the subgraph induced by the nodes within ``depth`` hops of
+        ``sources`` (one node id or a list of them) as a ``csr.CSRGraph``,
+        with the node attributes if ``attributes`` is set. Node ids must
+        be integers.
+        '''
+        reached = list(self.bfs(sources, depth, direction))
+        inside = set(reached)
+        builder = csr.CSRBuilder()
+        attrs = self.node_attributes(reached) if attributes else {}
+        for id in reached:
+            builder.add_node(id, attrs.get(id))
+        adjacency = self.adjacency(reached, 'out')
+        for id in reached:
+            targets = [t for t in adjacency[id] if t in inside]
+            builder.add_edges([id] * len(targets), targets)
+        return builder.build()
+
+    def ego_network(self, id, radius=1, direction=None, attributes=True):
+        '''
+        Returns the subgraph induced by a node and the nodes within
+        ``radius`` hops of it (see ``neighborhood``)
+        '''
+        return self.neighborhood([id], radius, direction, attributes)
+
+    def cache_info(self):
+        '''
+        Returns the lookups answered from the cache (``hits``) and from
+        the database (``misses``), the ``queries`` sent, and the number of
+        ``cached_lists`` and the ``cached_edges`` in them
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'queries': self.queries,
+                'cached_lists': len(self._adjacency),
+                'cached_edges': self._adjacency.weight - len(self._adjacency)}
+
+    def clear_cache(self):
+        self._adjacency.clear()
+        self._attrs.clear()
+
+    def close(self):
+        if self._owns_connection:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return '<LazyGraph: %d cached adjacency lists, %d queries>' % (len(self._adjacency), self.queries)
+
+# Cached for nodes that the Nodes rules do not produce
+_absent = object()
+
+__all__ = ['LazyGraph', 'LRUCache']
@@ -0,0 +1,69 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+
+import com.umdb.graphgen.PyGenerateGraph;
+
+/**
+ * Long-lived extraction worker used by graphgenpy.
+ *
+ * Reads one extraction request per line from stdin. A request holds the
+ * arguments of PyGenerateGraph separated by tabs, with backslashes, tabs and
+ * newlines escaped. After every request a single status line is written to
+ * stdout: "OK", or "ERR" followed by a tab and the escaped error message.
+ * Everything PyGenerateGraph prints goes to stderr so that it never mixes
+ * with the protocol.
+ *
+ * Launched as a single-file source program (JDK 11+) with the GraphGen jar
+ * on the classpath.
+ */
+public class PyGraphGenWorker {
+
+	public static void main(String[] args) throws IOException {
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+		PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+		System.setOut(System.err);
+
+		out.println("READY");
+		String line;
+		while ((line = in.readLine()) != null) {
+			String[] fields = line.split("\t", -1);
+			for (int i = 0; i < fields.length; i++) {
+				fields[i] = unescape(fields[i]);
+			}
+			try {
+				PyGenerateGraph.main(fields);
+				out.println("OK");
+			} catch (Throwable t) {
+				t.printStackTrace();
+				out.println("ERR\t" + escape(String.valueOf(t)));
+			}
+		}
+	}
+
+	private static String escape(String s) {
+		return s.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r");
+	}
+
+	private static String unescape(String s) {
+		StringBuilder sb = new StringBuilder(s.length());
+		for (int i = 0; i < s.length(); i++) {
+			char c = s.charAt(i);
+			if (c == '\\' && i + 1 < s.length()) {
+				char n = s.charAt(++i);
+				switch (n) {
+				case 't': sb.append('\t'); break;
+				case 'n': sb.append('\n'); break;
+				case 'r': sb.append('\r'); break;
+				default: sb.append(n);
+				}
+			} else {
+				sb.append(c);
+			}
+		}
+		return sb.toString();
+	}
+}
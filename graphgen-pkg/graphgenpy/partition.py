@@ -0,0 +1,278 @@
+# partition.py
+# Partitioned (sharded) graph output and a parallel loader for it.
+#
+# A partitioned graph is a directory holding a manifest.json and one shard
+# per partition. Nodes are assigned to partitions by a hash of their id or by
+# id range, and every edge is stored with the partition of its source, so a
+# shard holds its nodes together with their out-edges (an edge cut). Shards
+# are written in the serialization format of the extraction: a GML or
+# GraphSON file, or for CSR a directory of arrays (``ids``, ``offsets`` and
+# ``targets``, the latter holding node ids since targets may live in other
+# shards).
+#
+# `load_partitioned` parses the shards in a pool of processes and either
+# assembles them into one `csr.CSRGraph` or keeps them apart as a
+# `PartitionedGraph` for partition-at-a-time processing.
+
+import io
+import itertools
+import json
+import multiprocessing
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from . import attributes
+from . import csr
+from . import readers
+from . import writers
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+# A shard as loaded: its sorted node ids, the CSR offsets of their
+# out-edges, the edge target ids and the node attributes
+Shard = namedtuple('Shard', ['index', 'ids', 'offsets', 'targets', 'attrs'])
+
+##########################################################################
+# Partitioning
+##########################################################################
+
+_golden = np.uint64(0x9E3779B97F4A7C15)
+
+def hash_partition(ids, partitions):
+    '''
+    Returns the partition of every node id by Fibonacci hashing, which
+    spreads runs of consecutive ids over all partitions
+    '''
+    hashed = np.asarray(ids, dtype=np.int64).view(np.uint64) * _golden
+    return ((hashed >> np.uint64(32)) % np.uint64(partitions)).astype(np.int64)
+
+def range_bounds(ids, partitions):
+    '''
+    Returns the ``partitions - 1`` ids that split the sorted ``ids`` into
+    ranges of about the same number of nodes
+    '''
+    n = len(ids)
+    return [int(ids[k * n // partitions]) for k in range(1, partitions)] if n else []
+
+def range_partition(ids, bounds):
+    '''
+    Returns the partition of every node id given the range ``bounds``
+    '''
+    return np.searchsorted(np.asarray(bounds, dtype=np.int64), ids, side='right')
+
+def partition_of(ids, manifest):
+    '''
+    Returns the partition of every node id under the scheme recorded in
+    a manifest
+    '''
+    if manifest['scheme'] == 'range':
+        return range_partition(ids, manifest['bounds'])
+    return hash_partition(ids, manifest['partitions'])
+
+##########################################################################
+# Writing
+##########################################################################
+
+def _shard_name(index, serialization_format):
+    return 'part-%05d.%s' % (index, serialization_format)
+
+def _shard_records(ids, offsets, targets, attrs, chunksize=10000):
+    nodes = iter(zip(ids.tolist(), attrs.dicts()))
+    for start in range(0, len(ids), chunksize):
+        yield [readers.Node(id, values) for id, values in itertools.islice(nodes, chunksize)]
+    sources = np.repeat(ids, np.diff(offsets))
+    for start in range(0, len(sources), chunksize):
+        yield [readers.Edge(s, t, {}) for s, t in zip(sources[start:start + chunksize].tolist(),
+                                                     targets[start:start + chunksize].tolist())]
+
+def write_partitioned(graph, path, partitions, serialization_format='gml', scheme='hash', query=None):
+    '''
+    Writes a ``csr.CSRGraph`` (typically memory-mapped) to the directory
+    ``path`` as ``partitions`` shards plus a manifest, one shard at a time
+    so that only one shard is held in memory. Returns the manifest.
+
+    :param scheme: ``'hash'`` or ``'range'`` partitioning of the node ids.
+    '''
+    if scheme not in ('hash', 'range'):
+        raise ValueError("scheme must be 'hash' or 'range'")
+    if partitions < 1:
+        raise ValueError('partitions must be at least 1')
+    ids = np.asarray(graph.ids)
+    manifest = {'version': VERSION, 'serialization_format': serialization_format,
+                'partitions': partitions, 'scheme': scheme, 'query': query,
+                'nodes': int(len(ids)), 'edges': int(graph.number_of_edges()), 'shards': []}
+    if scheme == 'range':
+        manifest['bounds'] = range_bounds(ids, partitions)
+    owner = partition_of(ids, manifest)
+    out_degree = np.diff(graph.offsets)
+    attrs = graph.attrs
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for index in range(partitions):
+        rows = np.flatnonzero(owner == index)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(out_degree[rows], out=offsets[1:])
+        targets = ids[csr.gather_rows(graph.offsets, graph.neighbors, rows)]
+        shard_ids = ids[rows]
+        shard_attrs = attrs.take(rows, shard_ids)
+
+        name = _shard_name(index, serialization_format)
+        shard = os.path.join(path, name)
+        if serialization_format == 'csr':
+            csr.save_arrays(shard, {'ids': shard_ids, 'offsets': offsets, 'targets': targets}, shard_attrs)
+        else:
+            writers.write_records(_shard_records(shard_ids, offsets, targets, shard_attrs),
+                                  shard, serialization_format)
+        manifest['shards'].append({'path': name, 'nodes': int(len(rows)), 'edges': int(len(targets))})
+
+    # The manifest is written last: a directory without one is incomplete
+    _write_manifest(path, manifest)
+    return manifest
+
+def _write_manifest(path, manifest):
+    text = json.dumps(manifest, ensure_ascii=False) + '\n'
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    tmp = os.path.join(path, MANIFEST + '.tmp')
+    with io.open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.rename(tmp, os.path.join(path, MANIFEST))
+
+##########################################################################
+# Reading
+##########################################################################
+
+def read_manifest(path):
+    with io.open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != VERSION:
+        raise ValueError('Unsupported partitioned graph version: %r' % (manifest.get('version'),))
+    return manifest
+
+def read_shard(task):
+    '''
+    Reads one shard; ``task`` is ``(path, index, serialization_format,
+    mmap)``. Runs in the worker processes of ``load_partitioned``.
+    '''
+    path, index, serialization_format, mmap = task
+    if serialization_format == 'csr':
+        ids, offsets, targets = csr.load_arrays(path, ('ids', 'offsets', 'targets'), mmap)
+        return Shard(index, ids, offsets, targets, attributes.load_attributes(path, ids))
+
+    with io.open(path, 'r', encoding='utf-8') as f:
+        if serialization_format == 'gml':
+            try:
+                node_ids, sources, targets, attrs = _scan_shard(readers._scan_gml(f))
+            except readers._UnsupportedGML:
+                f.seek(0)
+                node_ids, sources, targets, attrs = _scan_shard(_record_chunks(f, serialization_format))
+        else:
+            node_ids, sources, targets, attrs = _scan_shard(_record_chunks(f, serialization_format))
+    ids = np.sort(csr._id_array(node_ids))
+    attrs = attrs.build(ids)
+    # Edges of a shard come from its own nodes; order them by source
+    rows = np.searchsorted(ids, sources)
+    edge_order = np.argsort(rows, kind='mergesort')
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=offsets[1:])
+    return Shard(index, ids, offsets, targets[edge_order], attrs)
+
+def _record_chunks(f, serialization_format):
+    # Records in the (nodes, sources, targets) chunks of readers._scan_gml
+    for chunk in readers.chunked(readers.iter_records(f, serialization_format), 1 << 16):
+        edges = [r for r in chunk if isinstance(r, readers.Edge)]
+        yield ([r for r in chunk if not isinstance(r, readers.Edge)],
+               csr._id_array([e.source for e in edges]), csr._id_array([e.target for e in edges]))
+
+def _scan_shard(chunks):
+    node_ids, sources, targets = [], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    attrs = attributes.AttributeBuilder()
+    for nodes, chunk_sources, chunk_targets in chunks:
+        for node in nodes:
+            node_ids.append(node.id)
+            if node.attrs:
+                attrs.add(node.id, node.attrs)
+        sources.append(chunk_sources)
+        targets.append(chunk_targets)
+    return node_ids, np.concatenate(sources), np.concatenate(targets), attrs
+
+class PartitionedGraph(object):
+    '''
+    The shards of a partitioned graph, kept apart. ``shards[i]`` holds the
+    nodes of partition ``i`` and their out-edges.
+    '''
+
+    def __init__(self, manifest, shards, path=None):
+        self.manifest = manifest
+        self.shards = shards
+        self.path = path
+
+    def number_of_nodes(self):
+        return sum(len(s.ids) for s in self.shards)
+
+    def number_of_edges(self):
+        return sum(len(s.targets) for s in self.shards)
+
+    def partition_of(self, ids):
+        '''
+        Returns the partition that owns every node id
+        '''
+        return partition_of(ids, self.manifest)
+
+    def assemble(self):
+        '''
+        Joins the shards into one ``csr.CSRGraph``
+        '''
+        return assemble(self.shards)
+
+    def __repr__(self):
+        return '<PartitionedGraph: %d partitions, %d nodes, %d edges>' % (
+            len(self.shards), self.number_of_nodes(), self.number_of_edges())
+
+def assemble(shards):
+    '''
+    Joins shards into one ``csr.CSRGraph``
+    '''
+    shards = list(shards)
+    node_ids = [np.asarray(s.ids, dtype=np.int64) for s in shards]
+    sources = [np.repeat(np.asarray(s.ids, dtype=np.int64), np.diff(s.offsets)) for s in shards]
+    targets = [np.asarray(s.targets, dtype=np.int64) for s in shards]
+    sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int64)
+    targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.int64)
+    # Vertices referenced only by edges still get a vertex number
+    ids = np.unique(np.concatenate(node_ids + [sources, targets]))
+    attrs = attributes.concat([(s.ids, s.attrs) for s in shards], ids)
+    return csr.from_edges(ids, np.searchsorted(ids, sources), np.searchsorted(ids, targets), attrs)
+
+def load_partitioned(path, processes=None, assemble=True, mmap=True):
+    '''
+    Loads a graph written with ``GraphGenerator.generateGraph(...,
+    partitions=N)``. GML and GraphSON shards are parsed in parallel by a
+    pool of ``processes`` worker processes (by default one per CPU, at
+    most one per shard); CSR shards are memory-mapped if ``mmap`` is set.
+
+    :param assemble: Return one ``csr.CSRGraph``; otherwise return a
+        ``PartitionedGraph`` of the separate shards.
+    '''
+    manifest = read_manifest(path)
+    fmt = manifest['serialization_format']
+    tasks = [(os.path.join(path, shard['path']), i, fmt, mmap) for i, shard in enumerate(manifest['shards'])]
+    processes = min(processes or multiprocessing.cpu_count(), len(tasks))
+    if fmt == 'csr' or processes <= 1:
+        shards = [read_shard(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            shards = pool.map(read_shard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    graph = PartitionedGraph(manifest, shards, path)
+    return graph.assemble() if assemble else graph
+
+__all__ = ['PartitionedGraph', 'Shard', 'load_partitioned', 'write_partitioned',
+           'hash_partition', 'range_partition']
@@ -0,0 +1,340 @@
+# planner.py
+# Pre-flight planning of the graph representation of an extraction.
+#
+# The Edges rule of a query such as
+#
+#   Edges(ID1, ID2) :- Orders(O1, ID1), Lineitem(O1, Part), Orders(O2, ID2), Lineitem(O2, Part).
+#
+# is a join of two halves on a key (Part). A key value bound by l rows on
+# the left and r on the right contributes l * r edges when expanded but only
+# l + r links when condensed into a virtual node (see `condensed`), so the
+# expanded graph blows up quadratically on popular keys. Before anything is
+# launched, the planner estimates both sizes from the statistics PostgreSQL
+# keeps on the key column (``pg_stats``: its most common values and their
+# frequencies, and a histogram of the other values) and picks:
+#
+#   expanded   when expanding costs at most EXPAND_FACTOR times the links,
+#   condensed  when nearly all edges come from heavy keys,
+#   hybrid     otherwise: heavy keys (l * r > EXPAND_FACTOR * (l + r)) stay
+#              virtual nodes and the edges of the other keys are stored
+#              directly.
+
+from collections import namedtuple
+
+from . import condensed
+from . import datalog
+from . import sizing
+
+# A key stays a virtual node when its clique has more than this many times
+# the edges of its links
+EXPAND_FACTOR = 4
+
+# Below this share of the hybrid graph, the direct edges are not worth a
+# hybrid graph
+HYBRID_SHARE = 0.05
+
+# A group of key values with the same estimated rows per value on the left
+# and right of the join; ``value`` is set for most common values only
+KeyGroup = namedtuple('KeyGroup', ['value', 'left', 'right', 'count'])
+
+ColumnStats = namedtuple('ColumnStats', ['table', 'column', 'null_frac', 'distinct', 'mcv', 'histogram'])
+
+class ExtractionPlan(object):
+    '''
+    The estimated size of a graph in every representation and the one
+    chosen for it. ``strategy`` is ``'expanded'``, ``'condensed'`` or
+    ``'hybrid'``; estimates that could not be made are None.
+    '''
+
+    def __init__(self, strategy, reason, nodes=None, edges=None, links=None, virtual_nodes=None,
+                 hybrid_edges=None, hybrid_links=None, heavy_keys=None, key=None, top_keys=(),
+                 planner_edges=None, expand_factor=EXPAND_FACTOR):
+        self.strategy = strategy
+        self.reason = reason
+        self.nodes = nodes
+        self.edges = edges
+        self.links = links
+        self.virtual_nodes = virtual_nodes
+        self.hybrid_edges = hybrid_edges
+        self.hybrid_links = hybrid_links
+        self.heavy_keys = heavy_keys
+        self.key = key
+        self.top_keys = list(top_keys)
+        self.planner_edges = planner_edges
+        self.expand_factor = expand_factor
+
+    def as_dict(self):
+        keys = ('strategy', 'reason', 'nodes', 'edges', 'links', 'virtual_nodes', 'hybrid_edges',
+                'hybrid_links', 'heavy_keys', 'key', 'top_keys', 'planner_edges', 'expand_factor')
+        return dict((key, getattr(self, key)) for key in keys)
+
+    def explain(self):
+        '''
+        Returns the plan as text
+        '''
+        lines = ['Strategy: %s (%s)' % (self.strategy, self.reason)]
+        if self.key is not None:
+            lines.append('Join key: %s' % self.key)
+        for label, value in (('Nodes', self.nodes), ('Expanded edges', self.edges),
+                             ('PostgreSQL edge estimate', self.planner_edges),
+                             ('Condensed links', self.links), ('Virtual nodes', self.virtual_nodes),
+                             ('Hybrid direct edges', self.hybrid_edges),
+                             ('Hybrid links', self.hybrid_links),
+                             ('Heavy keys', self.heavy_keys)):
+            if value is not None:
+                lines.append('%s: %s' % (label, _approx(value)))
+        if self.top_keys:
+            lines.append('Most expensive keys (value: edges):')
+            lines.extend('  %s: %s' % (value, _approx(edges)) for value, edges in self.top_keys)
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.explain()
+
+    def __repr__(self):
+        return '<ExtractionPlan: %s, ~%s edges>' % (self.strategy, _approx(self.edges))
+
+def _approx(value):
+    return 'unknown' if value is None else '{:,}'.format(int(round(value)))
+
+##########################################################################
+# Column statistics
+##########################################################################
+
+def column_stats(conn, table, column):
+    '''
+    Returns the ``ColumnStats`` PostgreSQL keeps on a column, or None if
+    the table has not been analyzed. ``distinct`` is the number of
+    distinct values, ``mcv`` a list of (value, frequency) pairs and
+    ``histogram`` the bounds of equally populated buckets of the other
+    values, all as text.
+    '''
+    cursor = conn.cursor()
+    cursor.execute("SELECT s.null_frac, s.n_distinct, s.most_common_vals::text::text[], "
+                   "s.most_common_freqs, s.histogram_bounds::text::text[], c.reltuples "
+                   "FROM pg_stats s JOIN pg_class c ON c.relname = s.tablename "
+                   "JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = s.schemaname "
+                   "WHERE s.tablename = %s AND s.attname = %s "
+                   "AND s.schemaname = ANY(current_schemas(false))", (table, column))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return None
+    null_frac, n_distinct, values, freqs, bounds, rows = row
+    # Negative n_distinct is minus the fraction of rows that are distinct
+    distinct = -n_distinct * max(rows, 0) if n_distinct < 0 else n_distinct
+    mcv = list(zip(values or [], freqs or []))
+    return ColumnStats(table, column, null_frac, max(distinct, len(mcv)), mcv, bounds or [])
+
+def _number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+def key_distribution(stats, comparisons=()):
+    '''
+    Returns the distribution of the values of a column as a list of
+    ``(value, probability, count)`` groups: ``count`` values, each holding
+    ``probability`` of the non-null rows. Most common values are groups of
+    their own; the other values are spread over the histogram buckets,
+    each holding the same share of the rows, in proportion to the width of
+    their range (or evenly if the column is not numeric).
+    ``comparisons`` are ``(op, constant)`` filters on the column.
+    '''
+    nonnull = max(1.0 - stats.null_frac, 1e-9)
+    groups = [(value, freq / nonnull, 1.0) for value, freq in stats.mcv]
+    rest = max(1.0 - sum(p for _, p, _ in groups), 0.0)
+    distinct = max(stats.distinct - len(groups), 0.0)
+    bounds = [_number(b) for b in stats.histogram]
+    buckets = []
+    if rest > 0 and distinct > 0:
+        if len(bounds) > 1 and None not in bounds:
+            widths = [hi - lo for lo, hi in zip(bounds, bounds[1:])]
+            total = sum(widths)
+            integral = all(b == int(b) for b in bounds)
+            for lo, hi, width in zip(bounds, bounds[1:], widths):
+                values = distinct * width / total if total else distinct / len(widths)
+                if integral:
+                    values = min(values, width + 1)
+                values = max(values, 1.0)
+                buckets.append((lo, hi, rest / len(widths) / values, values))
+        else:
+            buckets.append((None, None, rest / distinct, distinct))
+
+    for op, constant in comparisons:
+        constant = _number(constant)
+        if constant is None:
+            continue
+        groups = [g for g in groups if _number(g[0]) is None or _compare(_number(g[0]), op, constant)]
+        buckets = [(lo, hi, p, values * _range_share(lo, hi, op, constant)) for lo, hi, p, values in buckets]
+    groups += [(None, p, values) for _, _, p, values in buckets if values > 0]
+    # Probabilities among the rows that pass the filters
+    total = sum(p * count for _, p, count in groups)
+    return [(value, p / total, count) for value, p, count in groups] if total else []
+
+def _compare(value, op, constant):
+    return {'=': value == constant, '<>': value != constant, '<': value < constant,
+            '<=': value <= constant, '>': value > constant, '>=': value >= constant}[op]
+
+def _range_share(lo, hi, op, constant):
+    # The share of the values of the bucket [lo, hi] that pass a filter
+    if lo is None:
+        return 1.0 if op in ('<>', '!=') else 0.5
+    if op == '=':
+        return 1.0 / max(hi - lo, 1.0) if lo <= constant <= hi else 0.0
+    if op == '<>':
+        return 1.0
+    if hi == lo:
+        return 1.0 if _compare(lo, op, constant) else 0.0
+    below = min(max((constant - lo) / (hi - lo), 0.0), 1.0)
+    return below if op in ('<', '<=') else 1.0 - below
+
+##########################################################################
+# Join size estimation
+##########################################################################
+
+def join_groups(left, right, left_rows, right_rows, same_column=False):
+    '''
+    Pairs the key distributions of the two halves of a join into
+    ``KeyGroup``\\ s of values with ``left`` and ``right`` rows each. With
+    ``same_column`` both halves read the same column under the same
+    filters and are paired value for value; otherwise most common values
+    are matched by value and the others assumed to match uniformly, like
+    PostgreSQL's join selectivity estimate.
+    '''
+    if same_column:
+        return [KeyGroup(value, left_rows * p, right_rows * q, count)
+                for (value, p, count), (_, q, _) in zip(left, right)]
+    lmcv = dict((v, p) for v, p, _ in left if v is not None)
+    rmcv = dict((v, p) for v, p, _ in right if v is not None)
+    lrest = [(p, c) for v, p, c in left if v is None]
+    rrest = [(p, c) for v, p, c in right if v is None]
+    lavg, lcount = _average(lrest)
+    ravg, rcount = _average(rrest)
+    groups = []
+    for value, p in lmcv.items():
+        q = rmcv.get(value, ravg if rcount else 0.0)
+        if q:
+            groups.append(KeyGroup(value, left_rows * p, right_rows * q, 1.0))
+    for value, q in rmcv.items():
+        if value not in lmcv and lcount:
+            groups.append(KeyGroup(value, left_rows * lavg, right_rows * q, 1.0))
+    matched = min(lcount - len([v for v in rmcv if v not in lmcv]),
+                  rcount - len([v for v in lmcv if v not in rmcv]))
+    if matched > 0:
+        groups.append(KeyGroup(None, left_rows * lavg, right_rows * ravg, matched))
+    return groups
+
+def _average(groups):
+    count = sum(c for _, c in groups)
+    return (sum(p * c for p, c in groups) / count if count else 0.0), count
+
+def summarize(groups, expand_factor=EXPAND_FACTOR, top=5):
+    '''
+    Returns the estimated ``edges``, ``links``, ``virtual_nodes``,
+    ``hybrid_edges``, ``hybrid_links``, ``heavy_keys`` and ``top_keys`` of
+    a join from its ``KeyGroup``\\ s
+    '''
+    totals = dict(edges=0.0, links=0.0, virtual_nodes=0.0, hybrid_edges=0.0,
+                  hybrid_links=0.0, heavy_keys=0.0)
+    for g in groups:
+        edges, links = g.left * g.right, g.left + g.right
+        totals['edges'] += g.count * edges
+        totals['links'] += g.count * links
+        totals['virtual_nodes'] += g.count
+        if edges > expand_factor * links:
+            totals['hybrid_links'] += g.count * links
+            totals['heavy_keys'] += g.count
+        else:
+            totals['hybrid_edges'] += g.count * edges
+    ranked = sorted((g for g in groups if g.value is not None), key=lambda g: -g.left * g.right)
+    totals['top_keys'] = [(g.value, g.left * g.right) for g in ranked[:top]]
+    return totals
+
+##########################################################################
+# Planning
+##########################################################################
+
+def _key_column(atoms, variable, columns):
+    # The (table, column) of the first atom that binds a variable
+    for atom in atoms:
+        for column, term in zip(columns(atom.name), atom.terms):
+            if term == datalog.Var(variable):
+                return atom.name.lower(), column
+    return None
+
+def _key_filters(comparisons, variable):
+    # (op, constant) filters on a variable, with the variable on the left
+    flipped = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '<>': '<>'}
+    var = datalog.Var(variable)
+    filters = []
+    for c in comparisons:
+        if c.left == var and isinstance(c.right, datalog.Const):
+            filters.append((c.op, c.right.value))
+        elif c.right == var and isinstance(c.left, datalog.Const):
+            filters.append((flipped[c.op], c.left.value))
+    return sorted(filters)
+
+def choose(totals, expand_factor=EXPAND_FACTOR):
+    '''
+    Returns the ``(strategy, reason)`` for the estimated sizes of a join
+    '''
+    edges, links = totals['edges'], totals['links']
+    if edges <= expand_factor * links:
+        return 'expanded', 'expanding adds at most %gx the condensed links' % expand_factor
+    hybrid = totals['hybrid_edges'] + totals['hybrid_links']
+    if totals['hybrid_edges'] <= HYBRID_SHARE * hybrid:
+        return 'condensed', 'heavy join keys produce nearly all of the edges'
+    return 'hybrid', '%s heavy join keys blow up; the others are cheap to expand' % _approx(totals['heavy_keys'])
+
+def plan_extraction(conn, query, expand_factor=EXPAND_FACTOR):
+    '''
+    Plans the extraction of a Datalog query: estimates the size of its
+    graph expanded, condensed and hybrid, and returns an
+    ``ExtractionPlan`` with the representation to use
+    '''
+    rules = datalog.parse(query)
+    catalog = datalog.Catalog(conn)
+    try:
+        nodes = sum(sizing.estimate_rows(conn, *datalog.compile_rule(r, catalog))
+                    for r in datalog.node_rules(rules))
+        edge_rules = datalog.edge_rules(rules)
+        planner_edges = sum(sizing.estimate_rows(conn, *datalog.compile_rule(r, catalog)) for r in edge_rules)
+        plan = dict(nodes=nodes, planner_edges=planner_edges, edges=planner_edges, expand_factor=expand_factor)
+        if len(edge_rules) != 1:
+            return ExtractionPlan('expanded', 'only a single Edges rule can be condensed', **plan)
+        try:
+            split = condensed.split_rule(edge_rules[0])
+        except ValueError as e:
+            return ExtractionPlan('expanded', str(e), **plan)
+
+        halves = [split.half('left'), split.half('right')]
+        rows = [sizing.estimate_rows(conn, *datalog.compile_rule(h, catalog)) for h in halves]
+        # Estimated on the first key variable; further ones only narrow it
+        variable = split.key[0]
+        sides = []
+        for atoms, comparisons in ((split.left, split.left_comparisons), (split.right, split.right_comparisons)):
+            column = _key_column(atoms, variable, catalog)
+            sides.append((column, _key_filters(comparisons, variable)))
+        stats = [column_stats(conn, *column) if column else None for column, _ in sides]
+        plan['key'] = '.'.join(sides[0][0]) if sides[0][0] else variable
+        if None in stats:
+            totals = dict(edges=planner_edges, links=float(sum(rows)), hybrid_edges=0.0, hybrid_links=0.0,
+                          heavy_keys=None)
+            strategy, reason = choose(totals, expand_factor)
+            plan.update(links=totals['links'])
+            return ExtractionPlan(strategy, reason + ' (no statistics on the join key; run ANALYZE)', **plan)
+
+        distributions = [key_distribution(s, filters) for s, (_, filters) in zip(stats, sides)]
+        groups = join_groups(distributions[0], distributions[1], rows[0], rows[1],
+                             same_column=sides[0] == sides[1])
+        totals = summarize(groups, expand_factor)
+        strategy, reason = choose(totals, expand_factor)
+        plan.update((k, totals[k]) for k in ('edges', 'links', 'virtual_nodes', 'hybrid_edges',
+                                             'hybrid_links', 'heavy_keys', 'top_keys'))
+        return ExtractionPlan(strategy, reason, **plan)
+    finally:
+        conn.rollback()
+
+__all__ = ['ExtractionPlan', 'plan_extraction', 'EXPAND_FACTOR']
@@ -0,0 +1,317 @@
+# readers.py
+# Incremental parsers for the GML and GraphSON files written by GraphGen.
+#
+# Both parsers consume a file object a line (or a buffer) at a time and yield
+# node and edge records as soon as they are complete, so they work on pipes
+# as well as on files on disk.
+
+import io
+import os
+import re
+import json
+from collections import namedtuple
+
+import numpy as np
+
+Node = namedtuple('Node', ['id', 'attrs'])
+Edge = namedtuple('Edge', ['source', 'target', 'attrs'])
+
+##########################################################################
+# GML
+##########################################################################
+
+_gml_token = re.compile(r'''
+    (?P<open>\[) | (?P<close>\]) |
+    "(?P<string>[^"]*)" |
+    (?P<key>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+''', re.VERBOSE)
+
+_gml_entities = (('&quot;', '"'), ('&lt;', '<'), ('&gt;', '>'),
+                 ('&apos;', "'"), ('&amp;', '&'))
+
+def _gml_string(value):
+    if '&' in value:
+        for entity, char in _gml_entities:
+            value = value.replace(entity, char)
+    return value
+
+def _gml_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+_open, _close = object(), object()
+
+def _gml_items(f):
+    # Yields (key, value) pairs, with value _open for "key [" and
+    # (None, _close) for "]"
+    pending = ''
+    key = None
+    for line in f:
+        if pending:
+            line, pending = pending + line, ''
+        # Strings may span lines; wait for the closing quote
+        if '"' in line and line.count('"') % 2:
+            pending = line
+            continue
+        parts = line.split(None, 1)
+        if not parts or parts[0][0] == '#':
+            continue
+        # Fast path for the one "key value" pair per line that GraphGen writes
+        if key is None:
+            if len(parts) == 2:
+                value = parts[1].rstrip()
+                if value == '[':
+                    yield parts[0], _open
+                    continue
+                if value[0] == '"':
+                    if value.count('"') == 2 and value[-1] == '"':
+                        yield parts[0], _gml_string(value[1:-1])
+                        continue
+                elif ' ' not in value:
+                    try:
+                        yield parts[0], _gml_number(value)
+                        continue
+                    except ValueError:
+                        pass
+            elif parts[0] == ']':
+                yield None, _close
+                continue
+        for m in _gml_token.finditer(line):
+            kind = m.lastgroup
+            if kind == 'close' and key is None:
+                yield None, _close
+            elif kind == 'key' and key is None:
+                key = m.group(kind)
+            elif kind == 'open':
+                yield key, _open
+                key = None
+            elif kind == 'string':
+                yield key, _gml_string(m.group(kind))
+                key = None
+            elif kind == 'number':
+                yield key, _gml_number(m.group(kind))
+                key = None
+            else:
+                raise ValueError('Malformed GML line: %r' % (line,))
+
+def iter_gml(f):
+    """
+    Parse a GML document and yield a ``Node`` or ``Edge`` record for every
+    ``node [ ... ]`` and ``edge [ ... ]`` block of the top-level graph.
+    Other graph-level keys are skipped and nested lists inside a node or
+    edge are returned as dicts in its attributes.
+    :param f: A file object (or any iterable of lines).
+    """
+    stack = []
+    for key, value in _gml_items(f):
+        if value is _close:
+            if not stack:
+                raise ValueError('Unbalanced "]" in GML input')
+            name, block = stack.pop()
+            if len(stack) == 1:
+                if name == 'node':
+                    yield _node(block.pop('id'), block)
+                elif name == 'edge':
+                    source = block.pop('source')
+                    yield Edge(_node_id(source), _node_id(block.pop('target')), block)
+            elif stack:
+                stack[-1][1][name] = block
+        elif value is _open:
+            stack.append((key, {}))
+        elif stack:
+            stack[-1][1][key] = value
+    if stack:
+        raise ValueError('Truncated GML input')
+
+# Bulk scanner for the flat node/edge blocks GraphGen writes. Edge endpoints
+# are pulled out of a whole buffer with one regex each and converted to
+# arrays, so no per-edge Python objects are created. Anything outside that
+# subset (nested lists, quoted ids) makes it give up, and the general parser
+# reads the file; the ids must still be integers for the CSR graph. Brackets
+# inside quoted strings do not end a block.
+_gml_node = re.compile(r'node\s*\[((?:[^\[\]"]|"[^"]*")*)\]')
+_gml_node_start = re.compile(r'node\s*\[')
+_gml_edge_start = re.compile(r'edge\s*\[')
+_gml_source = re.compile(r'source\s+(-?\d+)')
+_gml_target = re.compile(r'target\s+(-?\d+)')
+_gml_pair = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)\s+(?:"([^"]*)"|([^\s"]+))')
+
+class _UnsupportedGML(Exception):
+    pass
+
+def _int_array(digits):
+    # Let numpy parse the integers in C rather than calling int() on each
+    return np.fromstring(' '.join(digits), dtype=np.int64, sep=' ')
+
+def _blocks_end(buf):
+    # The end of the last "]" of buf outside a quoted string (GML escapes
+    # quotes within strings), or 0
+    end = buf.rfind(']')
+    while end >= 0 and buf.count('"', 0, end) % 2:
+        end = buf.rfind(']', 0, end)
+    return end + 1
+
+def _scan_gml(f, bufsize=1 << 22):
+    # Yields (nodes, sources, targets) for every buffer of complete blocks
+    buf, eof = '', False
+    while not eof:
+        chunk = f.read(bufsize)
+        eof = not chunk
+        buf += chunk
+        # Everything up to the last "]" is made of complete blocks
+        end = _blocks_end(buf)
+        region, buf = buf[:end], buf[end:]
+        nodes = []
+        for m in _gml_node.finditer(region):
+            block = {}
+            for key, string, number in _gml_pair.findall(m.group(1)):
+                block[key] = _gml_number(number) if number else _gml_string(string)
+            nodes.append(_node(block.pop('id'), block))
+        sources = _gml_source.findall(region)
+        targets = _gml_target.findall(region)
+        edges = len(_gml_edge_start.findall(region))
+        if (len(nodes) != len(_gml_node_start.findall(region)) or
+                not len(sources) == len(targets) == edges):
+            raise _UnsupportedGML()
+        yield nodes, _int_array(sources), _int_array(targets)
+    if buf.strip():
+        raise _UnsupportedGML()
+
+##########################################################################
+# GraphSON
+##########################################################################
+
+_graphson_array = re.compile(r'"(vertices|edges)"\s*:\s*\[')
+_graphson_skip = re.compile(r'[\s,]*')
+
+def iter_graphson(f, bufsize=1 << 16):
+    """
+    Parse a GraphSON document and yield a ``Node`` record for every element
+    of its ``vertices`` array and an ``Edge`` record for every element of its
+    ``edges`` array. Elements are decoded one at a time from a rolling
+    buffer, so the document is never held in memory as a whole.
+    :param f: A file object opened in text mode.
+    :param bufsize: Number of characters read from ``f`` at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, array, eof = '', 0, None, False
+    while True:
+        if array is None:
+            m = _graphson_array.search(buf, pos)
+            if m:
+                array, pos = m.group(1), m.end()
+                continue
+            if eof:
+                return
+            # Keep enough of the tail to match a key split across reads
+            buf, pos = buf[max(pos, len(buf) - 32):], 0
+        else:
+            pos = _graphson_skip.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] == ']':
+                    array, pos = None, pos + 1
+                    continue
+                try:
+                    element, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise ValueError('Truncated GraphSON input')
+                else:
+                    yield _graphson_record(array, element)
+                    continue
+            elif eof:
+                raise ValueError('Truncated GraphSON input')
+            buf, pos = buf[pos:], 0
+        chunk = f.read(bufsize)
+        eof = not chunk
+        buf += chunk
+
+def _graphson_record(array, element):
+    element.pop('_type', None)
+    if 'label' not in element and '_label' in element:
+        element['label'] = element.pop('_label')
+    if array == 'vertices':
+        return _node(element.pop('_id'), element)
+    element.pop('_id', None)
+    source = element.pop('_outV')
+    return Edge(_node_id(source), _node_id(element.pop('_inV')), element)
+
+##########################################################################
+# Helpers
+##########################################################################
+
+def _node_id(value):
+    # Node ids are database keys; GraphSON writes them as strings
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _node(id, attrs):
+    return Node(_node_id(id), attrs)
+
+def iter_records(f, serialization_format='gml'):
+    """
+    Yield the node and edge records of a serialized graph.
+    :param f: A file object opened in text mode.
+    :param serialization_format: ``'gml'`` or ``'json'`` (GraphSON).
+    """
+    if serialization_format == 'gml':
+        return iter_gml(f)
+    if serialization_format == 'json':
+        return iter_graphson(f)
+    raise ValueError('Unsupported serialization format: %r' % (serialization_format,))
+
+def chunked(records, chunksize):
+    """
+    Group an iterable of records into lists of at most ``chunksize`` items.
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+##########################################################################
+# Files on disk
+##########################################################################
+
+_extensions = {'.gml': 'gml', '.json': 'json'}
+
+def read_graph(path, serialization_format=None):
+    """
+    Read a GML or GraphSON file written by GraphGen in a single pass,
+    straight into a ``csr.CSRGraph``, without building per-node dicts of
+    neighbors. Use ``CSRGraph.to_networkx`` or ``CSRGraph.to_scipy`` to
+    convert the result. Node ids must be integers: ``ValueError`` is
+    raised otherwise.
+    :param path: The file written by ``GraphGenerator.generateGraph``.
+    :param serialization_format: ``'gml'`` or ``'json'``; guessed from the
+        file extension if not given.
+    """
+    from . import csr
+    if serialization_format is None:
+        serialization_format = _extensions.get(os.path.splitext(path)[1].lower(), 'gml')
+    with io.open(path, 'r', encoding='utf-8') as f:
+        if serialization_format == 'gml':
+            try:
+                builder = csr.CSRBuilder()
+                for nodes, sources, targets in _scan_gml(f):
+                    builder.add_records(nodes)
+                    builder.add_edges(sources, targets)
+                return builder.build()
+            except _UnsupportedGML:
+                f.seek(0)
+        builder = csr.CSRBuilder()
+        builder.add_records(iter_records(f, serialization_format))
+        return builder.build()
+
+__all__ = ['Node', 'Edge', 'iter_gml', 'iter_graphson', 'iter_records', 'read_graph']
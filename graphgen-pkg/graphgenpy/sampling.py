@@ -0,0 +1,342 @@
+# sampling.py
+# Sampled extraction: a quick preview of the graph of a query, with
+# estimates of the size of the full graph.
+#
+# Sampling is by a hash of the values of one variable of the rules, so that
+# every atom binding it keeps the same values and joins stay consistent:
+# sampling P in
+#
+#   Edges(A, B) :- AuthorPublication(A, P), AuthorPublication(B, P).
+#
+# keeps, for every sampled publication, all the co-author edges it
+# produces. Each atom binding the variable is read from a temporary view of
+# its table that keeps the rows whose value hashes below the sampling
+# fraction. (TABLESAMPLE would sample every relation independently: a self
+# join would keep a fraction p squared of its rows, with no known
+# probability for an edge to be kept.)
+#
+# The variable is either a join key (a body variable, by default the one
+# most atoms of the Edges rule share), which keeps every node and a part of
+# its edges, or an endpoint of the edges (a head variable of the Edges
+# rules, sampled along with the node ids of the Nodes rules), which keeps a
+# fraction of the nodes with all their out- or in-edges.
+#
+# The counts of the full graph are Horvitz-Thompson estimates: every
+# sampled node or edge is weighted by the inverse of its probability of
+# being sampled. That is p for a node, and for an edge when sampling
+# endpoints. An edge produced by k values of a sampled join key is kept with
+# probability 1 - (1 - p)^k, where k is counted in the full data for the
+# sampled edges only. Confidence intervals come from random groups: the
+# sampled values are split by hash into REPLICATES groups, each one an
+# independent sample of fraction p / REPLICATES, and the spread of their
+# estimates gives the variance.
+#
+# A few heavy keys can produce most of the edges of a join, and a sample
+# that misses them is far off with no sign of it in its variance. The most
+# common values of the key columns in the PostgreSQL statistics that are at
+# least HEAVY_FACTOR times as frequent as the average value are therefore
+# estimated apart: the distinct edges they produce are counted exactly in
+# the database (without fetching them), and only the sampled edges that no
+# heavy key produces are weighted.
+
+import math
+import zlib
+from collections import OrderedDict, namedtuple
+
+from . import datalog
+from . import planner
+
+# Random groups the sample is split into for confidence intervals
+REPLICATES = 16
+# The 97.5% quantile of Student's t distribution with REPLICATES - 1
+# degrees of freedom, for 95% confidence intervals
+_t975 = 2.131
+
+# How much more frequent than the average value a key must be to have its
+# edges counted exactly
+HEAVY_FACTOR = 10
+
+_hash_range = 1 << 31
+
+Estimate = namedtuple('Estimate', ['value', 'low', 'high'])
+
+class SampleEstimate(object):
+    '''
+    Estimates of the full graph from a sample. ``nodes`` and ``edges`` are
+    ``Estimate(value, low, high)`` tuples with 95% confidence bounds
+    (``nodes`` is None without Nodes rules); ``sampled_nodes`` and
+    ``sampled_edges`` are the counts in the sample.
+    '''
+
+    def __init__(self, fraction, variable, mode, nodes, edges, sampled_nodes, sampled_edges):
+        self.fraction = fraction
+        self.variable = variable
+        self.mode = mode
+        self.nodes = nodes
+        self.edges = edges
+        self.sampled_nodes = sampled_nodes
+        self.sampled_edges = sampled_edges
+
+    @property
+    def density(self):
+        '''
+        The estimated edge density of the full graph, ``m / (n (n - 1))``
+        '''
+        if self.nodes is None or self.nodes.value <= 1:
+            return None
+        return self.edges.value / (self.nodes.value * (self.nodes.value - 1))
+
+    def as_dict(self):
+        keys = ('fraction', 'variable', 'mode', 'sampled_nodes', 'sampled_edges', 'density')
+        d = dict((key, getattr(self, key)) for key in keys)
+        d['nodes'] = self.nodes._asdict() if self.nodes is not None else None
+        d['edges'] = self.edges._asdict()
+        return d
+
+    def __str__(self):
+        lines = ['Sample of %.4g%% by %s %s: %d nodes, %d edges'
+                 % (100 * self.fraction, 'node' if self.mode == 'nodes' else 'key', self.variable,
+                    self.sampled_nodes, self.sampled_edges)]
+        for name, estimate in (('nodes', self.nodes), ('edges', self.edges)):
+            if estimate is not None:
+                lines.append('  estimated %s: %.0f (95%% CI %.0f - %.0f)' % ((name,) + tuple(estimate)))
+        if self.density is not None:
+            lines.append('  estimated density: %.3g' % self.density)
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '<SampleEstimate: %s>' % ', '.join('%s=%.0f' % (name, estimate.value) for name, estimate in
+                                                  (('nodes', self.nodes), ('edges', self.edges))
+                                                  if estimate is not None)
+
+##########################################################################
+# Sampling rules
+##########################################################################
+
+def join_key(rules):
+    '''
+    Returns the body variable of the Edges rule that most atoms share, or
+    None if there are several Edges rules or no join variable
+    '''
+    if len(rules) != 1:
+        return None
+    rule = rules[0]
+    head = set(t.name for t in rule.head.terms if isinstance(t, datalog.Var))
+    counts = OrderedDict()
+    for atom in rule.atoms:
+        for name in set(t.name for t in atom.terms if isinstance(t, datalog.Var)) - head:
+            counts[name] = counts.get(name, 0) + 1
+    best = max(counts.values()) if counts else 0
+    return next((name for name, count in counts.items() if count == best), None) if best > 1 else None
+
+def _column(atom, variable):
+    for i, term in enumerate(atom.terms):
+        if term == datalog.Var(variable):
+            return i
+    return None
+
+class _ViewCatalog(object):
+    # A datalog.Catalog that also knows the columns of the sampled views
+
+    def __init__(self, catalog, views):
+        self.catalog = catalog
+        self.views = views
+
+    def __call__(self, table):
+        columns = self.views.get(table.lower())
+        return columns if columns is not None else self.catalog(table)
+
+class Sample(object):
+    '''
+    The design of a sample of the graph of ``rules``: keep the values of
+    the variable ``sample_by`` whose hash falls in a ``fraction`` of the
+    hash range chosen by ``seed``. By default the variable is the join key
+    of the Edges rule, or else the source of the edges.
+    '''
+
+    def __init__(self, rules, fraction, sample_by=None, seed=0):
+        if not 0 < fraction <= 1:
+            raise ValueError('The sampling fraction must be in (0, 1]')
+        self.threshold = max(1, int(round(fraction * _hash_range)))
+        self.fraction = float(self.threshold) / _hash_range
+        self.seed = seed
+        self.nodes, self.edges = datalog.node_rules(rules), datalog.edge_rules(rules)
+        if not self.edges:
+            raise ValueError('Datalog query has no Edges rule')
+        self.variable = sample_by or join_key(self.edges)
+        if self.variable is None:
+            self.mode, self.position = 'nodes', 0
+            variables = [rule.head.terms[0] for rule in self.edges]
+        else:
+            positions = set()
+            for rule in self.edges:
+                if datalog.Var(self.variable) in rule.head.terms[:2]:
+                    positions.add(list(rule.head.terms).index(datalog.Var(self.variable)))
+                elif self.variable in rule.variables():
+                    positions.add(None)
+                else:
+                    raise ValueError('Edges rule %s does not use the sampled variable %s' % (rule, self.variable))
+            if len(positions) > 1:
+                raise ValueError('The sampled variable %s must be a join key or the same endpoint '
+                                 'in every Edges rule' % self.variable)
+            self.position = positions.pop()
+            self.mode = 'keys' if self.position is None else 'nodes'
+            variables = [datalog.Var(self.variable)] * len(self.edges)
+        if self.mode == 'nodes':
+            variables += [rule.head.terms[0] for rule in self.nodes]
+        if any(not isinstance(v, datalog.Var) for v in variables):
+            raise ValueError('Cannot sample on a constant node id')
+        self._variables = dict((id(rule), v.name) for rule, v in zip(self.edges + self.nodes, variables))
+        self.heavy = []
+
+    def rewrite(self, conn, catalog):
+        '''
+        Creates a temporary view of the sampled rows of every table the
+        sampled variable is read from. Returns the rules rewritten to read
+        them and a catalog that knows the views.
+        '''
+        if self.mode == 'keys':
+            self.heavy = self._heavy_keys(conn, catalog)
+        views, rules = OrderedDict(), []
+        cursor = conn.cursor()
+        try:
+            for rule in self.nodes + self.edges:
+                variable, atoms = self._variables.get(id(rule)), []
+                for atom in rule.atoms:
+                    column = _column(atom, variable) if variable else None
+                    if column is not None:
+                        key = (atom.name.lower(), column)
+                        if key not in views:
+                            views[key] = 'graphgen_sample_%d' % len(views)
+                            cursor.execute('CREATE TEMPORARY VIEW %s AS SELECT * FROM %s WHERE %s'
+                                           % (datalog.quote_ident(views[key]), datalog.quote_ident(key[0]),
+                                              self._predicate(catalog(atom.name)[column])),
+                                           self._params())
+                        atom = atom._replace(name=views[key])
+                    atoms.append(atom)
+                rules.append(rule._replace(atoms=tuple(atoms)))
+        finally:
+            cursor.close()
+        return rules, _ViewCatalog(catalog, dict((views[key], catalog(key[0])) for key in views))
+
+    def _predicate(self, column):
+        return ('(hashtext(CAST(%s AS text) || %%s) & %d) < %%s'
+                % (datalog.quote_ident(column), _hash_range - 1))
+
+    def _params(self):
+        return [':%d' % self.seed, self.threshold]
+
+    def _heavy_keys(self, conn, catalog):
+        # The most common values of the columns the join key is read from
+        # whose edges are counted exactly, as text
+        heavy = set()
+        for rule in self.edges:
+            for atom in rule.atoms:
+                column = _column(atom, self.variable)
+                if column is None:
+                    continue
+                stats = planner.column_stats(conn, atom.name.lower(), catalog(atom.name)[column])
+                if stats is not None:
+                    heavy.update(value for value, freq in stats.mcv
+                                 if freq * stats.distinct >= HEAVY_FACTOR * (1 - stats.null_frac))
+        return sorted(heavy)
+
+    def estimate(self, conn, rules, catalog):
+        '''
+        Estimates the nodes and edges of the full graph from the sampled
+        ``rules`` returned by ``rewrite``
+        '''
+        nodes, edges = datalog.node_rules(rules), datalog.edge_rules(rules)
+        p = self.fraction
+        node_estimate, sampled_nodes = None, 0
+        if nodes:
+            ids = [row[0] for row in _rows(conn, _union(nodes, catalog, lambda r: r.head.terms[:1]))]
+            sampled_nodes = len(ids)
+            if self.mode == 'nodes':
+                node_estimate = _replicated([(id, 1 / p) for id in ids], len(ids))
+            else:
+                node_estimate = Estimate(float(len(ids)), float(len(ids)), float(len(ids)))
+
+        if self.mode == 'nodes':
+            pairs = _rows(conn, _union(edges, catalog, lambda r: r.head.terms[:2]))
+            return SampleEstimate(p, self.variable or 'source', self.mode, node_estimate,
+                                  _replicated([(pair[self.position], 1 / p) for pair in pairs], len(pairs)),
+                                  sampled_nodes, len(pairs))
+
+        select = lambda r: tuple(r.head.terms[:2]) + (datalog.Var(self.variable),)
+        instances = _rows(conn, _union(edges, catalog, select))
+        keys = OrderedDict()
+        for source, target, key in instances:
+            keys.setdefault((source, target), []).append(key)
+        multiplicity = self._multiplicity(conn, list(keys), catalog)
+        weighted = [(None, float(self._heavy_edges(conn, catalog)))]
+        for edge, sampled in keys.items():
+            light, heavy = multiplicity.get(edge, (len(sampled), False))
+            if not heavy:
+                included = 1 - (1 - p) ** light
+                weighted += [(key, 1 / (included * len(sampled))) for key in sampled]
+        return SampleEstimate(p, self.variable, self.mode, node_estimate, _replicated(weighted, len(keys)),
+                              sampled_nodes, len(keys))
+
+    def _heavy_edges(self, conn, catalog):
+        # The number of distinct edges the heavy keys produce in the full data
+        if not self.heavy:
+            return 0
+        select = lambda r: tuple(r.head.terms[:2]) + (datalog.Var(self.variable),)
+        sql, params = _union(self.edges, catalog, select, distinct=False)
+        sql = ('SELECT count(*) FROM (SELECT DISTINCT c0, c1 FROM (%s) u(c0, c1, c2) '
+               'WHERE CAST(c2 AS text) = ANY(%%s)) h' % sql)
+        return _rows(conn, (sql, params + [self.heavy]))[0][0]
+
+    def _multiplicity(self, conn, edges, catalog):
+        # The number of distinct join keys producing each of the sampled
+        # edges in the full data, looked up by the edge endpoints, besides
+        # the heavy ones, and whether a heavy key produces it
+        if not edges:
+            return {}
+        select = lambda r: tuple(r.head.terms[:2]) + (datalog.Var(self.variable),)
+        sql, params = _union(self.edges, catalog, select, distinct=False)
+        sql = ('SELECT e.c0, e.c1, count(DISTINCT e.c2) FILTER (WHERE NOT e.heavy), bool_or(e.heavy) '
+               'FROM unnest(%%s, %%s) s(a, b) JOIN (SELECT c0, c1, c2, CAST(c2 AS text) = ANY(%%s) heavy '
+               'FROM (%s) u(c0, c1, c2)) e ON e.c0 = s.a AND e.c1 = s.b GROUP BY e.c0, e.c1' % sql)
+        rows = _rows(conn, (sql, [[e[0] for e in edges], [e[1] for e in edges], self.heavy] + params))
+        return dict(((source, target), (light, heavy)) for source, target, light, heavy in rows)
+
+def _union(rules, catalog, select, distinct=True):
+    parts = [datalog.compile_rule(r, catalog, select=select(r), distinct=distinct) for r in rules]
+    return (' UNION '.join('(%s)' % sql for sql, _ in parts) if distinct
+            else ' UNION ALL '.join('(%s)' % sql for sql, _ in parts),
+            [p for _, params in parts for p in params])
+
+def _rows(conn, compiled):
+    sql, params = compiled
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def _group(value):
+    return zlib.crc32(repr(value).encode('utf-8')) % REPLICATES
+
+def _replicated(weighted, observed):
+    '''
+    Returns the estimate of a total from ``(unit, weight)`` pairs of the
+    sampled items and its confidence interval from random groups of the
+    sampled units, no lower than the ``observed`` count. Items of the
+    unit None were certain to be sampled.
+    '''
+    totals, certain = [0.0] * REPLICATES, 0.0
+    for unit, weight in weighted:
+        if unit is None:
+            certain += weight
+        else:
+            totals[_group(unit)] += weight
+    sampled = sum(totals)
+    variance = sum((REPLICATES * t - sampled) ** 2 for t in totals) / (REPLICATES * (REPLICATES - 1))
+    half = _t975 * math.sqrt(variance)
+    value = certain + sampled
+    return Estimate(value, max(float(observed), value - half), value + half)
+
+__all__ = ['Sample', 'SampleEstimate', 'Estimate', 'join_key']
@@ -0,0 +1,212 @@
+# sharing.py
+# Extraction of several graphs in one pass over the database.
+#
+# Graphs extracted from the same tables often evaluate the same sub-joins:
+# the co-venue graph of DBLP joins AuthorPublication(A, P), Publication(P, C)
+# with itself, and the author-conference graph is that very join. Before the
+# graphs of a set are extracted, every connected group of body atoms (with
+# the comparisons among their variables) is put in a canonical form, and the
+# groups that occur more than once across all rules are evaluated once into
+# temporary tables. The rules are then rewritten to read those tables, and
+# every graph is extracted from them in the same transaction.
+#
+# Single atoms are only shared when constants or comparisons filter them:
+# copying a whole table costs more than scanning it again.
+
+import itertools
+from collections import OrderedDict, namedtuple
+
+from . import datalog
+
+# Largest group of atoms considered for sharing
+MAX_GROUP = 4
+
+# A shared group: the temporary table it is stored in, its variables in
+# canonical order and the rule that computes it
+Shared = namedtuple('Shared', ['name', 'width', 'rule'])
+
+# One occurrence of a group in a rule: the atom positions it covers, the
+# comparisons it applies and the variable bound to each canonical column
+_Occurrence = namedtuple('_Occurrence', ['rule', 'positions', 'comparisons', 'variables'])
+
+##########################################################################
+# Graphs of a set
+##########################################################################
+
+def split_graphs(programs):
+    '''
+    Returns an ``OrderedDict`` of graph name to its rules (``Nodes`` and
+    ``Edges`` rules) for a set of Datalog programs, given as one program,
+    a list of programs (named by position) or a dict of programs by name.
+    Every head predicate besides ``Nodes`` defines a graph of its own,
+    named after the predicate if a program has several, with the
+    ``Nodes`` rules of its program.
+    '''
+    if isinstance(programs, dict):
+        named = list(programs.items())
+    elif isinstance(programs, (list, tuple)):
+        named = [(str(i), program) for i, program in enumerate(programs)]
+    else:
+        named = [(None, programs)]
+    graphs = OrderedDict()
+    for name, program in named:
+        rules = datalog.parse(program) if not isinstance(program, list) else program
+        nodes = datalog.node_rules(rules)
+        predicates = OrderedDict()
+        for rule in rules:
+            if rule.head.name.lower() != 'nodes':
+                predicates.setdefault(rule.head.name, []).append(rule)
+        if not predicates:
+            raise ValueError('Datalog program %s has no edge rules' % (name or ''))
+        for predicate, edges in predicates.items():
+            if len(predicates) == 1 and name is not None:
+                graph = name
+            else:
+                graph = predicate.lower() if name is None else '%s.%s' % (name, predicate.lower())
+            if graph in graphs:
+                raise ValueError('Duplicate graph name %r' % graph)
+            graphs[graph] = nodes + [r._replace(head=r.head._replace(name='Edges')) for r in edges]
+    return graphs
+
+##########################################################################
+# Common sub-joins
+##########################################################################
+
+def _variables(terms):
+    return set(t.name for t in terms if isinstance(t, datalog.Var))
+
+def _connected(atoms, positions):
+    positions = list(positions)
+    reached, frontier = set(positions[:1]), positions[:1]
+    while frontier:
+        names = _variables(t for p in frontier for t in atoms[p].terms)
+        frontier = [p for p in positions if p not in reached and names & _variables(atoms[p].terms)]
+        reached.update(frontier)
+    return len(reached) == len(positions)
+
+def canonical(atoms, comparisons):
+    '''
+    Returns a key that is equal for groups of atoms and comparisons that
+    are the same up to atom order and variable names, and the list of
+    variable names in the canonical column order
+    '''
+    best = None
+    for order in itertools.permutations(atoms):
+        names = OrderedDict()
+
+        def term(t):
+            if isinstance(t, datalog.Var):
+                return ('v', names.setdefault(t.name, len(names)))
+            if isinstance(t, datalog.Const):
+                return ('c', repr(t.value))
+            return ('_',)
+        key = (tuple((a.name.lower(), tuple(term(t) for t in a.terms)) for a in order),)
+        key += (tuple(sorted((term(c.left), c.op, term(c.right)) for c in comparisons)),)
+        if best is None or key < best[0]:
+            best = (key, list(names))
+    return best
+
+def _occurrences(rules):
+    # Every connected group of atoms of every rule, by canonical key
+    groups = OrderedDict()
+    for r, rule in enumerate(rules):
+        for size in range(1, min(len(rule.atoms), MAX_GROUP) + 1):
+            for positions in itertools.combinations(range(len(rule.atoms)), size):
+                if not _connected(rule.atoms, positions):
+                    continue
+                atoms = [rule.atoms[p] for p in positions]
+                names = _variables(t for a in atoms for t in a.terms)
+                comparisons = [c for c in rule.comparisons
+                               if _variables((c.left, c.right)) and _variables((c.left, c.right)) <= names]
+                filtered = comparisons or any(isinstance(t, datalog.Const) for a in atoms for t in a.terms)
+                if size == 1 and not filtered:
+                    continue
+                key, variables = canonical(atoms, comparisons)
+                groups.setdefault(key, []).append(_Occurrence(r, positions, comparisons, variables))
+    return groups
+
+def plan_sharing(graphs, prefix='graphgen_shared_'):
+    '''
+    Finds the groups of atoms that occur more than once in the rules of
+    ``graphs`` (as returned by ``split_graphs``), largest first. Returns
+    the list of ``Shared`` groups and the graphs with their rules
+    rewritten to read the shared groups as tables.
+    '''
+    rules = [rule for graph in graphs.values() for rule in graph]
+    groups = _occurrences(rules)
+    covered = [set() for _ in rules]
+    chosen = []
+    ranked = sorted(groups.items(), key=lambda item: (-len(item[1][0].positions), -len(item[1])))
+    for key, occurrences in ranked:
+        if len(occurrences) < 2:
+            continue
+        taken, claimed = [], [set(c) for c in covered]
+        for occurrence in occurrences:
+            if not claimed[occurrence.rule] & set(occurrence.positions):
+                claimed[occurrence.rule].update(occurrence.positions)
+                taken.append(occurrence)
+        if len(taken) < 2:
+            continue
+        covered = claimed
+        name = '%s%d' % (prefix, len(chosen))
+        first = taken[0]
+        rule = rules[first.rule]
+        head = datalog.Atom(name, tuple(datalog.Var(v) for v in first.variables))
+        definition = datalog.Rule(head, tuple(rule.atoms[p] for p in first.positions), tuple(first.comparisons))
+        chosen.append((Shared(name, len(first.variables), definition), taken))
+
+    rewritten = list(rules)
+    for shared, taken in chosen:
+        for occurrence in taken:
+            rewritten[occurrence.rule] = _substitute(rewritten[occurrence.rule], rules[occurrence.rule],
+                                                     shared, occurrence)
+    result, i = OrderedDict(), 0
+    for name, graph in graphs.items():
+        result[name] = [_compact(r) for r in rewritten[i:i + len(graph)]]
+        i += len(graph)
+    return [shared for shared, _ in chosen], result
+
+def _substitute(current, original, shared, occurrence):
+    # Replaces the atoms of an occurrence by one atom over the shared table.
+    # Atoms stay in place (replaced atoms become None) so that the positions
+    # of other occurrences remain valid until _compact.
+    atoms = list(current.atoms)
+    for p in occurrence.positions:
+        atoms[p] = None
+    atoms[occurrence.positions[0]] = datalog.Atom(shared.name, tuple(datalog.Var(v) for v in occurrence.variables))
+    comparisons = tuple(c for c in current.comparisons if c not in occurrence.comparisons)
+    return datalog.Rule(current.head, tuple(atoms), comparisons)
+
+def _compact(rule):
+    return datalog.Rule(rule.head, tuple(a for a in rule.atoms if a is not None), rule.comparisons)
+
+class SharedCatalog(object):
+    '''
+    A ``datalog.Catalog`` that also knows the columns of the shared tables
+    '''
+
+    def __init__(self, catalog, shared):
+        self.catalog = catalog
+        self.shared = dict((s.name, ['v%d' % i for i in range(s.width)]) for s in shared)
+
+    def __call__(self, table):
+        columns = self.shared.get(table.lower())
+        return columns if columns is not None else self.catalog(table)
+
+def create_shared(conn, shared, columns):
+    '''
+    Evaluates the shared groups into temporary tables, which are dropped
+    when the transaction ends, and analyzes them
+    '''
+    cursor = conn.cursor()
+    try:
+        for s in shared:
+            sql, params = datalog.compile_rule(s.rule, columns, distinct=True)
+            cursor.execute('CREATE TEMPORARY TABLE %s (%s) ON COMMIT DROP AS %s'
+                           % (datalog.quote_ident(s.name), ', '.join('v%d' % i for i in range(s.width)), sql),
+                           params)
+            cursor.execute('ANALYZE %s' % datalog.quote_ident(s.name))
+    finally:
+        cursor.close()
+
+__all__ = ['split_graphs', 'plan_sharing', 'create_shared', 'SharedCatalog']
@@ -0,0 +1,297 @@
+# shm.py
+# Zero-copy sharing of an extracted graph between processes on one host.
+#
+# One process publishes a CSR graph under a name: its arrays (the node ids,
+# which map node ids to vertex numbers by binary search, the offsets, the
+# neighbors, the edge weights if any and the attribute columns) are copied
+# once into a segment of shared memory, a file in /dev/shm (the temporary
+# directory where there is none). Any process can then attach to it by
+# name: the segment is mapped read-only and the arrays are numpy views of
+# the mapping, so N consumers share one copy of the graph instead of
+# holding N.
+#
+# The segment starts with a header,
+#
+#   magic 'GRAPHGEN', format version, number of user slots, publication
+#   time, length of the directory
+#
+# followed by the user slots (one pid per attached user, 0 when free), a
+# JSON directory of the arrays and attribute columns, and the arrays, each
+# aligned to 64 bytes. Attaching and detaching claim and free a slot under
+# an flock of the segment. The last user to detach removes the segment;
+# users that exited without detaching are dropped whenever another process
+# attaches or detaches. Segments are opened unbuffered, so that reading the
+# slots sees the writes of the other processes.
+
+import contextlib
+import errno
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from . import attributes
+from . import csr
+
+MAGIC = b'GRAPHGEN'
+FORMAT_VERSION = 1
+# Processes that can be attached to one graph at the same time
+SLOTS = 128
+
+_header = struct.Struct('=8sIIdQ')
+_slots = struct.Struct('=%dq' % SLOTS)
+_align = 64
+
+def segment_path(name):
+    '''
+    Returns the path of the shared memory segment of a graph name
+    '''
+    if not name or '/' in name or name.startswith('.'):
+        raise ValueError('Invalid shared graph name %r' % (name,))
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'graphgen-' + name)
+
+##########################################################################
+# Users
+##########################################################################
+
+@contextlib.contextmanager
+def _locked(f):
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def _users(f):
+    # The slots of the users, freeing those of processes that exited
+    f.seek(_header.size)
+    slots = list(_slots.unpack(f.read(_slots.size)))
+    for i, pid in enumerate(slots):
+        if pid and not _alive(pid):
+            _set_slot(f, i, 0)
+            slots[i] = 0
+    return slots
+
+def _set_slot(f, i, pid):
+    f.seek(_header.size + 8 * i)
+    f.write(struct.pack('=q', pid))
+    f.flush()
+
+##########################################################################
+# Publishing and attaching
+##########################################################################
+
+def _aligned(offset):
+    return (offset + _align - 1) // _align * _align
+
+def _graph_arrays(graph):
+    # The arrays of a graph and the schema of its attribute columns, in the
+    # layout of attributes.save_attributes
+    arrays = [('ids', graph.ids), ('offsets', graph.offsets), ('neighbors', graph.neighbors)]
+    if graph.weights is not None:
+        arrays.append(('weights', graph.weights))
+    schema = []
+    attrs = graph.attrs
+    for i, name in enumerate(attrs.names()):
+        column = attrs.column(name)
+        prefix = 'attrs.%d.' % i
+        if column.kind == 'numeric':
+            arrays.append((prefix + 'values', column.values))
+            if column.mask is not None:
+                arrays.append((prefix + 'mask', column.mask))
+            schema.append({'name': name, 'kind': 'numeric', 'masked': column.mask is not None})
+        else:
+            arrays += [(prefix + 'codes', column.codes), (prefix + 'pool', column.pool.data),
+                       (prefix + 'pool_offsets', column.pool.offsets)]
+            schema.append({'name': name, 'kind': column.kind})
+    return [(name, np.ascontiguousarray(array)) for name, array in arrays], schema
+
+def publish(graph, name):
+    '''
+    Copies a ``csr.CSRGraph`` (or the CSR graph in a directory) into the
+    shared memory segment ``name`` and returns the publisher's
+    ``SharedGraph``. The segment is removed when the publisher and every
+    process that attached to it have detached. Raises ``ValueError`` if a
+    graph of that name is published and in use.
+    '''
+    if not isinstance(graph, csr.CSRGraph):
+        graph = csr.load_csr(graph)
+    path = segment_path(name)
+    arrays, schema = _graph_arrays(graph)
+    entries, offset = [], 0
+    for array_name, array in arrays:
+        offset = _aligned(offset)
+        entries.append([array_name, array.dtype.str, len(array), offset])
+        offset += array.nbytes
+    directory = json.dumps({'arrays': entries, 'columns': schema}).encode('utf-8')
+    start = _aligned(_header.size + _slots.size + len(directory))
+
+    fd, tmp = tempfile.mkstemp(prefix='.graphgen-', dir=os.path.dirname(path))
+    f = os.fdopen(fd, 'r+b', 0)
+    try:
+        f.truncate(start + offset)
+        f.write(_header.pack(MAGIC, FORMAT_VERSION, SLOTS, time.time(), len(directory)))
+        f.write(_slots.pack(*([os.getpid()] + [0] * (SLOTS - 1))))
+        f.write(directory)
+        for (_, array), (_, _, _, position) in zip(arrays, entries):
+            f.seek(start + position)
+            f.flush()
+            array.tofile(f)
+        f.flush()
+        # Appear under the name complete, or not at all
+        while True:
+            try:
+                os.link(tmp, path)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                if not _abandoned(path):
+                    raise ValueError('Shared graph %r is already published' % name)
+                _remove(path)
+        return SharedGraph(name, path, f, 0)
+    except Exception:
+        f.close()
+        raise
+    finally:
+        os.unlink(tmp)
+
+def _abandoned(path):
+    # Whether a segment has no live users left
+    try:
+        with open(path, 'r+b', 0) as f:
+            with _locked(f):
+                return not any(_users(f))
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return True
+        raise
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def attach(name):
+    '''
+    Attaches to the graph published as ``name`` and returns its
+    ``SharedGraph``, whose arrays are read-only views of the shared
+    memory. Raises ``IOError`` if no graph of that name is published.
+    '''
+    path = segment_path(name)
+    f = open(path, 'r+b', 0)
+    try:
+        with _locked(f):
+            if os.fstat(f.fileno()).st_nlink == 0:
+                # The last user detached while this process opened it
+                raise IOError(errno.ENOENT, 'Shared graph %r was removed' % name, path)
+            magic, version = _header.unpack(f.read(_header.size))[:2]
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError('%s is not a shared graph of format version %d' % (path, FORMAT_VERSION))
+            slots = _users(f)
+            if 0 not in slots:
+                raise ValueError('Shared graph %r has %d users already' % (name, SLOTS))
+            slot = slots.index(0)
+            _set_slot(f, slot, os.getpid())
+        return SharedGraph(name, path, f, slot)
+    except Exception:
+        f.close()
+        raise
+
+class SharedGraph(object):
+    '''
+    A process's reference to a graph in shared memory, as returned by
+    ``publish`` and ``attach``. ``graph`` is a read-only ``csr.CSRGraph``
+    over the shared arrays (with its attributes) and ``arrays`` maps the
+    array names to the views. ``created`` is the time the graph was
+    published.
+
+    Call ``detach`` (or use it in a ``with`` block) when done; views
+    still referenced afterwards stay valid, as the memory is only released
+    once they are gone.
+    '''
+
+    def __init__(self, name, path, f, slot):
+        self.name = name
+        self.path = path
+        self._file = f
+        self._slot = slot
+        f.seek(0)
+        _, self.format_version, _, self.created, length = _header.unpack(f.read(_header.size))
+        f.seek(_header.size + _slots.size)
+        directory = json.loads(f.read(length).decode('utf-8'))
+        start = _aligned(_header.size + _slots.size + length)
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.arrays = OrderedDict((array_name, np.frombuffer(self._map, np.dtype(dtype), count, start + offset))
+                                  for array_name, dtype, count, offset in directory['arrays'])
+        ids = self.arrays['ids']
+        columns = [(spec['name'], self._column('attrs.%d.' % i, spec)) for i, spec in enumerate(directory['columns'])]
+        self.graph = csr.CSRGraph(ids, self.arrays['offsets'], self.arrays['neighbors'],
+                                  attributes.NodeAttributes(ids, columns), weights=self.arrays.get('weights'))
+
+    def _column(self, prefix, spec):
+        arrays = self.arrays
+        if spec['kind'] == 'numeric':
+            return attributes.NumericColumn(arrays[prefix + 'values'],
+                                            arrays[prefix + 'mask'] if spec.get('masked') else None)
+        return attributes.text_column(spec['kind'], arrays[prefix + 'codes'],
+                                      attributes.StringPool(arrays[prefix + 'pool'], arrays[prefix + 'pool_offsets']))
+
+    @property
+    def attached(self):
+        return self._file is not None
+
+    def users(self):
+        '''
+        Returns the number of processes attached to the graph
+        '''
+        if self._file is None:
+            raise ValueError('Shared graph %r is detached' % self.name)
+        with _locked(self._file):
+            return sum(1 for pid in _users(self._file) if pid)
+
+    def detach(self):
+        '''
+        Releases this reference; the last one removes the segment
+        '''
+        if self._file is None:
+            return
+        f, self._file = self._file, None
+        self.graph = self.arrays = None
+        try:
+            with _locked(f):
+                _set_slot(f, self._slot, 0)
+                if not any(_users(f)) and os.fstat(f.fileno()).st_nlink:
+                    os.unlink(self.path)
+        finally:
+            f.close()
+            # Not closed explicitly: views of the arrays still in use keep the
+            # mapping alive, and it is unmapped once they are gone
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def __repr__(self):
+        return '<SharedGraph %r: %s>' % (self.name, repr(self.graph) if self.graph is not None else 'detached')
+
+__all__ = ['SharedGraph', 'publish', 'attach']
@@ -0,0 +1,95 @@
+# sizing.py
+# Cost-based JVM heap sizing for extractions.
+#
+# The size of the graph GraphGen builds is estimated from the row counts
+# PostgreSQL's planner predicts for the compiled Nodes and Edges rules, and
+# turned into a maximum heap and garbage collector choice. Graphs that would
+# not fit in memory are extracted in spill mode instead (see
+# `DatalogEngine.extract_to_disk`).
+
+import json
+import re
+from collections import namedtuple
+
+from . import batch
+from . import datalog
+from . import utils
+
+# Approximate heap footprint of the graph GraphGen holds in memory
+NODE_BYTES = 256
+EDGE_BYTES = 64
+BASE_HEAP = 128 * 2 ** 20
+SAFETY = 1.5
+MIN_HEAP = 256 * 2 ** 20
+
+# Heaps up to this size use the serial collector, which starts fastest
+SERIAL_GC_LIMIT = 2 ** 30
+
+# Options that select a garbage collector; the JVM refuses to start with two
+_gc_option = re.compile(r'^-XX:\+Use\w+GC$')
+
+HeapPlan = namedtuple('HeapPlan', ['nodes', 'edges', 'heap', 'options', 'spill'])
+
+def estimate_rows(conn, sql, params=()):
+    """
+    Return the number of rows the planner estimates ``sql`` returns.
+    """
+    cursor = conn.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    cursor.close()
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def estimate_graph(conn, query):
+    """
+    Return the estimated ``(nodes, edges)`` of the graph of a Datalog
+    query. Rules are estimated without removing duplicates, which is what
+    an extraction has to hold while it runs.
+    """
+    rules = datalog.parse(query)
+    catalog = datalog.Catalog(conn)
+    try:
+        counts = []
+        for group in (datalog.node_rules(rules), datalog.edge_rules(rules)):
+            counts.append(sum(estimate_rows(conn, *datalog.compile_rule(r, catalog)) for r in group))
+    finally:
+        conn.rollback()
+    return tuple(counts)
+
+def heap_size(nodes, edges):
+    """
+    Return the maximum heap in bytes for a graph of the given size,
+    rounded up to a multiple of 64 MiB.
+    """
+    size = BASE_HEAP + SAFETY * (NODE_BYTES * nodes + EDGE_BYTES * edges)
+    step = 64 * 2 ** 20
+    return max(MIN_HEAP, int(-(-size // step) * step))
+
+def jvm_options(heap, configured=None):
+    """
+    Return the JVM options for a maximum heap of ``heap`` bytes. No
+    collector is chosen if the ``configured`` java options (by default
+    those set with ``utils.config_java``) already select one.
+    """
+    configured = utils._java_options if configured is None else configured
+    options = ['-Xmx%dm' % (heap // 2 ** 20)]
+    if not any(_gc_option.match(o) for o in configured):
+        options.append('-XX:+UseSerialGC' if heap <= SERIAL_GC_LIMIT else '-XX:+UseParallelGC')
+    return options
+
+def plan_heap(conn, query, memory=None, fraction=0.8):
+    """
+    Size the JVM heap for extracting ``query`` and decide whether it fits
+    in ``fraction`` of ``memory`` (by default the memory currently
+    available). Returns a ``HeapPlan``; ``spill`` is set when it does not.
+    """
+    nodes, edges = estimate_graph(conn, query)
+    heap = heap_size(nodes, edges)
+    if memory is None:
+        memory = batch.available_memory()
+    budget = fraction * batch.parse_size(memory)
+    return HeapPlan(nodes, edges, heap, jvm_options(heap), heap > budget)
+
+__all__ = ['HeapPlan', 'estimate_graph', 'heap_size', 'jvm_options', 'plan_heap']
@@ -0,0 +1,236 @@
+# stats.py
+# Per-phase timing and resource instrumentation of extractions.
+#
+# `GraphGenerator.generateGraph` records an `ExtractionStats` for every call
+# and returns it on an `ExtractionResult`, a str holding the path of the
+# output (so existing callers keep working). Finished extractions are
+# passed to the generator's hooks and logged on the ``graphgenpy.stats``
+# logger, with the stats as a dict in the ``graphgen_stats`` attribute of
+# the log record, for export to a metrics pipeline.
+
+import contextlib
+import logging
+import os
+import re
+import resource
+import sys
+import time
+
+logger = logging.getLogger('graphgenpy.stats')
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+class ExtractionStats(object):
+    '''
+    Measurements of one extraction. Attributes that could not be measured
+    (such as JVM figures for the SQL engine) are None.
+
+    ``phases`` maps phase names to seconds, in the order they ran:
+    ``plan`` (choosing the graph representation and sizing the JVM
+    heap), ``cache`` (cache lookup and storage), ``share`` (evaluating the
+    sub-joins shared by a set of graphs),
+    ``jvm`` (the GraphGen JVM run: startup, query evaluation, graph
+    construction and serialization, which the JVM does not report apart),
+    ``sql`` (fetching the query results for the SQL engine), ``serialize``
+    (writing the output from Python), ``estimate`` (estimating the full
+    graph from a sample), ``count`` (counting the nodes and
+    edges of a file written by the JVM) and ``partition`` (splitting the
+    graph into shards).
+
+    ``child_cpu`` is the CPU time of the child processes (the JVM) that
+    ended during the extraction and ``child_max_rss`` the largest RSS in
+    bytes of any child process so far, both from ``resource.getrusage``;
+    with concurrent extractions they include the other extractions'
+    JVMs. ``jvm_peak_heap`` (bytes) and ``jvm_gc_time`` (seconds) come
+    from the JVM's GC log. ``strategy`` is the graph representation:
+    ``'expanded'``, ``'condensed'`` or ``'hybrid'``. ``sample`` is the
+    sampling fraction of a sampled extraction and ``estimate`` its
+    ``sampling.SampleEstimate`` of the full graph.
+    '''
+
+    def __init__(self, query=None, serialization_format=None, engine=None):
+        self.query = query
+        self.serialization_format = serialization_format
+        self.engine = engine
+        self.strategy = None
+        self.sample = None
+        self.estimate = None
+        self.path = None
+        self.started = time.time()
+        self.phases = []
+        self.duration = None
+        self.cached = False
+        self.spill = False
+        self.nodes = None
+        self.edges = None
+        self.bytes_written = None
+        self.jvm_peak_heap = None
+        self.jvm_gc_time = None
+        self.jvm_gc_count = None
+        self.child_cpu = None
+        self.child_max_rss = None
+        self.stderr = None
+        self.error = None
+        self._children = _children_usage()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''
+        Times the enclosed block as phase ``name``
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        for i, (phase, total) in enumerate(self.phases):
+            if phase == name:
+                self.phases[i] = (name, total + seconds)
+                return
+        self.phases.append((name, seconds))
+
+    def finish(self, path=None):
+        '''
+        Records the end of the extraction, the size of its output and the
+        resources its child processes used
+        '''
+        self.duration = time.time() - self.started
+        self.path = path
+        if path is not None and os.path.exists(path):
+            self.bytes_written = _disk_size(path)
+        cpu, rss = _children_usage()
+        self.child_cpu = cpu - self._children[0]
+        self.child_max_rss = rss or None
+
+    def as_dict(self):
+        keys = ('serialization_format', 'engine', 'strategy', 'path', 'started', 'duration', 'cached', 'spill',
+                'nodes', 'edges', 'bytes_written', 'jvm_peak_heap', 'jvm_gc_time', 'jvm_gc_count',
+                'child_cpu', 'child_max_rss', 'error')
+        d = dict((key, getattr(self, key)) for key in keys)
+        d['phases'] = dict(self.phases)
+        d['sample'] = self.sample
+        d['estimate'] = self.estimate.as_dict() if self.estimate is not None else None
+        return d
+
+    def __repr__(self):
+        phases = ', '.join('%s=%.3fs' % p for p in self.phases)
+        return '<ExtractionStats: %s (%s)>' % ('%.3fs' % self.duration if self.duration is not None
+                                               else 'running', phases)
+
+class ExtractionResult(str):
+    '''
+    The path of an extracted graph, as returned by
+    ``GraphGenerator.generateGraph``, with the ``ExtractionStats`` of the
+    extraction in ``stats``
+    '''
+
+    def __new__(cls, path, stats):
+        result = str.__new__(cls, path)
+        result.stats = stats
+        return result
+
+    @property
+    def path(self):
+        return str(self)
+
+def _children_usage():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * _rss_unit
+
+def _disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+def notify(hooks, stats):
+    '''
+    Passes finished ``stats`` to every hook and logs them
+    '''
+    for hook in hooks:
+        hook(stats)
+    if stats.error is None:
+        logger.info('extracted %s in %.3fs', stats.path, stats.duration,
+                    extra={'graphgen_stats': stats.as_dict()})
+    else:
+        logger.warning('extraction failed after %.3fs: %s', stats.duration, stats.error,
+                       extra={'graphgen_stats': stats.as_dict()})
+
+##########################################################################
+# JVM GC logs
+##########################################################################
+
+# JDK 9+ unified logging:  [0.2s][info][gc] GC(3) Pause Young (...) 24M->3M(123M) 1.234ms
+# JDK 8 -Xloggc:           0.2: [GC (Allocation Failure)  24576K->3072K(125952K), 0.0012340 secs]
+_gc_unified = re.compile(r'GC\(\d+\) Pause.*?(\d+)([KMG])->\d+[KMG]\(\d+[KMG]\) ([\d.]+)ms')
+_gc_legacy = re.compile(r'\[(?:Full )?GC.*?(\d+)([KMG])->\d+[KMG]\(\d+[KMG]\), ([\d.]+) secs\]')
+_units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+
+def gc_log_options(path):
+    '''
+    Returns the JVM options that write a GC log to ``path``
+    (``-Xloggc`` is understood by JDK 8 and by later JDKs)
+    '''
+    return ['-Xloggc:' + path]
+
+def read_gc_log(path):
+    '''
+    Returns ``(peak_heap, gc_time, gc_count)`` from a GC log: the largest
+    heap occupancy seen before a collection in bytes, and the total
+    pause time in seconds. Returns None if there is no log.
+    '''
+    try:
+        with open(path) as f:
+            text = f.read()
+    except (IOError, OSError):
+        return None
+    peak, total, count = 0, 0.0, 0
+    for m in _gc_unified.finditer(text):
+        peak = max(peak, int(m.group(1)) * _units[m.group(2)])
+        total += float(m.group(3)) / 1000
+        count += 1
+    for m in _gc_legacy.finditer(text):
+        peak = max(peak, int(m.group(1)) * _units[m.group(2)])
+        total += float(m.group(3))
+        count += 1
+    return peak or None, total, count
+
+##########################################################################
+# Counting
+##########################################################################
+
+# Element markers, with whitespace bounded so that a match never spans more
+# than the bytes carried over between blocks
+_markers = {'gml': (re.compile(br'\bnode\s{0,8}\['), re.compile(br'\bedge\s{0,8}\[')),
+            'json': (re.compile(br'"_type"\s{0,8}:\s{0,8}"vertex"'),
+                     re.compile(br'"_type"\s{0,8}:\s{0,8}"edge"'))}
+_overlap = 64
+
+def count_elements(path, serialization_format, bufsize=1 << 22):
+    '''
+    Returns the ``(nodes, edges)`` of a GML or GraphSON file by scanning
+    it for element markers, without parsing it. Returns ``(None, None)``
+    for other formats.
+    '''
+    markers = _markers.get(serialization_format)
+    if markers is None:
+        return None, None
+    counts = [0, 0]
+    tail = b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(bufsize)
+            if not block:
+                break
+            data = tail + block
+            for i, marker in enumerate(markers):
+                # Matches that end inside the carried-over tail were
+                # counted with the previous block
+                counts[i] += sum(1 for m in marker.finditer(data) if m.end() > len(tail))
+            tail = data[-_overlap:]
+    return counts[0], counts[1]
+
+__all__ = ['ExtractionStats', 'ExtractionResult']
@@ -8,12 +8,24 @@
 
 import sys
 import os
+import json
+import hashlib
 import subprocess
 
 
 _java_bin = None
 _java_options = []
 
+# The options used when java is configured implicitly, unless an earlier
+# process saved others
+_default_options = ['-Xmx10G']
+
+# Resolved java binary and options, and class-data-sharing archives, are
+# kept here across processes
+_state_dir = os.path.join(os.path.expanduser('~'), '.graphgenpy')
+_java_config_file = os.path.join(_state_dir, 'java.json')
+_cds_dir = os.path.join(_state_dir, 'cds')
+
 ##########################################################################
 # Search for files/binaries
 ##########################################################################
@@ -22,7 +34,7 @@ def _decode_stdoutdata(stdoutdata):
     """ Convert data read from stdout/stderr to unicode """
     if not isinstance(stdoutdata, bytes):
         return stdoutdata
-    return stdoutdata
+    return stdoutdata.decode('utf-8', 'replace')
 
 def find_file_iter(filename, env_vars=(), searchpath=(),
     file_names=None, url=None, verbose=True, finding_dir=False):
@@ -173,17 +185,59 @@ def config_java(bin=None, options=None, verbose=True):
         the maximum heap size to 512 megabytes.  If no options are
         specified, then do not modify the options list.
     :type options: list(str)
+
+    Without ``bin``, the binary and options resolved by an earlier call
+    are reused from ``~/.graphgenpy/java.json`` while the binary and the
+    JAVAHOME/JAVA_HOME variables are unchanged, which skips the search.
     """
     global _java_bin, _java_options
-    _java_bin = find_binary('java', bin, env_vars=['JAVAHOME', 'JAVA_HOME'], verbose=verbose, binary_names=['java.exe'])
+    config = _load_java_config() if bin is None else None
+    if config is not None:
+        _java_bin = config['bin']
+        if options is None:
+            options = config['options']
+    else:
+        _java_bin = find_binary('java', bin, env_vars=['JAVAHOME', 'JAVA_HOME'], verbose=verbose, binary_names=['java.exe'])
 
     if options is not None:
         if isinstance(options, str):
             options = options.split()
         _java_options = list(options)
+    if config is None:
+        _save_java_config()
+
+def _default_java_options():
+    # None reuses the options saved with a still valid configuration
+    return None if _load_java_config() is not None else _default_options
+
+def _java_env():
+    return [os.environ.get('JAVAHOME'), os.environ.get('JAVA_HOME')]
+
+def _load_java_config():
+    try:
+        with open(_java_config_file) as f:
+            config = json.load(f)
+        if config['env'] != _java_env() or os.path.getmtime(config['bin']) != config['mtime']:
+            return None
+        return config
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def _save_java_config():
+    config = {'bin': _java_bin, 'options': _java_options, 'env': _java_env(),
+              'mtime': os.path.getmtime(_java_bin)}
+    try:
+        if not os.path.isdir(_state_dir):
+            os.makedirs(_state_dir)
+        tmp = '%s.%d' % (_java_config_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(config, f)
+        os.rename(tmp, _java_config_file)
+    except (IOError, OSError):
+        pass
 
 def java(cmd, classpath=None, stdin=None, stdout=None, stderr=None,
-         blocking=True):
+         blocking=True, options=None):
     """
     Execute the given java command, by opening a subprocess that calls
     Java.  If java has not yet been configured, it will be configured
@@ -215,6 +269,9 @@ def java(cmd, classpath=None, stdin=None, stdout=None, stderr=None,
         by the java command if the ``stdout`` and ``stderr`` parameters
         were set to ``subprocess.PIPE``; or None otherwise.  If
         ``blocking=False``, then return a ``subprocess.Popen`` object.
+    :param options: Extra options for this call only. A ``-Xmx`` option
+        here replaces the configured maximum heap size.
+    :type options: list(str)
     :raise OSError: If the java command returns a nonzero return code.
     """
     if stdin == 'pipe': stdin = subprocess.PIPE
@@ -226,9 +283,30 @@ def java(cmd, classpath=None, stdin=None, stdout=None, stderr=None,
     # Make sure we know where a java binary is.
     if _java_bin is None:
         # config_java(bin='/usr/bin/java')
-        config_java(options=['-Xmx10G'])
+        config_java(options=_default_java_options())
         # config_java(options=default_options, verbose=False)
 
+    cmd = java_command(cmd, classpath, options)
+
+    # Call java via a subprocess
+    p = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr)
+    if not blocking: return p
+    (stdout, stderr) = p.communicate()
+
+    # Check the return code.
+    if p.returncode != 0:
+        print(_decode_stdoutdata(stderr))
+        raise OSError('Java command failed : ' + str(cmd))
+
+    return (stdout, stderr)
+
+def java_command(cmd, classpath, options=None, cds=True):
+    """
+    Build the full argument list that ``java`` runs, for a configured
+    java binary. See ``java`` for the parameters. With ``cds``, the
+    class-data-sharing archive built by ``warm_java`` for the classpath
+    is used if there is one.
+    """
     # Set up the classpath.
     if isinstance(classpath, str):
         classpaths=[classpath]
@@ -236,22 +314,67 @@ def java(cmd, classpath=None, stdin=None, stdout=None, stderr=None,
         classpaths=list(classpath)
     classpath=os.path.pathsep.join(classpaths)
 
+    java_options = list(_java_options)
+    if options:
+        if any(o.startswith('-Xmx') for o in options):
+            java_options = [o for o in java_options if not o.startswith('-Xmx')]
+        java_options += list(options)
+    # Source-file programs are compiled at launch and cannot use the archive
+    if cds and cmd and not cmd[0].endswith('.java'):
+        archive = cds_archive(classpath)
+        if os.path.exists(archive):
+            java_options += ['-XX:SharedArchiveFile=' + archive, '-Xshare:auto']
+
     # Construct the full command string.
     cmd = list(cmd)
     cmd = ['-cp', classpath] + cmd
-    cmd = [_java_bin] + _java_options + cmd
+    return [_java_bin] + java_options + cmd
 
-    # Call java via a subprocess
-    p = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr)
-    if not blocking: return p
-    (stdout, stderr) = p.communicate()
+##########################################################################
+# Class data sharing
+##########################################################################
 
-    # Check the return code.
-    if p.returncode != 0:
-        print(_decode_stdoutdata(stderr))
-        raise OSError('Java command failed : ' + str(cmd))
+def cds_archive(classpath):
+    """
+    Return the path of the AppCDS archive for running the configured java
+    binary with ``classpath``. The name depends on the binary and on the
+    size and modification time of every classpath entry, so a rebuilt jar
+    or a different JVM never picks up a stale archive.
+    """
+    stamp = [_java_bin, classpath]
+    for path in [_java_bin] + classpath.split(os.path.pathsep):
+        try:
+            st = os.stat(path)
+            stamp += [st.st_size, st.st_mtime]
+        except OSError:
+            stamp.append(None)
+    key = hashlib.sha1(json.dumps(stamp).encode('utf-8')).hexdigest()
+    return os.path.join(_cds_dir, key + '.jsa')
 
-    return (stdout, stderr)
+def warm_java(cmd, classpath):
+    """
+    Run the java command ``cmd`` once to record the classes it loads into
+    an AppCDS archive for ``classpath`` (JDK 13 or later), which ``java``
+    uses for later calls with the same classpath. The training run may
+    fail (for instance without arguments); only the loaded classes matter.
+    Returns the path of the archive.
+    :raise OSError: If the JVM did not write an archive.
+    """
+    if _java_bin is None:
+        config_java(options=_default_java_options())
+    classpath = classpath if isinstance(classpath, str) else os.path.pathsep.join(classpath)
+    archive = cds_archive(classpath)
+    if not os.path.isdir(_cds_dir):
+        os.makedirs(_cds_dir)
+    tmp = '%s.%d' % (archive, os.getpid())
+    p = subprocess.Popen(java_command(cmd, classpath, ['-XX:ArchiveClassesAtExit=' + tmp], cds=False),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (stdout, stderr) = p.communicate()
+    if not os.path.exists(tmp):
+        print(_decode_stdoutdata(stderr))
+        raise OSError('Java did not write a class data archive (AppCDS needs JDK 13 or later)')
+    os.rename(tmp, archive)
+    return archive
 
 # Only export the 'java' method
 __all__ = ['java']
@@ -0,0 +1,252 @@
+# vertexcentric.py
+# A parallel vertex-centric (BSP) executor, the Python counterpart of
+# GraphGen's VertexCentric/Executor.
+#
+# A user function ``compute(vertex, ctx)`` runs for every active vertex in
+# each superstep. It reads the messages sent to the vertex in the previous
+# superstep, updates ``vertex.value``, sends messages along edges and may
+# vote to halt. A halted vertex sleeps until it receives a message; the run
+# ends when every vertex has halted and no messages are in flight.
+#
+# Supersteps run over edge-balanced partitions of the vertices in a process
+# pool. The graph, the vertex values and the messages are kept in .npy
+# files under /dev/shm and memory-mapped by the workers, so the graph is
+# shared rather than copied into every process.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import csr
+
+_combiners = {'sum': np.add, 'min': np.minimum, 'max': np.maximum}
+
+class Vertex(object):
+    '''
+    The vertex a ``compute`` call runs for. ``messages`` holds the values
+    sent to it in the previous superstep (a single combined value when the
+    run has a combiner) and ``neighbors`` the vertex numbers of its
+    neighbors.
+    '''
+    __slots__ = ('index', 'id', 'neighbors', 'messages', '_values')
+
+    def __init__(self, index, id, neighbors, messages, values):
+        self.index = index
+        self.id = id
+        self.neighbors = neighbors
+        self.messages = messages
+        self._values = values
+
+    @property
+    def value(self):
+        return self._values[self.index]
+
+    @value.setter
+    def value(self, value):
+        self._values[self.index] = value
+
+    def getVal(self):
+        return self.value
+
+    def setVal(self, value):
+        self.value = value
+
+    def degree(self):
+        return len(self.neighbors)
+
+class Context(object):
+    '''
+    What ``compute`` can do besides updating its vertex: send messages and
+    vote to halt. ``superstep`` counts from 0.
+    '''
+
+    def __init__(self, superstep, num_vertices, halted):
+        self.superstep = superstep
+        self.num_vertices = num_vertices
+        self._halted = halted
+        self._targets = []
+        self._messages = []
+
+    def send(self, target, message):
+        '''
+        Sends ``message`` to the vertex numbered ``target``
+        '''
+        self._targets.append(target)
+        self._messages.append(message)
+
+    def send_to_neighbors(self, vertex, message):
+        self._targets.extend(vertex.neighbors.tolist())
+        self._messages.extend([message] * len(vertex.neighbors))
+
+    def vote_to_halt(self, vertex):
+        self._halted[vertex.index] = True
+
+    voteToHalt = vote_to_halt
+
+##########################################################################
+# Workers
+##########################################################################
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+def _init_worker(compute, directory, combiner):
+    graph = csr.load_csr(directory)
+    _worker.update(compute=compute, directory=directory, combiner=combiner, graph=graph,
+                   values=np.load(os.path.join(directory, 'values.npy'), mmap_mode='r+'),
+                   halted=np.load(os.path.join(directory, 'halted.npy'), mmap_mode='r+'))
+
+def _combine(targets, messages, combiner):
+    '''
+    Sorts messages by target and, with a combiner, reduces the messages
+    to each target to one
+    '''
+    order = np.argsort(targets, kind='mergesort')
+    targets, messages = targets[order], messages[order]
+    if combiner is not None and len(targets):
+        targets, starts = np.unique(targets, return_index=True)
+        messages = _combiners.get(combiner, combiner).reduceat(messages, starts)
+    return targets, messages
+
+def _superstep(task):
+    part, lo, hi, step = task
+    compute, directory, combiner = _worker['compute'], _worker['directory'], _worker['combiner']
+    graph, values, halted = _worker['graph'], _worker['values'], _worker['halted']
+    inbox = os.path.join(directory, 'inbox-%d-' % step)
+    if step:
+        targets = np.load(inbox + 'targets.npy', mmap_mode='r')
+        messages = np.load(inbox + 'messages.npy', mmap_mode='r')
+    else:
+        targets = messages = np.zeros(0)
+    bounds = np.searchsorted(targets, np.arange(lo, hi + 1))
+
+    ctx = Context(step, graph.number_of_nodes(), halted)
+    active = 0
+    for v in range(lo, hi):
+        start, end = bounds[v - lo], bounds[v - lo + 1]
+        if halted[v] and start == end:
+            continue
+        halted[v] = False
+        active += 1
+        vertex = Vertex(v, graph.ids[v], graph.neighbors[graph.offsets[v]:graph.offsets[v + 1]],
+                        messages[start:end].tolist(), values)
+        compute(vertex, ctx)
+
+    out = _combine(np.array(ctx._targets, dtype=np.int64),
+                   np.array(ctx._messages, dtype=np.float64), combiner)
+    outbox = os.path.join(directory, 'outbox-%d-%d-' % (step, part))
+    np.save(outbox + 'targets.npy', out[0])
+    np.save(outbox + 'messages.npy', out[1])
+    return outbox, active
+
+##########################################################################
+# Executor
+##########################################################################
+
+class VertexCentric(object):
+    '''
+    Runs vertex-centric programs on a graph (a ``csr.CSRGraph``, or a
+    ``condensed.CondensedGraph`` which is expanded first).
+
+    :param processes: Number of worker processes, by default one per CPU.
+        With 1 supersteps run in the calling process.
+    :param partitions: Number of vertex ranges per superstep, by default
+        four per process. Ranges hold about the same number of edges.
+    :param direction: ``'out'`` to use out-neighbors, ``'both'`` to use
+        the neighbors in either direction (like ``Direction.BOTH``).
+    :param directory: Where the shared arrays live, by default /dev/shm.
+    '''
+
+    def __init__(self, graph, processes=None, partitions=None, direction='out', directory=None):
+        if hasattr(graph, 'expand'):
+            graph = graph.expand()
+        if direction == 'both':
+            from . import analytics
+            src, dst = analytics.edge_arrays(graph, undirected=True)
+            graph = csr.from_edges(graph.ids, src, dst)
+        elif direction != 'out':
+            raise ValueError("direction must be 'out' or 'both'")
+        self.graph = graph
+        self.processes = processes or multiprocessing.cpu_count()
+        self.partitions = partitions or 4 * self.processes
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        self.directory = directory
+        self.values = None
+
+    def _ranges(self):
+        n = self.graph.number_of_nodes()
+        offsets = np.asarray(self.graph.offsets)
+        # Balance edges, counting every vertex as one edge as well
+        work = offsets + np.arange(n + 1)
+        cuts = np.searchsorted(work, np.linspace(0, work[-1], self.partitions + 1))
+        cuts[0], cuts[-1] = 0, n
+        cuts = np.unique(cuts)
+        return list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+    def run(self, compute, initial=0.0, combiner=None, max_supersteps=100, dtype=np.float64):
+        '''
+        Runs ``compute(vertex, ctx)`` in supersteps until every vertex has
+        voted to halt and no messages are pending, or ``max_supersteps``
+        supersteps have run. Returns a dict of the final vertex values
+        keyed by node id (also kept as the array ``self.values``).
+
+        :param initial: The initial value of every vertex.
+        :param combiner: None to deliver every message, or ``'sum'``,
+            ``'min'``, ``'max'`` or a NumPy ufunc to combine the messages
+            to a vertex into one. Messages are numbers.
+        '''
+        n = self.graph.number_of_nodes()
+        directory = tempfile.mkdtemp(prefix='graphgen-bsp-', dir=self.directory)
+        pool = None
+        try:
+            csr.save_arrays(directory, dict((name, getattr(self.graph, name)) for name in csr._arrays))
+            values = np.lib.format.open_memmap(os.path.join(directory, 'values.npy'), mode='w+',
+                                               dtype=dtype, shape=(n,))
+            values[:] = initial
+            halted = np.lib.format.open_memmap(os.path.join(directory, 'halted.npy'), mode='w+',
+                                               dtype=bool, shape=(n,))
+            values.flush()
+            halted.flush()
+
+            args = (compute, directory, combiner)
+            if self.processes > 1:
+                pool = multiprocessing.Pool(self.processes, _init_worker, args)
+                run = pool.map
+            else:
+                _init_worker(*args)
+                run = lambda f, tasks: [f(t) for t in tasks]
+
+            ranges = self._ranges()
+            for step in range(max_supersteps):
+                tasks = [(part, lo, hi, step) for part, (lo, hi) in enumerate(ranges)]
+                outboxes = [outbox for outbox, _ in run(_superstep, tasks)]
+                if step:
+                    os.remove(inbox + 'targets.npy')
+                    os.remove(inbox + 'messages.npy')
+                targets, messages = _combine(
+                    np.concatenate([np.load(o + 'targets.npy') for o in outboxes]),
+                    np.concatenate([np.load(o + 'messages.npy') for o in outboxes]), combiner)
+                for o in outboxes:
+                    os.remove(o + 'targets.npy')
+                    os.remove(o + 'messages.npy')
+                if not len(targets) and halted.all():
+                    break
+                inbox = os.path.join(directory, 'inbox-%d-' % (step + 1))
+                np.save(inbox + 'targets.npy', targets)
+                np.save(inbox + 'messages.npy', messages)
+
+            self.values = np.array(values)
+            del values, halted
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _worker.clear()
+            shutil.rmtree(directory, ignore_errors=True)
+        return dict(zip(np.asarray(self.graph.ids).tolist(), self.values.tolist()))
+
+__all__ = ['VertexCentric', 'Vertex', 'Context']
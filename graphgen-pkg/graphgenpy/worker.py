@@ -0,0 +1,170 @@
+# worker.py
+# A persistent JVM that serves extraction requests for `graphgenpy`, so that
+# JVM startup and jar class loading are paid once instead of on every call.
+
+import os
+import subprocess
+import threading
+import time
+import warnings
+
+from . import utils
+
+_worker_source = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'lib', 'PyGraphGenWorker.java')
+
+
+def _escape(field):
+    return (field.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _unescape(field):
+    out = []
+    chars = iter(field)
+    for c in chars:
+        if c == '\\':
+            n = next(chars, '')
+            out.append({'t': '\t', 'n': '\n', 'r': '\r'}.get(n, n))
+        else:
+            out.append(c)
+    return ''.join(out)
+
+
+class ExtractionWorker(object):
+    '''
+    Keeps a single JVM running ``PyGraphGenWorker`` and feeds it
+    ``PyGenerateGraph`` argument lists over its stdin/stdout.
+
+    The JVM is started lazily on the first request, restarted if it dies,
+    and recycled after ``max_requests`` requests to bound heap growth.
+
+    If the JVM exits cleanly while serving a request (``PyGenerateGraph``
+    calling ``System.exit``), it cannot be kept running: the worker sets
+    ``disabled``, warns once, and its owner launches a JVM per extraction
+    instead.
+    '''
+
+    def __init__(self, classpath, max_requests=100):
+        self.classpath = classpath
+        self.max_requests = max_requests
+        self.requests_served = 0
+        self.disabled = False
+        self._process = None
+        self._lock = threading.Lock()
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        '''
+        Launch the JVM and wait for it to report that it is ready.
+        '''
+        self.close()
+        # The worker is a single-file Java program (JDK 11+) compiled in
+        # memory against the GraphGen jar when the JVM launches.
+        self._process = utils.java([_worker_source], classpath=self.classpath,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   blocking=False)
+        self.requests_served = 0
+        status = self._readline()
+        if status != 'READY':
+            self.close()
+            raise OSError('GraphGen worker failed to start')
+
+    def close(self):
+        '''
+        Shut the JVM down, giving it a moment to exit on EOF before killing it.
+        '''
+        p, self._process = self._process, None
+        if p is None:
+            return
+        try:
+            p.stdin.close()
+        except (IOError, OSError):
+            pass
+        for _ in range(50):
+            if p.poll() is not None:
+                break
+            time.sleep(0.1)
+        else:
+            p.kill()
+            p.wait()
+        p.stdout.close()
+
+    def extract(self, args):
+        '''
+        Run one extraction with the given ``PyGenerateGraph`` arguments.
+        If the JVM has crashed since the last request it is restarted and
+        the request is sent again once.
+        :raise OSError: If the extraction fails.
+        '''
+        with self._lock:
+            if self.disabled:
+                raise OSError('GraphGen worker is disabled')
+            if self.alive() and self.requests_served >= self.max_requests:
+                self.close()
+            for attempt in (0, 1):
+                if not self.alive():
+                    self.start()
+                try:
+                    return self._request(args)
+                except _WorkerDied as e:
+                    returncode = e.returncode
+                    self.close()
+                    # PyGenerateGraph called System.exit() once it was done:
+                    # the request went through, but every later one would
+                    # start a new JVM
+                    if returncode == 0:
+                        self.disabled = True
+                        warnings.warn('The GraphGen worker JVM exits after every extraction; '
+                                      'extractions will launch a JVM each', RuntimeWarning)
+                        return
+                    if attempt:
+                        raise OSError('GraphGen worker died with exit status %s'
+                                      % returncode)
+
+    def _request(self, args):
+        line = '\t'.join(_escape(a) for a in args) + '\n'
+        try:
+            self._process.stdin.write(line.encode('utf-8'))
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            raise _WorkerDied(self._process.wait())
+        status = self._readline()
+        if status is None:
+            raise _WorkerDied(self._process.wait())
+        self.requests_served += 1
+        if status.startswith('ERR'):
+            raise OSError('Java command failed : ' + _unescape(status[4:]))
+
+    def _readline(self):
+        line = self._process.stdout.readline()
+        if not line:
+            return None
+        return line.decode('utf-8').rstrip('\r\n')
+
+    def __del__(self):
+        # Garbage collection and interpreter shutdown must not wait on the
+        # JVM as close() does; no request can be in flight at this point
+        p = getattr(self, '_process', None)
+        if p is None:
+            return
+        if p.poll() is None:
+            try:
+                p.kill()
+            except OSError:
+                pass
+        for pipe in (p.stdin, p.stdout):
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+
+
+class _WorkerDied(Exception):
+
+    def __init__(self, returncode):
+        Exception.__init__(self, returncode)
+        self.returncode = returncode
+
+__all__ = ['ExtractionWorker']
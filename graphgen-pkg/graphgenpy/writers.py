@@ -0,0 +1,93 @@
+# writers.py
+# Streaming GML and GraphSON writers producing the same layout GraphGen
+# writes, so files extracted without the JVM load with the same tools.
+
+import io
+import json
+import numbers
+
+from . import readers
+
+def _gml_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    # Python 2 longs and numpy scalars too, written as GML numbers
+    if isinstance(value, numbers.Integral):
+        return '%d' % value
+    if isinstance(value, numbers.Real):
+        return repr(float(value))
+    value = u'%s' % (value,)
+    return u'"%s"' % value.replace(u'&', u'&amp;').replace(u'"', u'&quot;')
+
+def _gml_attrs(attrs, indent):
+    return u''.join(u'%s%s %s\n' % (indent, key, _gml_value(value))
+                    for key, value in attrs.items() if value is not None)
+
+def write_gml(records, f):
+    """
+    Write node and edge records to ``f`` as a GML document.
+    :param records: An iterable of ``readers.Node`` and ``readers.Edge``
+        records, or of lists of them.
+    :param f: A file object opened in text mode.
+    """
+    f.write(u'graph [\n  directed 1\n')
+    for record in _flatten(records):
+        if isinstance(record, readers.Edge):
+            f.write(u'  edge [\n    source %d\n    target %d\n%s  ]\n'
+                    % (record.source, record.target, _gml_attrs(record.attrs, u'    ')))
+        else:
+            f.write(u'  node [\n    id %d\n%s  ]\n'
+                    % (record.id, _gml_attrs(record.attrs, u'    ')))
+    f.write(u']\n')
+
+def write_graphson(records, f):
+    """
+    Write node and edge records to ``f`` as a GraphSON document. All node
+    records must come before the edge records.
+    :param records: An iterable of ``readers.Node`` and ``readers.Edge``
+        records, or of lists of them.
+    :param f: A file object opened in text mode.
+    """
+    f.write(u'{"mode":"NORMAL","vertices":[')
+    in_edges, first, edge_id = False, True, 0
+    for record in _flatten(records):
+        if isinstance(record, readers.Edge):
+            if not in_edges:
+                f.write(u'],"edges":[')
+                in_edges, first = True, True
+            element = dict(record.attrs, _id=str(edge_id), _type='edge',
+                           _outV=str(record.source), _inV=str(record.target))
+            edge_id += 1
+        else:
+            if in_edges:
+                raise ValueError('GraphSON output needs all nodes before the edges')
+            element = dict(record.attrs, _id=str(record.id), _type='vertex')
+        f.write((u'' if first else u',') + _json(element))
+        first = False
+    f.write(u']}' if in_edges else u'],"edges":[]}')
+
+def _json(value):
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    return text.decode('utf-8') if isinstance(text, bytes) else text
+
+def _flatten(records):
+    for record in records:
+        if isinstance(record, list):
+            for r in record:
+                yield r
+        else:
+            yield record
+
+def write_records(records, path, serialization_format='gml'):
+    """
+    Write node and edge records to ``path`` in the given format
+    (``'gml'`` or ``'json'``) and return ``path``.
+    """
+    writer = {'gml': write_gml, 'json': write_graphson}.get(serialization_format)
+    if writer is None:
+        raise ValueError('Unsupported serialization format: %r' % (serialization_format,))
+    with io.open(path, 'w', encoding='utf-8') as f:
+        writer(records, f)
+    return path
+
+__all__ = ['write_gml', 'write_graphson', 'write_records']
@@ -77,7 +77,7 @@ config = {
     "install_requires": requires,
     "zip_safe": False,
     "scripts": [],
-    "package_data": {'graphgenpy': ['lib/GraphGen-0.0.6-SNAPSHOT-jar-with-dependencies.jar']}
+    "package_data": {'graphgenpy': ['lib/GraphGen-0.0.6-SNAPSHOT-jar-with-dependencies.jar', 'lib/PyGraphGenWorker.java']}
     }
 
 ##########################################################################
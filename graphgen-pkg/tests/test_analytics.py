@@ -0,0 +1,71 @@
+# test_analytics.py
+# Tests for the vectorized graph algorithms, against NetworkX on small
+# random graphs.
+
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from graphgenpy import analytics
+from graphgenpy import csr
+
+def _random_graph(seed, n=30, m=60):
+    rng = random.Random(seed)
+    # Ids that are not vertex numbers, repeated edges and self-loops too
+    ids = np.array(sorted(rng.sample(range(1000), n)), dtype=np.int64)
+    sources = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    targets = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    graph = csr.from_edges(ids, sources, targets)
+    return graph, graph.to_networkx()
+
+def _nx_pagerank(G):
+    try:
+        return nx.pagerank(G)
+    except ImportError:
+        # NetworkX 3 computes it with scipy; its pure-Python version is the
+        # one graphgenpy follows
+        from networkx.algorithms.link_analysis import pagerank_alg
+        return pagerank_alg._pagerank_python(G)
+
+SEEDS = range(10)
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_pagerank(seed):
+    graph, G = _random_graph(seed)
+    ours, theirs = analytics.pagerank(graph), _nx_pagerank(G)
+    assert set(ours) == set(theirs)
+    assert all(abs(ours[n] - theirs[n]) < 1e-6 for n in theirs)
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_degree(seed):
+    graph, G = _random_graph(seed)
+    assert analytics.degree(graph) == dict(G.degree())
+    assert analytics.degree(graph, 'in') == dict(G.in_degree())
+    assert analytics.degree(graph, 'out') == dict(G.out_degree())
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_connected_components(seed):
+    graph, G = _random_graph(seed, m=25)
+    ours = analytics.connected_components(graph)
+    # Compared as partitions of the node set
+    partition = set(frozenset(n for n in ours if ours[n] == c) for c in set(ours.values()))
+    assert partition == set(frozenset(c) for c in nx.weakly_connected_components(G))
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_bfs(seed):
+    graph, G = _random_graph(seed)
+    for source in sorted(G)[:5]:
+        assert analytics.bfs(graph, source) == nx.single_source_shortest_path_length(G, source)
+        assert analytics.bfs(graph, source, depth=2) == nx.single_source_shortest_path_length(G, source, 2)
+        assert (analytics.bfs(graph, source, directed=False) ==
+                nx.single_source_shortest_path_length(G.to_undirected(), source))
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_triangles(seed):
+    pytest.importorskip('scipy')
+    graph, G = _random_graph(seed, m=120)
+    U = G.to_undirected()
+    U.remove_edges_from(list(nx.selfloop_edges(U)))
+    assert analytics.triangles(graph) == nx.triangles(U)
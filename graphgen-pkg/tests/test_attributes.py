@@ -0,0 +1,100 @@
+# test_attributes.py
+# Tests for columnar node attributes.
+
+import random
+
+import numpy as np
+import pytest
+
+from graphgenpy import attributes
+from graphgenpy import csr
+from graphgenpy import shm
+
+IDS = np.array([3, 9, 10, 12], dtype=np.int64)
+
+MIXED = {9: {'a': 1, 'b': 2.5}, 10: {'a': u'1'}, 12: {'a': True, 'b': u'z'}}
+
+def test_mixed_columns_keep_types(tmpdir):
+    attrs = attributes.from_dicts(IDS, MIXED)
+    assert attrs.column('a').kind == 'mixed'
+    assert dict(attrs) == MIXED
+
+    graph = csr.from_edges(IDS, np.array([0]), np.array([1]), MIXED)
+    path = str(tmpdir.join('g.csr'))
+    csr.save_csr(graph, path)
+    assert dict(csr.load_csr(path).attrs) == MIXED
+
+    with shm.publish(graph, 'graphgen-test-mixed') as published:
+        assert dict(published.graph.attrs) == MIXED
+
+def _random_dicts(rng, ids, kinds):
+    values = {
+        'int': lambda: rng.randrange(-5, 5),
+        'float': lambda: rng.random(),
+        'text': lambda: rng.choice([u'a', u'b', u'été', u'']),
+        'mixed': lambda: rng.choice([1, 2.5, u'1', True]),
+    }
+    dicts = {}
+    for id in ids:
+        row = dict((name, values[kind]()) for name, kind in kinds.items() if rng.random() < 0.7)
+        if row:
+            dicts[int(id)] = row
+    return dicts
+
+KINDS = {'I': 'int', 'F': 'float', 'T': 'text', 'M': 'mixed'}
+
+def test_columns_match_dicts(tmpdir):
+    rng = random.Random(0)
+    ids = np.array(sorted(rng.sample(range(1000), 60)), dtype=np.int64)
+    dicts = _random_dicts(rng, ids, KINDS)
+    attrs = attributes.from_dicts(ids, dicts)
+    assert [attrs.column(name).kind for name in 'IFTM'] == ['numeric', 'numeric', 'string', 'mixed']
+    assert dict(attrs) == dicts
+    assert list(attrs.dicts()) == [dicts.get(int(id), {}) for id in ids]
+    # Every distinct string is pooled once
+    assert len(attrs.column('T').pool) == len(set(d['T'] for d in dicts.values() if 'T' in d))
+
+    rows = np.array([5, 1, 40])
+    taken = attrs.take(rows, ids[rows])
+    assert list(taken.dicts()) == [dicts.get(int(ids[r]), {}) for r in rows]
+
+    path = str(tmpdir)
+    attributes.save_attributes(path, ids, attrs)
+    loaded = attributes.load_attributes(path, ids)
+    assert loaded.names() == attrs.names() and not loaded._columns
+    assert dict(loaded) == dicts
+
+def test_equal_values_of_other_types_stay_apart():
+    attrs = attributes.from_dicts(IDS, {3: {'a': 1}, 9: {'a': True}, 10: {'a': 1.0}, 12: {'a': u'1'}})
+    assert [type(attrs[id]['a']) for id in (3, 9, 10, 12)] == [int, bool, float, type(u'')]
+    # Without text the column is numeric: one dtype for all of its values
+    attrs = attributes.from_dicts(IDS, {3: {'a': 1}, 9: {'a': 2.5}})
+    assert attrs.column('a').values.dtype == np.float64 and attrs[3] == {'a': 1.0}
+
+@pytest.mark.parametrize('seed', range(5))
+def test_concat_matches_union(seed):
+    rng = random.Random(seed)
+    ids = np.array(sorted(rng.sample(range(1000), 90)), dtype=np.int64)
+    parts, expected = [], {}
+    for part_ids in (ids[0::3], ids[1::3], ids[2::3]):
+        # Each part has some of the attributes, of a kind of its own
+        kinds = dict((name, rng.choice(['int', 'float', 'text', 'mixed']))
+                     for name in 'ABC' if rng.random() < 0.8)
+        dicts = _random_dicts(rng, part_ids, kinds)
+        parts.append((part_ids, attributes.from_dicts(part_ids, dicts)))
+        expected.update(dicts)
+    merged = attributes.concat(parts, ids)
+    # Numeric parts of different dtypes widen, ints to floats
+    actual = dict(merged)
+    assert set(actual) == set(expected)
+    for id in expected:
+        assert actual[id] == expected[id]
+        for name, value in expected[id].items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                assert type(actual[id][name]) is type(value)
+
+def test_concat_keeps_nodes_without_parts():
+    part = np.array([3, 10], dtype=np.int64)
+    merged = attributes.concat([(part, attributes.from_dicts(part, {3: {'a': u'x'}, 10: {'a': 2}}))], IDS)
+    assert dict(merged) == {3: {'a': u'x'}, 10: {'a': 2}}
+    assert len(merged) == 2 and 9 not in merged
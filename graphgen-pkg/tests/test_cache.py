@@ -0,0 +1,67 @@
+# test_cache.py
+# Tests for the extraction result cache.
+
+import io
+import os
+import stat
+
+import pytest
+
+from graphgenpy import cache as _cache
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+def _write(path, text):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def _replace(path, text):
+    # As generateGraph does before every extraction
+    _cache._remove(path)
+    _write(path, text)
+
+def _placed_file(tmpdir):
+    cache = _cache.ExtractionCache(str(tmpdir.join('cache')))
+    path = str(tmpdir.join('graph.gml'))
+    _write(path, u'cached')
+    key = cache.key('Edges(A, B) :- T(A, B).', ('localhost',), 'gml')
+    cache.store(key, {'t': [1]}, path)
+    cached = cache.lookup(key, {'t': [1]})
+    _cache.place(cached, path)
+    return cached, path
+
+def test_placed_output_is_linked_read_only(tmpdir):
+    cached, path = _placed_file(tmpdir)
+    assert os.path.samefile(cached, path)
+    assert not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+def test_replacing_placed_output_keeps_entry(tmpdir):
+    cached, path = _placed_file(tmpdir)
+    _replace(path, u'overwritten')
+    assert _read(cached) == u'cached'
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() == 0,
+                    reason='root ignores file permissions')
+def test_writing_placed_output_in_place_fails(tmpdir):
+    cached, path = _placed_file(tmpdir)
+    with pytest.raises((IOError, OSError)):
+        _write(path, u'overwritten')
+    assert _read(cached) == u'cached'
+
+def test_replacing_placed_directory_keeps_entry(tmpdir):
+    cache = _cache.ExtractionCache(str(tmpdir.join('cache')))
+    path = str(tmpdir.join('graph.csr'))
+    os.makedirs(path)
+    _write(os.path.join(path, 'ids.npy'), u'cached')
+    key = cache.key('Edges(A, B) :- T(A, B).', ('localhost',), 'csr')
+    cache.store(key, {'t': [1]}, path)
+
+    cached = cache.lookup(key, {'t': [1]})
+    _cache.place(cached, path)
+    assert os.path.samefile(os.path.join(cached, 'ids.npy'), os.path.join(path, 'ids.npy'))
+    _cache._remove(path)
+    os.makedirs(path)
+    _write(os.path.join(path, 'ids.npy'), u'overwritten')
+    assert _read(os.path.join(cached, 'ids.npy')) == u'cached'
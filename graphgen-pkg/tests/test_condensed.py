@@ -0,0 +1,92 @@
+# test_condensed.py
+# Tests for condensed (virtual-node) graphs against brute-force expansions
+# of their links.
+
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from graphgenpy import condensed
+from graphgenpy import datalog
+
+def _random_links(seed, hybrid=False, self_loops=True):
+    rng = random.Random(seed)
+    ids = sorted(rng.sample(range(1, 500), 25))
+    n_virtual = 8
+    left = [(rng.choice(ids), rng.randrange(n_virtual)) for _ in range(30)]
+    right = [(rng.choice(ids), rng.randrange(n_virtual)) for _ in range(30)]
+    direct = [(rng.choice(ids), rng.choice(ids)) for _ in range(15)] if hybrid else []
+    return ids, n_virtual, left, right, direct, self_loops
+
+def _build(links):
+    ids, n_virtual, left, right, direct, self_loops = links
+    arrays = lambda pairs, i: np.array([p[i] for p in pairs], dtype=np.int64)
+    edges = (arrays(direct, 0), arrays(direct, 1)) if direct else (None, None)
+    return condensed.from_links(np.array(ids, dtype=np.int64), arrays(left, 0), arrays(left, 1),
+                                arrays(right, 0), arrays(right, 1), n_virtual, self_loops,
+                                edge_sources=edges[0], edge_targets=edges[1])
+
+def _brute_force(links):
+    ids, n_virtual, left, right, direct, self_loops = links
+    edges = set((l, r) for l, v in left for r, w in right if v == w) | set(direct)
+    if not self_loops:
+        edges = set((s, t) for s, t in edges if s != t)
+    return edges
+
+def _hops(edges, source):
+    adjacency = {}
+    for s, t in edges:
+        adjacency.setdefault(s, set()).add(t)
+    dist, queue = {source: 0}, deque([source])
+    while queue:
+        node = queue.popleft()
+        for m in adjacency.get(node, ()):
+            if m not in dist:
+                dist[m] = dist[node] + 1
+                queue.append(m)
+    return dist
+
+CASES = [(seed, hybrid, self_loops) for seed in range(5) for hybrid in (False, True) for self_loops in (True, False)]
+
+@pytest.mark.parametrize('seed, hybrid, self_loops', CASES)
+def test_matches_brute_force(seed, hybrid, self_loops):
+    links = _random_links(seed, hybrid, self_loops)
+    graph = _build(links)
+    edges = _brute_force(links)
+
+    expanded = graph.expand(batch=7)
+    assert set(expanded.to_networkx().edges()) == edges
+    for id in links[0]:
+        expected = sorted(t for s, t in edges if s == id)
+        assert graph.successors(id).tolist() == expected
+        assert graph.out_degree(id) == len(expected)
+    for source in links[0][:5]:
+        assert graph.bfs(source) == _hops(edges, source)
+        assert graph.bfs(source, depth=1) == dict((n, d) for n, d in _hops(edges, source).items() if d <= 1)
+
+def test_save_and_load(tmpdir):
+    links = _random_links(0, hybrid=True, self_loops=False)
+    graph = _build(links)
+    path = str(tmpdir.join('g.condensed'))
+    condensed.save_condensed(graph, path)
+    loaded = condensed.load_condensed(path)
+    assert loaded.is_hybrid() and not loaded.self_loops
+    assert set(loaded.expand().to_networkx().edges()) == _brute_force(links)
+
+def test_split_rule():
+    rule = datalog.edge_rules(datalog.parse(
+        'Edges(A, B) :- AP(A, P), Pub(P, Y), AP(B, P), Y > 2000, A != B.'))[0]
+    split = condensed.split_rule(rule)
+    assert split.key == ['P']
+    assert not split.self_loops
+    # The first split point with the smallest key: Y is bound on the right
+    assert [a.name for a in split.left] == ['AP']
+    assert split.left_comparisons == []
+    assert [c.left.name for c in split.right_comparisons] == ['Y']
+
+def test_split_rule_rejects_spanning_comparison():
+    rule = datalog.edge_rules(datalog.parse('Edges(A, B) :- AP(A, P), AP(B, P), A < B.'))[0]
+    with pytest.raises(ValueError):
+        condensed.split_rule(rule)
@@ -0,0 +1,35 @@
+# test_csr.py
+# Tests for saving and loading CSR graphs.
+
+import os
+
+import numpy as np
+import pytest
+
+from graphgenpy import csr
+
+def _weighted(path):
+    ids = np.array([1, 2, 3], dtype=np.int64)
+    return csr.save_edges(path, ids, np.array([1, 2, 3]), np.array([2, 3, 1]),
+                          weights=np.array([4, 5, 6], dtype=np.int64))
+
+def test_save_replaces_earlier_graph(tmpdir):
+    path = str(tmpdir.join('g.csr'))
+    _weighted(path)
+    assert list(csr.load_csr(path).weights) == [4, 5, 6]
+
+    sources, targets = np.array([1, 1, 2, 3, 4]), np.array([2, 3, 3, 4, 1])
+    csr.save_csr(csr.from_edges(np.array([1, 2, 3, 4]), sources - 1, targets - 1), path)
+    graph = csr.load_csr(path)
+    assert graph.weights is None
+    assert graph.to_networkx().number_of_edges() == 5
+
+    csr.save_edges(path, np.array([1, 2, 3, 4]), sources, targets)
+    assert csr.load_csr(path).weights is None
+
+def test_load_rejects_misaligned_weights(tmpdir):
+    path = str(tmpdir.join('g.csr'))
+    _weighted(path)
+    np.save(os.path.join(path, 'weights.npy'), np.array([1, 2], dtype=np.int64))
+    with pytest.raises(ValueError):
+        csr.load_csr(path)
@@ -0,0 +1,46 @@
+# test_engine.py
+# Tests for the SQL engine, on PostgreSQL when GRAPHGEN_TEST_DSN holds a
+# libpq connection string (see test_sharing.py).
+
+import os
+
+import pytest
+
+from graphgenpy.engine import DatalogEngine
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get('GRAPHGEN_TEST_DSN')
+    if not dsn:
+        pytest.skip('GRAPHGEN_TEST_DSN is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE gt_member (id integer, name text, club text)')
+        cursor.executemany('INSERT INTO gt_member VALUES (%s, %s, %s)',
+                           [(1, 'a', 'x'), (2, 'b', 'x'), (3, 'c', 'y')])
+        cursor.close()
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+def test_integer_ids_pass(conn):
+    eng = DatalogEngine(conn)
+    query = 'Nodes(ID, Name) :- GT_Member(ID, Name, C).\nEdges(A, B) :- GT_Member(A, N, C), GT_Member(B, M, C).'
+    eng.check_ids(query)
+    assert eng.extract(query).to_networkx().number_of_edges() == 5
+
+@pytest.mark.parametrize('query, column', [
+    ('Nodes(Name, ID) :- GT_Member(ID, Name, C).', 'gt_member.name'),
+    ('Edges(A, C) :- GT_Member(A, N, C).', 'gt_member.club'),
+])
+def test_text_ids_are_rejected(conn, query, column):
+    with pytest.raises(ValueError) as e:
+        DatalogEngine(conn).check_ids(query)
+    assert column in str(e.value)
+
+def test_string_constant_ids_are_rejected(conn):
+    with pytest.raises(ValueError):
+        DatalogEngine(conn).check_ids("Edges(A, 'x') :- GT_Member(A, N, C).")
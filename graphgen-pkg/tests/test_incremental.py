@@ -0,0 +1,161 @@
+# test_incremental.py
+# Tests for incrementally maintained graphs: the delta rules, the refresh
+# bookkeeping and, on PostgreSQL when GRAPHGEN_TEST_DSN holds a libpq
+# connection string (see test_sharing.py), refreshes against recomputed
+# graphs. The PostgreSQL tests install triggers, so their tables are
+# dropped again afterwards.
+
+import os
+import random
+from collections import Counter
+
+import pytest
+
+from graphgenpy import datalog
+from graphgenpy import incremental
+
+QUERY = 'Nodes(ID, Name) :- GT_Person(ID, Name).\nEdges(A, B) :- GT_Knows(A, P), GT_Knows(B, P).'
+
+_columns = {'gt_person': ['id', 'name'], 'gt_knows': ['pid', 'tid']}
+
+def _catalog(table):
+    return _columns[table.lower()]
+
+##########################################################################
+# Delta rules
+##########################################################################
+
+def test_full_counts_read_the_tables():
+    sql, params = incremental.compile_counts(datalog.edge_rules(datalog.parse(QUERY)), _catalog, 2)
+    assert 'graphgen_log_' not in sql
+    assert 'HAVING sum(w) <> 0' in sql
+
+def test_delta_rules_read_one_log_per_part():
+    sql, _ = incremental.compile_counts(datalog.edge_rules(datalog.parse(QUERY)), _catalog, 2, '10:20:12,15')
+    parts = sql.split(' UNION ALL (')
+    # One part per atom: dR1 x R2 and R1' x dR2
+    assert len(parts) == 2
+    assert "txid_visible_in_snapshot(graphgen_xid, '10:20:12,15')" in sql
+    # The atoms after the changed one read the old table, the log undone
+    assert parts[0].count('FROM "graphgen_log_gt_knows"') == 2
+    assert parts[1].count('FROM "graphgen_log_gt_knows"') == 1
+
+def test_malformed_snapshot():
+    with pytest.raises(ValueError):
+        incremental.compile_counts(datalog.parse(QUERY), _catalog, 2, "1:2:'; DROP TABLE x")
+
+##########################################################################
+# Refresh bookkeeping
+##########################################################################
+
+def _expected(counts):
+    return dict((k, v) for k, v in counts.items() if v > 0)
+
+def test_apply_matches_recomputed_graph():
+    rng = random.Random(0)
+    nodes, edges = Counter(), Counter()
+    graph = incremental.IncrementalGraph(QUERY, '1:1:', {}, {})
+    view = graph.to_networkx()
+    for _ in range(200):
+        delta_nodes, delta_edges = {}, {}
+        for id in rng.sample(range(8), rng.randint(0, 4)):
+            current = [key for key in nodes if key[0] == id and nodes[key]]
+            name = rng.choice('abc')
+            if not current:
+                delta_nodes[(id, name)] = rng.choice([0, 1])
+            elif rng.random() < 0.5:
+                # Removing a node drops its edges from the NetworkX view too,
+                # so only nodes without edges are removed
+                linked = any(id in edge for edge in edges if edges[edge])
+                delta_nodes[current[0]] = 1 if linked else rng.choice([-nodes[current[0]], 1])
+            elif name != current[0][1]:
+                # Renamed
+                delta_nodes[current[0]] = -nodes[current[0]]
+                delta_nodes[(id, name)] = 1
+        for _ in range(rng.randint(0, 6)):
+            edge = (rng.randrange(8), rng.randrange(8))
+            if edge in delta_edges:
+                continue
+            # Zero changes are rows inserted and deleted again in between
+            delta_edges[edge] = rng.choice([-edges[edge], 0, 1, 2]) if edges[edge] else rng.choice([0, 1])
+        nodes.update(delta_nodes)
+        edges.update(delta_edges)
+        delta = graph._apply('1:1:', delta_nodes, delta_edges)
+        assert graph.nodes == _expected(nodes)
+        assert graph.edges == _expected(edges)
+        assert not set(delta.removed_edges) - set(view.edges())
+        delta.apply(view)
+        expected = graph.to_networkx()
+        assert sorted(view.edges()) == sorted(expected.edges())
+        # Endpoints of removed edges stay behind in the view, without attributes
+        assert dict((n, a) for n, a in view.nodes(data=True) if a) == \
+            dict((n, a) for n, a in expected.nodes(data=True) if a)
+
+def test_netted_out_changes_are_not_reported():
+    graph = incremental.IncrementalGraph(QUERY, '1:1:', {(1, 'a'): 1}, {(1, 1): 1})
+    delta = graph._apply('1:1:', {(2, 'b'): 0}, {(1, 2): 0, (2, 1): 0})
+    assert delta == incremental.GraphDelta([], [], [], [], [])
+    assert graph.edges == {(1, 1): 1}
+
+def test_renamed_node_is_changed():
+    graph = incremental.IncrementalGraph(QUERY, '1:1:', {(1, 'a'): 1, (2, 'b'): 1}, {})
+    delta = graph._apply('1:1:', {(1, 'a'): -1, (1, 'c'): 1, (2, 'b'): -1}, {})
+    assert [node.attrs for node in delta.changed_nodes] == [{'Name': 'c'}]
+    assert delta.removed_nodes == [2]
+    assert graph._keys == {1: set([(1, 'c')])}
+
+##########################################################################
+# Refreshes against recomputed graphs
+##########################################################################
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get('GRAPHGEN_TEST_DSN')
+    if not dsn:
+        pytest.skip('GRAPHGEN_TEST_DSN is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    tables = ('gt_person', 'gt_knows')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE gt_person (id integer, name text)')
+        cursor.execute('CREATE TABLE gt_knows (pid integer, tid integer)')
+        cursor.executemany('INSERT INTO gt_person VALUES (%s, %s)', [(i, 'p%d' % i) for i in range(6)])
+        cursor.executemany('INSERT INTO gt_knows VALUES (%s, %s)', [(0, 1), (1, 1), (2, 2), (3, 2)])
+        cursor.close()
+        conn.commit()
+        yield conn
+    finally:
+        conn.rollback()
+        cursor = conn.cursor()
+        for table in tables:
+            cursor.execute('DROP TABLE IF EXISTS %s, %s' % (table, incremental.log_table(table)))
+        cursor.close()
+        conn.commit()
+        conn.close()
+
+def _run(conn, *statements):
+    cursor = conn.cursor()
+    for sql in statements:
+        cursor.execute(sql)
+    cursor.close()
+    conn.commit()
+
+def test_refresh_matches_extraction(conn):
+    graph = incremental.IncrementalGraph.extract(conn, QUERY)
+    view = graph.to_networkx()
+    _run(conn, 'INSERT INTO gt_knows VALUES (4, 2)', 'DELETE FROM gt_knows WHERE pid = 0',
+         "UPDATE gt_person SET name = 'renamed' WHERE id = 1")
+    graph.refresh(conn).apply(view)
+    # Inserted and deleted again before the next refresh
+    _run(conn, 'INSERT INTO gt_knows VALUES (5, 1)', 'INSERT INTO gt_person VALUES (9, \'gone\')')
+    _run(conn, 'DELETE FROM gt_knows WHERE pid = 5', 'DELETE FROM gt_person WHERE id = 9')
+    delta = graph.refresh(conn)
+    assert (5, 1) not in delta.removed_edges and 9 not in delta.removed_nodes
+    delta.apply(view)
+
+    fresh = incremental.IncrementalGraph.extract(conn, QUERY)
+    assert graph.nodes == fresh.nodes
+    assert graph.edges == fresh.edges
+    assert sorted(view.edges()) == sorted(fresh.to_networkx().edges())
+    assert view.nodes[1] == {'Name': 'renamed'}
@@ -0,0 +1,143 @@
+# test_lazy.py
+# Tests for lazily explored graphs: the LRU cache, the lookup statements
+# and, on PostgreSQL when GRAPHGEN_TEST_DSN holds a libpq connection
+# string (see test_sharing.py), lookups against brute-force adjacency. A
+# LazyGraph ends its transactions after every lookup, so the tables are
+# committed and dropped again afterwards.
+
+import os
+import random
+from collections import OrderedDict, deque
+
+import pytest
+
+from graphgenpy import datalog
+from graphgenpy import lazy
+
+##########################################################################
+# LRU cache
+##########################################################################
+
+def test_lru_matches_model():
+    rng = random.Random(0)
+    cache, model = lazy.LRUCache(20), OrderedDict()
+    for _ in range(2000):
+        key = rng.randrange(30)
+        if rng.random() < 0.5:
+            value = model.pop(key, None)
+            assert cache.get(key) == (value[0] if value else None)
+            if value:
+                model[key] = value
+        else:
+            value, weight = rng.random(), rng.randrange(1, 8)
+            model.pop(key, None)
+            model[key] = (value, weight)
+            cache.put(key, value, weight)
+            while sum(w for _, w in model.values()) > 20:
+                model.popitem(last=False)
+        assert len(cache) == len(model)
+        assert cache.weight == sum(w for _, w in model.values()) <= cache.capacity
+        assert all(key in cache for key in model)
+
+def test_lru_drops_entries_heavier_than_capacity():
+    cache = lazy.LRUCache(5)
+    cache.put('a', 1, 3)
+    cache.put('a', 2, 6)
+    assert 'a' not in cache and cache.weight == 0
+    cache.put('b', 3, 5)
+    assert cache.get('b') == 3
+    cache.clear()
+    assert len(cache) == 0 and cache.weight == 0
+
+##########################################################################
+# Lookup statements
+##########################################################################
+
+_columns = {'gt_knows': ['pid', 'tid'], 'gt_link': ['src', 'dst']}
+
+def _catalog(table):
+    return _columns[table.lower()]
+
+def test_compile_lookup_filters_the_key_column():
+    rules = datalog.edge_rules(datalog.parse(
+        'Edges(A, B) :- GT_Knows(A, P), GT_Knows(B, P).\nEdges(A, B) :- GT_Link(A, B).'))
+    sql, params = lazy.compile_lookup(rules, _catalog, 2, key=1)
+    assert sql.startswith('SELECT DISTINCT c0, c1 FROM ((')
+    assert sql.endswith(') e(c0, c1) WHERE c1 = ANY(%s)')
+    assert sql.count(' UNION ALL ') == 1
+    assert params == []
+
+##########################################################################
+# Lookups on PostgreSQL
+##########################################################################
+
+_rng = random.Random(1)
+EDGES = [(_rng.randrange(30), _rng.randrange(30)) for _ in range(70)]
+
+QUERY = 'Nodes(ID, Name) :- GT_Node(ID, Name).\nEdges(A, B) :- GT_Link(A, B).'
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get('GRAPHGEN_TEST_DSN')
+    if not dsn:
+        pytest.skip('GRAPHGEN_TEST_DSN is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE gt_node (id integer, name text)')
+        cursor.execute('CREATE TABLE gt_link (src integer, dst integer)')
+        cursor.executemany('INSERT INTO gt_node VALUES (%s, %s)', [(k, 'n%d' % k) for k in range(0, 30, 2)])
+        cursor.executemany('INSERT INTO gt_link VALUES (%s, %s)', EDGES)
+        cursor.close()
+        conn.commit()
+        yield conn
+    finally:
+        conn.rollback()
+        cursor = conn.cursor()
+        cursor.execute('DROP TABLE IF EXISTS gt_node, gt_link')
+        conn.commit()
+        conn.close()
+
+def _hops(adjacency, source, depth=None):
+    dist, queue = {source: 0}, deque([source])
+    while queue:
+        v = queue.popleft()
+        if depth is not None and dist[v] >= depth:
+            continue
+        for w in adjacency.get(v, ()):
+            if w not in dist:
+                dist[w] = dist[v] + 1
+                queue.append(w)
+    return dist
+
+def test_lookups_match_brute_force(conn):
+    out, into = {}, {}
+    for s, t in set(EDGES):
+        out.setdefault(s, set()).add(t)
+        into.setdefault(t, set()).add(s)
+    both = dict((v, out.get(v, set()) | into.get(v, set())) for v in range(30))
+
+    graph = lazy.LazyGraph(conn, QUERY, cache_size=40, batch_size=7)
+    for v in range(30):
+        assert set(graph.successors(v)) == out.get(v, set())
+        assert set(graph.predecessors(v)) == into.get(v, set())
+        assert set(graph.neighbors(v, 'both')) == both[v]
+    for source in (0, 5, 17):
+        assert graph.bfs(source) == _hops(out, source)
+        assert graph.bfs(source, depth=2, direction='both') == _hops(both, source, 2)
+    assert graph.cache_info()['cached_edges'] + graph.cache_info()['cached_lists'] <= 40
+
+    assert graph.node_attributes([2, 3, 4]) == {2: {'Name': 'n2'}, 4: {'Name': 'n4'}}
+    sub = graph.ego_network(0, radius=1)
+    assert set(sub.ids.tolist()) == set(_hops(out, 0, 1))
+
+def test_cache_answers_repeated_lookups(conn):
+    graph = lazy.LazyGraph(conn, QUERY)
+    graph.bfs(0)
+    queries = graph.queries
+    graph.bfs(0)
+    assert graph.queries == queries
+    graph.clear_cache()
+    graph.successors(0)
+    assert graph.queries == queries + 1
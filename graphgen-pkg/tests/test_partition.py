@@ -0,0 +1,74 @@
+# test_partition.py
+# Tests for partitioned graph output: shards written in every format and
+# scheme load back into the original graph.
+
+import json
+import random
+
+import numpy as np
+import pytest
+
+from graphgenpy import csr
+from graphgenpy import partition
+
+def _random_graph(seed, n=50, m=120):
+    rng = random.Random(seed)
+    ids = np.array(sorted(rng.sample(range(10000), n)), dtype=np.int64)
+    sources = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    targets = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    attrs = dict((int(id), {'Name': 'node%d' % id, 'Weight': rng.randrange(5)})
+                 for id in ids if rng.random() < 0.8)
+    return csr.from_edges(ids, sources, targets, attrs)
+
+def _edges(graph):
+    return sorted(graph.to_networkx().edges())
+
+CASES = [(fmt, scheme, processes) for fmt in ('gml', 'json', 'csr')
+         for scheme in ('hash', 'range') for processes in (1, 2)]
+
+@pytest.mark.parametrize('fmt, scheme, processes', CASES)
+def test_round_trip(tmpdir, fmt, scheme, processes):
+    graph = _random_graph(0)
+    path = str(tmpdir.join('g.parts'))
+    manifest = partition.write_partitioned(graph, path, 4, fmt, scheme, query='Edges(A, B) :- T(A, B).')
+    assert manifest['nodes'] == graph.number_of_nodes()
+    assert sum(s['edges'] for s in manifest['shards']) == graph.number_of_edges()
+
+    loaded = partition.load_partitioned(path, processes=processes)
+    assert loaded.ids.tolist() == graph.ids.tolist()
+    assert _edges(loaded) == _edges(graph)
+    for id in graph.ids.tolist():
+        assert loaded.attrs.get(id) == graph.attrs.get(id)
+
+@pytest.mark.parametrize('scheme', ['hash', 'range'])
+def test_shards_own_their_nodes_and_out_edges(tmpdir, scheme):
+    graph = _random_graph(1)
+    path = str(tmpdir.join('g.parts'))
+    partition.write_partitioned(graph, path, 3, 'csr', scheme)
+    parts = partition.load_partitioned(path, assemble=False)
+    assert parts.number_of_nodes() == graph.number_of_nodes()
+    assert parts.number_of_edges() == graph.number_of_edges()
+    for shard in parts.shards:
+        assert (parts.partition_of(np.asarray(shard.ids)) == shard.index).all()
+        for i, id in enumerate(np.asarray(shard.ids).tolist()):
+            targets = np.asarray(shard.targets)[shard.offsets[i]:shard.offsets[i + 1]]
+            assert sorted(targets.tolist()) == sorted(graph.successors(id).tolist())
+
+def test_range_partitions_are_balanced():
+    ids = np.arange(100, 200, dtype=np.int64)
+    owner = partition.range_partition(ids, partition.range_bounds(ids, 4))
+    assert np.bincount(owner).tolist() == [25, 25, 25, 25]
+    assert (np.diff(owner) >= 0).all()
+
+def test_hash_spreads_consecutive_ids():
+    counts = np.bincount(partition.hash_partition(np.arange(1000), 4), minlength=4)
+    assert counts.min() > 200
+
+def test_manifest_version(tmpdir):
+    path = str(tmpdir.join('g.parts'))
+    partition.write_partitioned(_random_graph(2), path, 2, 'csr')
+    manifest = partition.read_manifest(path)
+    manifest['version'] = partition.VERSION + 1
+    tmpdir.join('g.parts', partition.MANIFEST).write(json.dumps(manifest))
+    with pytest.raises(ValueError):
+        partition.read_manifest(path)
@@ -0,0 +1,106 @@
+# test_planner.py
+# Tests for the key distribution and join size estimates of the planner,
+# against brute-force counts over columns whose statistics are known.
+
+import random
+from collections import Counter
+
+import pytest
+
+from graphgenpy import planner
+
+def _stats(values, n_mcv=None, buckets=10):
+    # Statistics like ANALYZE keeps on a column: the most common values and
+    # a histogram of the others
+    counts = Counter(values)
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    n_mcv = len(ranked) if n_mcv is None else n_mcv
+    mcv = [(str(v), float(c) / len(values)) for v, c in ranked[:n_mcv]]
+    rest = sorted(v for v, _ in ranked[n_mcv:] for _ in range(counts[v]))
+    histogram = [str(rest[k * (len(rest) - 1) // buckets]) for k in range(buckets + 1)] if rest else []
+    return planner.ColumnStats('t', 'c', 0.0, float(len(counts)), mcv, histogram)
+
+def _join(left, right):
+    lc, rc = Counter(left), Counter(right)
+    keys = set(lc) & set(rc)
+    return sum(lc[k] * rc[k] for k in keys), sum(lc[k] + rc[k] for k in keys)
+
+def _estimate(left, right, same_column=False, **kwargs):
+    ls, rs = _stats(left, **kwargs), _stats(right, **kwargs)
+    groups = planner.join_groups(planner.key_distribution(ls), planner.key_distribution(rs),
+                                 len(left), len(right), same_column)
+    return planner.summarize(groups)
+
+def _skewed(rng, n, keys):
+    return [min(int(rng.paretovariate(1.2)), keys) for _ in range(n)]
+
+##########################################################################
+# Key distributions
+##########################################################################
+
+def test_distribution_sums_to_one():
+    rng = random.Random(0)
+    stats = _stats(_skewed(rng, 5000, 400), n_mcv=20)
+    groups = planner.key_distribution(stats)
+    assert abs(sum(p * count for _, p, count in groups) - 1.0) < 1e-9
+    assert all(count >= 1.0 for _, _, count in groups)
+    assert [value for value, _, _ in groups[:20]] == [value for value, _ in stats.mcv]
+
+def test_filters_on_most_common_values():
+    values = [1] * 50 + [2] * 30 + [3] * 20
+    groups = planner.key_distribution(_stats(values), [('>', '1')])
+    assert [(v, round(p, 6)) for v, p, _ in groups] == [('2', 0.6), ('3', 0.4)]
+    assert planner.key_distribution(_stats(values), [('=', '7')]) == []
+
+def test_filters_on_histogram():
+    values = list(range(1000))
+    groups = planner.key_distribution(_stats(values, n_mcv=0), [('<', '250')])
+    # A quarter of the distinct values pass
+    assert abs(sum(count for _, _, count in groups) - 250) < 30
+
+##########################################################################
+# Join sizes
+##########################################################################
+
+@pytest.mark.parametrize('seed', range(5))
+def test_exact_with_complete_statistics(seed):
+    rng = random.Random(seed)
+    left, right = _skewed(rng, 2000, 100), _skewed(rng, 1500, 100)
+    edges, links = _join(left, right)
+    totals = _estimate(left, right)
+    assert abs(totals['edges'] - edges) < 1e-6 * edges
+    assert abs(totals['links'] - links) < 1e-6 * links
+
+@pytest.mark.parametrize('seed', range(5))
+def test_self_join_pairs_values(seed):
+    rng = random.Random(seed)
+    values = _skewed(rng, 3000, 500)
+    edges, _ = _join(values, values)
+    totals = _estimate(values, values, same_column=True, n_mcv=30)
+    # Exact for the most common values, close for the heavy tail
+    assert 0.8 * edges < totals['edges'] < 1.25 * edges
+    assert totals['top_keys'][0][0] == str(Counter(values).most_common(1)[0][0])
+
+def test_uniform_join_from_histograms():
+    rng = random.Random(1)
+    left = [rng.randrange(1000) for _ in range(20000)]
+    right = [rng.randrange(1000) for _ in range(10000)]
+    edges, links = _join(left, right)
+    totals = _estimate(left, right, n_mcv=0)
+    assert 0.8 * edges < totals['edges'] < 1.25 * edges
+    assert 0.8 * links < totals['links'] < 1.25 * links
+
+def test_unmatched_most_common_values():
+    groups = planner.join_groups([('a', 1.0, 1.0)], [('b', 1.0, 1.0)], 10, 10)
+    assert groups == []
+
+##########################################################################
+# Choice
+##########################################################################
+
+def test_choose():
+    light = planner.KeyGroup(None, 2.0, 2.0, 1000.0)
+    heavy = planner.KeyGroup('x', 1000.0, 1000.0, 1.0)
+    assert planner.choose(planner.summarize([light]))[0] == 'expanded'
+    assert planner.choose(planner.summarize([heavy]))[0] == 'condensed'
+    assert planner.choose(planner.summarize([heavy, planner.KeyGroup(None, 3.0, 3.0, 20000.0)]))[0] == 'hybrid'
@@ -0,0 +1,70 @@
+# test_readers.py
+# Tests for the GML and GraphSON readers.
+
+import io
+
+from graphgenpy import readers
+
+GML = u'''graph [
+  directed 1
+  node [
+    id 1
+    Name "a]b"
+    Age 3
+  ]
+  node [
+    id 2
+    Name "[c"
+    Age 4
+  ]
+  node [
+    id 3
+    Name "d"
+  ]
+  edge [
+    source 1
+    target 2
+  ]
+  edge [
+    source 2
+    target 3
+  ]
+]
+'''
+
+def _scanned(text, bufsize):
+    nodes, edges = {}, []
+    for chunk_nodes, sources, targets in readers._scan_gml(io.StringIO(text), bufsize):
+        nodes.update((node.id, node.attrs) for node in chunk_nodes)
+        edges += zip(sources.tolist(), targets.tolist())
+    return nodes, edges
+
+def _parsed(text):
+    nodes, edges = {}, []
+    for record in readers.iter_gml(io.StringIO(text)):
+        if isinstance(record, readers.Edge):
+            edges.append((record.source, record.target))
+        else:
+            nodes[record.id] = record.attrs
+    return nodes, edges
+
+def test_gml_brackets_in_strings():
+    expected = ({1: {'Name': 'a]b', 'Age': 3}, 2: {'Name': '[c', 'Age': 4}, 3: {'Name': 'd'}},
+                [(1, 2), (2, 3)])
+    assert _parsed(GML) == expected
+    # Buffers that end anywhere, including inside a quoted string
+    for bufsize in range(1, len(GML) + 1):
+        try:
+            assert _scanned(GML, bufsize) == expected, bufsize
+        except readers._UnsupportedGML:
+            pass
+    assert _scanned(GML, 1 << 22) == expected
+
+def test_read_graph_brackets_in_strings(tmpdir):
+    path = str(tmpdir.join('graph.gml'))
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(GML.replace('"[c"', '"c]"'))
+    graph = readers.read_graph(path)
+    assert graph.attrs[1] == {'Name': 'a]b', 'Age': 3}
+    assert graph.attrs[2] == {'Name': 'c]', 'Age': 4}
+    assert sorted(graph.successors(1)) == [2]
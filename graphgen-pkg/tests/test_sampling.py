@@ -0,0 +1,152 @@
+# test_sampling.py
+# Tests for sampled extraction: the choice of the sampled variable, the
+# random-group estimates and, on PostgreSQL when GRAPHGEN_TEST_DSN holds a
+# libpq connection string (see test_sharing.py), estimates against the
+# counts of the full graph.
+
+import os
+import random
+import zlib
+
+import pytest
+
+from graphgenpy import datalog
+from graphgenpy import sampling
+
+COAUTHORS = 'Edges(A, B) :- AP(A, P), AP(B, P).'
+
+##########################################################################
+# Sampled variable
+##########################################################################
+
+@pytest.mark.parametrize('query, key', [
+    (COAUTHORS, 'P'),
+    ('Edges(A, B) :- AP(A, P), Pub(P, V), AP(B, P), Venue(V).', 'P'),
+    ('Edges(A, B) :- Knows(A, B).', None),
+    ('Edges(A, B) :- Knows(A, X), Likes(B, Y).', None),
+    ('Edges(A, B) :- Knows(A, B).\nEdges(A, B) :- AP(A, P), AP(B, P).', None),
+])
+def test_join_key(query, key):
+    assert sampling.join_key(datalog.edge_rules(datalog.parse(query))) == key
+
+@pytest.mark.parametrize('query, sample_by, mode, variable, position', [
+    (COAUTHORS, None, 'keys', 'P', None),
+    (COAUTHORS, 'A', 'nodes', 'A', 0),
+    (COAUTHORS, 'B', 'nodes', 'B', 1),
+    ('Nodes(ID) :- Person(ID).\nEdges(X, Y) :- Knows(X, Y).', None, 'nodes', None, 0),
+    ('Edges(A, B) :- Knows(A, B).\nEdges(A, B) :- Likes(A, B).', 'A', 'nodes', 'A', 0),
+])
+def test_sample_mode(query, sample_by, mode, variable, position):
+    design = sampling.Sample(datalog.parse(query), 0.25, sample_by)
+    assert (design.mode, design.variable, design.position) == (mode, variable, position)
+    assert abs(design.fraction - 0.25) < 1e-9
+
+@pytest.mark.parametrize('query, sample_by', [
+    ('Nodes(ID) :- Person(ID).', None),
+    (COAUTHORS, 'Q'),
+    ('Edges(A, B) :- Knows(A, B).\nEdges(B, A) :- Likes(A, B).', 'A'),
+    ('Edges(A, B) :- Knows(A, B).\nEdges(A, B) :- AP(A, P), AP(B, P).', 'P'),
+    ('Edges(1, B) :- Knows(A, B).', None),
+])
+def test_sample_rejects(query, sample_by):
+    with pytest.raises(ValueError):
+        sampling.Sample(datalog.parse(query), 0.25, sample_by)
+
+@pytest.mark.parametrize('fraction', [0, -0.5, 1.5])
+def test_sample_fraction(fraction):
+    with pytest.raises(ValueError):
+        sampling.Sample(datalog.parse(COAUTHORS), fraction)
+
+##########################################################################
+# Random groups
+##########################################################################
+
+def test_replicated_sums_weights():
+    weighted = [(unit, 2.0) for unit in range(100)] + [(None, 7.0)]
+    estimate = sampling._replicated(weighted, 100)
+    assert estimate.value == 207.0
+    assert estimate.low <= 207.0 <= estimate.high
+    # Only certain items: no variance
+    assert sampling._replicated([(None, 5.0)], 1) == sampling.Estimate(5.0, 5.0, 5.0)
+
+def test_replicated_low_bound_is_observed():
+    estimate = sampling._replicated([(0, 1.0), (1, 1000.0)], 2)
+    assert estimate.low == 2.0
+
+def test_replicated_intervals_cover():
+    # Poisson samples of a skewed population: the 95% intervals hold the
+    # total most of the time
+    rng = random.Random(0)
+    sizes = [int(rng.paretovariate(2)) for _ in range(5000)]
+    total, p, covered = sum(sizes), 0.2, 0
+    for trial in range(100):
+        weighted = [(unit, size / p) for unit, size in enumerate(sizes)
+                    if zlib.crc32(('%d:%d' % (trial, unit)).encode('utf-8')) % 1000 < 1000 * p]
+        estimate = sampling._replicated(weighted, len(weighted))
+        covered += estimate.low <= total <= estimate.high
+    assert covered >= 85
+
+##########################################################################
+# Estimates on PostgreSQL
+##########################################################################
+
+QUERY = 'Nodes(ID) :- GT_AP(ID, P).\nEdges(A, B) :- GT_AP(A, P), GT_AP(B, P).'
+
+def _rows(seed):
+    # Authors of publications, a few of them with many authors
+    rng = random.Random(seed)
+    rows = set()
+    for pub in range(300):
+        for _ in range(40 if pub < 3 else rng.randint(1, 3)):
+            rows.add((rng.randrange(400), pub))
+    return sorted(rows)
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get('GRAPHGEN_TEST_DSN')
+    if not dsn:
+        pytest.skip('GRAPHGEN_TEST_DSN is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE gt_ap (a integer, p integer)')
+        cursor.executemany('INSERT INTO gt_ap VALUES (%s, %s)', _rows(0))
+        cursor.execute('ANALYZE gt_ap')
+        cursor.close()
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+def _full():
+    authors = {}
+    for a, p in _rows(0):
+        authors.setdefault(p, []).append(a)
+    edges = set()
+    for group in authors.values():
+        edges.update((a, b) for a in group for b in group)
+    return len(set(a for a, _ in _rows(0))), len(edges)
+
+@pytest.mark.parametrize('sample_by', [None, 'A'])
+def test_full_sample_is_exact(conn, sample_by):
+    design = sampling.Sample(datalog.parse(QUERY), 1, sample_by)
+    rules, catalog = design.rewrite(conn, datalog.Catalog(conn))
+    estimate = design.estimate(conn, rules, catalog)
+    nodes, edges = _full()
+    assert estimate.nodes.value == nodes and estimate.sampled_nodes == nodes
+    assert abs(estimate.edges.value - edges) < 1e-6 and estimate.sampled_edges == edges
+    if sample_by is None:
+        assert design.heavy
+
+@pytest.mark.parametrize('sample_by', [None, 'A'])
+def test_sample_interval_holds_full_count(conn, sample_by):
+    design = sampling.Sample(datalog.parse(QUERY), 0.3, sample_by, seed=0)
+    rules, catalog = design.rewrite(conn, datalog.Catalog(conn))
+    estimate = design.estimate(conn, rules, catalog)
+    nodes, edges = _full()
+    # A 95% interval: the seed is fixed
+    assert estimate.sampled_edges < edges
+    assert estimate.edges.low <= edges <= estimate.edges.high
+    if sample_by == 'A':
+        assert estimate.nodes.low <= nodes <= estimate.nodes.high
@@ -0,0 +1,141 @@
+# test_sharing.py
+# Tests for the rewriting of graph sets onto shared sub-joins.
+#
+# The rewritten programs are checked against the originals on PostgreSQL
+# when GRAPHGEN_TEST_DSN holds a libpq connection string, for example
+#
+#   GRAPHGEN_TEST_DSN="dbname=test user=postgres" python -m pytest tests
+#
+# The tables are created in a transaction that is rolled back.
+
+import os
+import random
+
+import pytest
+
+from graphgenpy import datalog
+from graphgenpy import sharing
+
+_nodes = 'Nodes(ID, Name) :- GT_Author(ID, Name).\n'
+
+CASES = {
+    'self-joins': {
+        'coauthor': _nodes + 'Edges(A, B) :- GT_AP(A, P), GT_AP(B, P).',
+        'covenue': _nodes + 'Edges(A, B) :- GT_AP(A, P), GT_Pub(P, C), GT_AP(B, Q), GT_Pub(Q, C).',
+        'authorvenue': 'Edges(A, C) :- GT_AP(A, P), GT_Pub(P, C).',
+    },
+    'constants': {
+        'coauthor2': _nodes + 'Edges(A, B) :- GT_AP(A, P), GT_AP(B, P), GT_Pub(P, 2).',
+        'authorpub2': 'Edges(A, P) :- GT_AP(A, P), GT_Pub(P, 2).',
+        'authorpub3': 'Edges(A, P) :- GT_AP(A, P), GT_Pub(P, 3).',
+    },
+    'spanning comparisons': {
+        'later': 'Edges(A, B) :- GT_AP(A, P), GT_Pub(P, C), GT_AP(B, Q), GT_Pub(Q, D), C < D, A != B.',
+        'authorvenue': 'Edges(A, C) :- GT_AP(A, P), GT_Pub(P, C).',
+        'early': 'Edges(A, C) :- GT_AP(A, P), GT_Pub(P, C), C <= 3.',
+    },
+    'overlapping groups': {
+        'authorname': 'Edges(A, N) :- GT_AP(A, P), GT_Pub(P, C), GT_Venue(C, N).',
+        'authorvenue': 'Edges(A, C) :- GT_AP(A, P), GT_Pub(P, C).',
+        'pubname': 'Edges(P, N) :- GT_Pub(P, C), GT_Venue(C, N).',
+    },
+}
+
+def _plan(case):
+    graphs = sharing.split_graphs(CASES[case])
+    shared, rewritten = sharing.plan_sharing(graphs)
+    return graphs, shared, rewritten
+
+def _reads_shared(rules):
+    return any(a.name.startswith('graphgen_shared_') for r in rules for a in r.atoms)
+
+##########################################################################
+# Plans
+##########################################################################
+
+def test_self_joins_share_each_side():
+    _, shared, rewritten = _plan('self-joins')
+    assert [str(s.rule) for s in shared] == ['graphgen_shared_0(A,P,C) :- GT_AP(A,P), GT_Pub(P,C).']
+    covenue = datalog.edge_rules(rewritten['covenue'])[0]
+    assert str(covenue) == 'Edges(A,B) :- graphgen_shared_0(A,P,C), graphgen_shared_0(B,Q,C).'
+    assert not _reads_shared(rewritten['coauthor'])
+
+def test_constants_are_part_of_the_group():
+    _, shared, rewritten = _plan('constants')
+    assert len(shared) == 1 and 'GT_Pub(P,2)' in str(shared[0].rule)
+    assert _reads_shared(rewritten['coauthor2']) and _reads_shared(rewritten['authorpub2'])
+    assert not _reads_shared(rewritten['authorpub3'])
+
+def test_spanning_comparisons_stay_in_the_rule():
+    graphs, _, rewritten = _plan('spanning comparisons')
+    later = datalog.edge_rules(rewritten['later'])[0]
+    assert later.comparisons == datalog.edge_rules(graphs['later'])[0].comparisons
+    assert not _reads_shared(rewritten['early'])
+
+def test_overlapping_groups_claim_atoms_once():
+    graphs, _, rewritten = _plan('overlapping groups')
+    for name in graphs:
+        rule = datalog.edge_rules(rewritten[name])[0]
+        shared = [a for a in rule.atoms if a.name.startswith('graphgen_shared_')]
+        assert len(shared) <= 1
+    assert _reads_shared(rewritten['authorname']) and _reads_shared(rewritten['authorvenue'])
+
+##########################################################################
+# Rewritten programs against the originals
+##########################################################################
+
+_tables = {
+    'gt_author': ('id integer', 'name text'),
+    'gt_ap': ('aid integer', 'pid integer'),
+    'gt_pub': ('id integer', 'cid integer'),
+    'gt_venue': ('id integer', 'name text'),
+}
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get('GRAPHGEN_TEST_DSN')
+    if not dsn:
+        pytest.skip('GRAPHGEN_TEST_DSN is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        for table, columns in _tables.items():
+            cursor.execute('CREATE TABLE %s (%s)' % (table, ', '.join(columns)))
+        rng = random.Random(0)
+        rows = {
+            'gt_author': [(i, 'author%d' % i) for i in range(30)],
+            'gt_pub': [(p, rng.randint(1, 5)) for p in range(60)],
+            # Repeated rows too: the graphs are sets either way
+            'gt_ap': [(rng.randrange(30), rng.randrange(60)) for _ in range(150)],
+            'gt_venue': [(c, 'venue%d' % c) for c in range(1, 6)],
+        }
+        for table, values in rows.items():
+            cursor.executemany('INSERT INTO %s VALUES (%%s, %%s)' % table, values)
+        cursor.close()
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+def _graph(conn, rules, columns):
+    compiled = datalog.compile_program(rules, columns)
+    graph = {}
+    cursor = conn.cursor()
+    for key, (sql, params) in compiled.items():
+        cursor.execute(sql, params)
+        graph[key] = sorted(cursor.fetchall())
+    cursor.close()
+    return graph
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_rewritten_programs_extract_the_same_graphs(conn, case):
+    graphs, shared, rewritten = _plan(case)
+    catalog = datalog.Catalog(conn)
+    expected = dict((name, _graph(conn, rules, catalog)) for name, rules in graphs.items())
+    sharing.create_shared(conn, shared, catalog)
+    columns = sharing.SharedCatalog(catalog, shared)
+    for name, rules in rewritten.items():
+        graph = _graph(conn, rules, columns)
+        assert graph == expected[name], name
+        assert graph['edges'], name
@@ -0,0 +1,119 @@
+# test_shm.py
+# Tests for graphs shared in memory: the attached views, and the reference
+# counting of the users, including processes that exited without
+# detaching.
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from graphgenpy import csr
+from graphgenpy import shm
+
+def _graph():
+    ids = np.array([2, 5, 7], dtype=np.int64)
+    return csr.from_edges(ids, np.array([0, 0, 2]), np.array([1, 2, 1]), {5: {'Name': u'x'}})
+
+@pytest.fixture
+def name(request):
+    name = 'test-%d-%s' % (os.getpid(), request.node.name.replace('[', '-').rstrip(']'))
+    yield name
+    # Do not leave segments behind when a test fails
+    if os.path.exists(shm.segment_path(name)):
+        os.unlink(shm.segment_path(name))
+
+def _dead_pid():
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    return child.pid
+
+def _slots(path):
+    with open(path, 'rb') as f:
+        f.seek(shm._header.size)
+        return list(shm._slots.unpack(f.read(shm._slots.size)))
+
+def _attach_and_exit(name):
+    # Attaches and exits without detaching
+    shm.attach(name)
+    os._exit(0)
+
+def test_attached_views_match(name):
+    graph = _graph()
+    with shm.publish(graph, name):
+        with shm.attach(name) as shared:
+            assert shared.graph.ids.tolist() == graph.ids.tolist()
+            assert sorted(shared.graph.to_networkx().edges()) == sorted(graph.to_networkx().edges())
+            assert dict(shared.graph.attrs) == {5: {'Name': u'x'}}
+            with pytest.raises(ValueError):
+                shared.arrays['neighbors'][0] = 0
+
+def test_last_user_removes_segment(name):
+    path = shm.segment_path(name)
+    published = shm.publish(_graph(), name)
+    first, second = shm.attach(name), shm.attach(name)
+    assert published.users() == 3
+    assert _slots(path)[:3] == [os.getpid()] * 3
+    # Detaching in any order, and twice, releases one slot each
+    published.detach()
+    published.detach()
+    assert first.users() == 2 and os.path.exists(path)
+    first.detach()
+    assert second.users() == 1
+    second.detach()
+    assert not os.path.exists(path)
+    with pytest.raises(IOError):
+        shm.attach(name)
+
+def test_slots_are_reused(name):
+    with shm.publish(_graph(), name) as published:
+        shm.attach(name).detach()
+        shared = shm.attach(name)
+        assert shared._slot == 1 and published.users() == 2
+        shared.detach()
+
+def test_stale_users_are_dropped(name):
+    path = shm.segment_path(name)
+    published = shm.publish(_graph(), name)
+    with open(path, 'r+b') as f:
+        shm._set_slot(f, 5, _dead_pid())
+    assert published.users() == 1
+    assert _slots(path)[5] == 0
+
+    # A process that attached and exited without detaching
+    child = multiprocessing.Process(target=_attach_and_exit, args=(name,))
+    child.start()
+    child.join()
+    assert _slots(path)[1] == child.pid
+    assert published.users() == 1
+    published.detach()
+    assert not os.path.exists(path)
+
+def test_publisher_exited(name):
+    path = shm.segment_path(name)
+    published = shm.publish(_graph(), name)
+    shared = shm.attach(name)
+    with open(path, 'r+b') as f:
+        shm._set_slot(f, 0, _dead_pid())
+    # The remaining user is the last one
+    published._file.close()
+    published._file = None
+    shared.detach()
+    assert not os.path.exists(path)
+
+def test_republish_abandoned_segment(name):
+    path = shm.segment_path(name)
+    published = shm.publish(_graph(), name)
+    with pytest.raises(ValueError):
+        shm.publish(_graph(), name)
+    # As if the publisher exited without detaching
+    with open(path, 'r+b') as f:
+        shm._set_slot(f, 0, _dead_pid())
+    published._file.close()
+    published._file = None
+    with shm.publish(_graph(), name) as again:
+        assert again.users() == 1
+    assert not os.path.exists(path)
@@ -0,0 +1,13 @@
+# test_sizing.py
+# Tests for the JVM heap sizing.
+
+from graphgenpy import sizing
+
+def test_collector_follows_heap():
+    assert sizing.jvm_options(2 ** 29, []) == ['-Xmx512m', '-XX:+UseSerialGC']
+    assert sizing.jvm_options(2 ** 32, []) == ['-Xmx4096m', '-XX:+UseParallelGC']
+
+def test_configured_collector_is_kept():
+    assert sizing.jvm_options(2 ** 29, ['-Xmx10G', '-XX:+UseG1GC']) == ['-Xmx512m']
+    # Other -XX flags do not select a collector
+    assert sizing.jvm_options(2 ** 29, ['-XX:+UseGCOverheadLimit', '-XX:-UseG1GC'])[1:] == ['-XX:+UseSerialGC']
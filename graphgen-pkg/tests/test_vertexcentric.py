@@ -0,0 +1,103 @@
+# test_vertexcentric.py
+# Tests for the vertex-centric (BSP) executor against brute-force results,
+# in the calling process and in a process pool.
+
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from graphgenpy import csr
+from graphgenpy import VertexCentric
+
+# Compute functions are defined at module level for the worker processes
+
+def degree(v, ctx):
+    v.value = v.degree()
+    ctx.vote_to_halt(v)
+
+def components(v, ctx):
+    if ctx.superstep == 0:
+        v.value = v.index
+        ctx.send_to_neighbors(v, v.index)
+    elif v.messages and min(v.messages) < v.value:
+        v.value = min(v.messages)
+        ctx.send_to_neighbors(v, v.value)
+    ctx.vote_to_halt(v)
+
+def hops(v, ctx):
+    # Hop distance from vertex 0; every message is delivered
+    if ctx.superstep == 0:
+        v.value = -1
+        if v.index == 0:
+            v.value = 0
+            ctx.send_to_neighbors(v, 1)
+    elif v.value < 0 and v.messages:
+        assert len(set(v.messages)) == 1
+        v.value = v.messages[0]
+        ctx.send_to_neighbors(v, v.value + 1)
+    ctx.vote_to_halt(v)
+
+def _random_graph(seed, n=40, m=60):
+    rng = random.Random(seed)
+    ids = np.array(sorted(rng.sample(range(1000), n)), dtype=np.int64)
+    sources = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    targets = np.array([rng.randrange(n) for _ in range(m)], dtype=np.int64)
+    return csr.from_edges(ids, sources, targets), list(zip(sources.tolist(), targets.tolist()))
+
+def _neighbors(n, edges, both):
+    adjacency = [set() for _ in range(n)]
+    for s, t in edges:
+        adjacency[s].add(t)
+        if both:
+            adjacency[t].add(s)
+    return adjacency
+
+def _bfs(adjacency, source):
+    dist, queue = {source: 0}, deque([source])
+    while queue:
+        v = queue.popleft()
+        for w in adjacency[v]:
+            if w not in dist:
+                dist[w] = dist[v] + 1
+                queue.append(w)
+    return dist
+
+CASES = [(seed, processes) for seed in range(3) for processes in (1, 2)]
+
+@pytest.mark.parametrize('seed, processes', CASES)
+def test_degree(tmpdir, seed, processes):
+    graph, edges = _random_graph(seed)
+    result = VertexCentric(graph, processes, partitions=5, directory=str(tmpdir)).run(degree)
+    # Out-neighbors as stored, parallel edges included
+    counts = np.bincount([s for s, _ in edges], minlength=graph.number_of_nodes())
+    assert result == dict(zip(graph.ids.tolist(), counts.astype(float).tolist()))
+
+@pytest.mark.parametrize('seed, processes', CASES)
+def test_components(tmpdir, seed, processes):
+    graph, edges = _random_graph(seed)
+    n = graph.number_of_nodes()
+    p = VertexCentric(graph, processes, direction='both', directory=str(tmpdir))
+    result = p.run(components, combiner='min')
+    adjacency = _neighbors(n, edges, both=True)
+    expected = [min(_bfs(adjacency, v)) for v in range(n)]
+    assert p.values.tolist() == expected
+    assert result == dict(zip(graph.ids.tolist(), map(float, expected)))
+
+@pytest.mark.parametrize('seed, processes', CASES)
+def test_messages_without_combiner(tmpdir, seed, processes):
+    graph, edges = _random_graph(seed, m=80)
+    n = graph.number_of_nodes()
+    p = VertexCentric(graph, processes, partitions=n + 3, directory=str(tmpdir))
+    p.run(hops)
+    dist = _bfs(_neighbors(n, edges, both=False), 0)
+    assert p.values.tolist() == [dist.get(v, -1) for v in range(n)]
+
+def test_max_supersteps(tmpdir):
+    graph, edges = _random_graph(0)
+    p = VertexCentric(graph, 1, direction='both', directory=str(tmpdir))
+    p.run(components, combiner='min', max_supersteps=1)
+    # Only the initial labels
+    assert p.values.tolist() == list(range(graph.number_of_nodes()))
+    assert not tmpdir.listdir()
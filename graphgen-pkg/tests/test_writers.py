@@ -0,0 +1,26 @@
+# test_writers.py
+# Tests for the GML writer: values read back with the types they had.
+
+import io
+
+import numpy as np
+
+from graphgenpy import readers
+from graphgenpy import writers
+
+def test_gml_numbers():
+    assert writers._gml_value(10) == '10'
+    assert writers._gml_value(np.int64(10)) == '10'
+    assert writers._gml_value(True) == '1'
+    assert writers._gml_value(2.5) == '2.5'
+    assert writers._gml_value(np.float32(0.5)) == '0.5'
+    assert writers._gml_value(3.0) == '3.0'
+
+def test_gml_round_trip():
+    attrs = {'Count': np.int64(1) << 40, 'Score': 0.1, 'Name': u'a "b" & c', 'Whole': 2.0}
+    out = io.StringIO()
+    writers.write_gml([readers.Node(1, attrs), readers.Node(2, {}), readers.Edge(1, 2, {'W': 3})], out)
+    records = list(readers.iter_gml(io.StringIO(out.getvalue())))
+    assert records[0] == readers.Node(1, {'Count': 1 << 40, 'Score': 0.1, 'Name': u'a "b" & c', 'Whole': 2.0})
+    assert type(records[0].attrs['Whole']) is float
+    assert records[2] == readers.Edge(1, 2, {'W': 3})